@@ -35,6 +35,7 @@ from cola.functions.budget import BudgetApplyServer, ALLFINISHED
 from cola.functions.speed import SpeedControlServer
 from cola.cluster.tracker import WorkerTracker, JobTracker
 from cola.cluster.stage import Stage
+from cola.cluster.weight import WeightCalculator
 from cola.core.rpc import FileTransportServer, FileTransportClient, \
                             client_call
 from cola.core.zip import ZipHandler
@@ -63,9 +64,9 @@ class JobMaster(object):
         
         self.inited = False
         self.lock = threading.Lock()
-        self.init()
-        
+        self.stopped = threading.Event()
         self.workers = workers
+        self.init()
             
     def _init_counter_server(self):
         counter_dir = os.path.join(self.working_dir, 'counter')
@@ -85,6 +86,36 @@ class JobMaster(object):
                                                rpc_server=self.rpc_server,
                                                app_name=self.job_name)
         
+    def _init_weight_service(self):
+        weighting = self.settings.job.weighting
+        if not weighting.enable or self.settings.job.placement == 'jump':
+            return
+        
+        self.weight_calculator = WeightCalculator(
+            self.counter_server, n_instances=self.settings.job.instances,
+            min_weight=weighting.min, change=weighting.change,
+            smoothing=weighting.smoothing)
+        
+        def run():
+            while not self.stopped.wait(weighting.interval):
+                self.push_weights()
+        self.weight_t = threading.Thread(target=run)
+        self.weight_t.setDaemon(True)
+        self.weight_t.start()
+        
+    def push_weights(self):
+        """
+        Calculate the weights of the workers, and push them to 
+        every worker if changed.
+        """
+        workers = list(self.workers)
+        weights = self.weight_calculator.calc(workers)
+        if weights is None:
+            return
+        for worker in workers:
+            client_call(worker, 'set_weights', self.job_name, weights, 
+                        ignore=True)
+        
     def init(self):
         with self.lock:
             if self.inited:
@@ -93,6 +124,7 @@ class JobMaster(object):
             self._init_counter_server()
             self._init_budget_server()
             self._init_speed_server()
+            self._init_weight_service()
 
             self.inited = True
                 
@@ -114,6 +146,13 @@ class JobMaster(object):
             client_call(node, 'add_node', worker)
         self.workers.append(worker)
         
+        # the weights of the other workers are kept by the new one
+        weights = getattr(self, 'weight_calculator', None) and \
+            self.weight_calculator.weights
+        if weights:
+            client_call(worker, 'set_weights', self.job_name, weights,
+                        ignore=True)
+        
     def has_worker(self, worker):
         return worker in self.workers
     
@@ -122,6 +161,7 @@ class JobMaster(object):
             if not self.inited:
                 return
 
+            self.stopped.set()
             self.counter_server.shutdown()
             self.budget_server.shutdown()
             self.speed_server.shutdown()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-29
+
+@author: chine
+'''
+
+from collections import defaultdict
+
+
+class WeightCalculator(object):
+    """
+    Calculate the weights of the workers for placing the mq objects
+    by their throughput.
+
+    The throughput of an instance is the pages processed per second of
+    its processing time, which comes from the ``pages`` and ``secs``
+    counters of the instance, so a worker is not weighted down just for
+    getting fewer objects. The rate of an instance is the exponential
+    moving average of its rates between the calculations, so the weights
+    do not jump, and it is kept if no page is processed since last time.
+    The weight of a worker is the sum of its instances' rates, and the
+    worker which has not reported yet is taken as ``n_instances``
+    instances of the mean rate.
+
+    The weights are normalized to the mean of 1, so the worker added
+    later gets the mean weight before its weight is calculated.
+    """
+    def __init__(self, counter_server, n_instances=1,
+                 min_weight=.2, change=.1, smoothing=.5):
+        """
+        :param counter_server: instance of
+               :class:`~cola.functions.counter.CounterServer`
+        :param n_instances: instances of a single worker
+        :param min_weight: the weight will not be less than it,
+               so that no worker is left out
+        :param change: the new weights are returned only if
+               one of them changes more than this ratio
+        :param smoothing: the weight of the latest rate in the moving average,
+               1 means only the latest rate is used
+        """
+        self.counter_server = counter_server
+        self.n_instances = n_instances
+        self.min_weight = min_weight
+        self.change = change
+        self.smoothing = smoothing
+
+        self.last_counts = {}
+        self.rates = {}
+        self.weights = {}
+
+    def _instance_rates(self):
+        """
+        :return: dict from the ip to the rates of its instances
+        """
+        counter = self.counter_server.inc_counter
+        rates = defaultdict(list)
+        for instance in counter.container.keys():
+            if '#' not in instance:
+                continue
+            pages = counter.get(instance, 'pages')
+            secs = counter.get(instance, 'secs')
+            if not pages or not secs:
+                continue
+
+            last_pages, last_secs = self.last_counts.get(instance, (0, 0))
+            if pages < last_pages or secs < last_secs:
+                # the counters are reset
+                last_pages, last_secs = 0, 0
+            if pages > last_pages and secs > last_secs:
+                self.last_counts[instance] = (pages, secs)
+                rate = (pages - last_pages) / float(secs - last_secs)
+                last_rate = self.rates.get(instance)
+                if last_rate is not None:
+                    rate = self.smoothing * rate + \
+                        (1 - self.smoothing) * last_rate
+                self.rates[instance] = rate
+
+        for instance, rate in self.rates.iteritems():
+            rates[instance.rsplit('#', 1)[0]].append(rate)
+        return rates
+
+    def _changed(self, weights):
+        if set(weights) != set(self.weights):
+            return True
+        for worker, weight in weights.iteritems():
+            old_weight = self.weights[worker]
+            if abs(weight - old_weight) > self.change * old_weight:
+                return True
+        return False
+
+    def calc(self, workers):
+        """
+        :param workers: the worker addresses as ``ip:port``
+        :return: dict from the worker to its weight, or None
+                 if the weights are not changed enough
+        """
+        if len(workers) == 0:
+            return
+
+        rates = self._instance_rates()
+        # the workers on the same ip share the counters
+        ip_workers = defaultdict(list)
+        for worker in workers:
+            ip_workers[worker.split(':', 1)[0]].append(worker)
+
+        weights = {}
+        for ip, ip_rates in rates.iteritems():
+            for worker in ip_workers.get(ip, []):
+                weights[worker] = sum(ip_rates) / len(ip_workers[ip])
+        if len(weights) == 0:
+            return
+
+        n_known = sum(len(rates[ip]) for ip in rates if ip in ip_workers)
+        mean_rate = sum(weights.itervalues()) / n_known
+        for worker in workers:
+            if worker not in weights:
+                weights[worker] = mean_rate * self.n_instances
+
+        mean_weight = sum(weights.itervalues()) / len(weights)
+        weights = dict((worker, round(max(weight / mean_weight, self.min_weight), 2)) \
+                       for worker, weight in weights.iteritems())
+        if not self._changed(weights):
+            return
+        self.weights = weights
+        return weights
@@ -81,6 +81,7 @@ class Worker(object):
                                               'pack_job_error')
             self.rpc_server.register_function(self.add_node, 'add_node')
             self.rpc_server.register_function(self.remove_node, 'remove_node')
+            self.rpc_server.register_function(self.set_weights, 'set_weights')
             self.rpc_server.register_function(self.shutdown, 'shutdown')
             
     def run(self):
@@ -193,6 +194,11 @@ class Worker(object):
         for job_info in self.running_jobs.values():
             job_info.job.remove_node(worker)
             
+    def set_weights(self, job_name, weights):
+        job_info = self.running_jobs.get(job_name)
+        if job_info:
+            job_info.job.set_weights(weights)
+            
     def shutdown(self):
         if not hasattr(self, '_t'):
             return
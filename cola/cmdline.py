@@ -26,11 +26,13 @@ from cola.commands.job import JobCommand
 from cola.commands.master import MasterCommand
 from cola.commands.worker import WorkerCommand
 from cola.commands.startproject import StartProjectCommand
+from cola.commands.mq import MessageQueueCommand
 
 def execute():
     parser = argparse.ArgumentParser(prog='coca')
     sub_parsers = parser.add_subparsers(help='sub-commands')
-    for command_cls in (JobCommand, MasterCommand, WorkerCommand, StartProjectCommand):
+    for command_cls in (JobCommand, MasterCommand, WorkerCommand, StartProjectCommand,
+                        MessageQueueCommand):
         command = command_cls()
         command.add_arguments(sub_parsers)
 
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-24
+
+@author: chine
+'''
+
+import os
+import time
+
+from cola.commands import Command
+from cola.core.mq.scanner import StoreScanner, find_store_dirs
+from cola.core.logs import get_logger
+
+class MessageQueueCommand(Command):
+    def __init__(self):
+        self.logger = get_logger('cola_mq_command')
+
+    def add_arguments(self, parser):
+        self.mq_parser = parser.add_parser('mq', help='message queue commands')
+        mq_sub_parsers = self.mq_parser.add_subparsers(help='mq sub-commands')
+        
+        self.inspect_parser = mq_sub_parsers.add_parser(
+            'inspect', help='inspect the mq stores in a directory without changing them')
+        self.inspect_parser.add_argument('path', metavar='directory', nargs=1,
+                                         help='a store directory, or the one containing stores like the job mq directory')
+        self.inspect_parser.add_argument('-n', '--hosts', metavar='count', type=int, default=10,
+                                         help='count of the top hosts to show')
+        self.inspect_parser.add_argument('-s', '--samples', metavar='count', type=int, default=5,
+                                         help='count of the records sampled to show')
+        self.inspect_parser.add_argument('-q', '--quick', action='store_true',
+                                         help='only count the messages by the file headers')
+        self.inspect_parser.add_argument('-c', '--verify', action='store_true',
+                                         help='check the crc32 of every record')
+        self.inspect_parser.add_argument('-d', '--decode', action='store_true',
+                                         help='decode the pickled records to find their hosts')
+        self.inspect_parser.set_defaults(func=self.inspect)
+        
+    def _format_object(self, obj):
+        if hasattr(obj, '__dict__'):
+            return '%s %r' % (obj.__class__.__name__, obj.__dict__)
+        return repr(obj)
+        
+    def _format_summary(self, summary):
+        lines = ['files: %(files)s, messages: %(messages)s, bytes: %(bytes)s' % summary]
+        if summary.get('types'):
+            lines.append('types: ' + ', '.join('%s=%s' % it for it in sorted(summary['types'].items())))
+        if summary.get('sizes'):
+            lines.append('sizes:')
+            lines.extend('    <= %-10s %s' % it for it in sorted(summary['sizes'].items()))
+        if summary.get('hosts'):
+            lines.append('top hosts:')
+            lines.extend('    %-40s %s' % it for it in summary['hosts'])
+        if summary.get('samples'):
+            lines.append('samples:')
+            lines.extend('    ' + self._format_object(obj) for obj in summary['samples'])
+        if summary.get('undecodable'):
+            lines.append('undecodable records: %s' % summary['undecodable'])
+        for file_path in summary['skipped']:
+            lines.append('skipped (old version or empty): %s' % file_path)
+        for file_path in summary.get('broken', []):
+            lines.append('broken: %s' % file_path)
+        return '\n'.join(lines)
+        
+    def inspect(self, args):
+        path = os.path.abspath(args.path[0])
+        if not os.path.isdir(path):
+            self.logger.error('directory does not exist: %s' % path)
+            return
+        
+        store_dirs = find_store_dirs(path)
+        if len(store_dirs) == 0:
+            self.logger.info('no mq stores found under %s' % path)
+            return
+        
+        for store_dir in store_dirs:
+            start = time.time()
+            scanner = StoreScanner(store_dir, verify=args.verify)
+            if args.quick:
+                summary = scanner.count()
+            else:
+                summary = scanner.summarize(n_hosts=args.hosts, n_samples=args.samples,
+                                            decode=args.decode)
+            self.logger.info('====> store: %s, scanned in %.2fs\n%s' % \
+                             (os.path.relpath(store_dir, path) if store_dir != path else store_dir,
+                              time.time() - start, self._format_summary(summary)))
+            
+    def run(self, args):
+        self.inspect(args)
@@ -32,7 +32,8 @@ from cola.core.config import Config
 from cola.core.utils import get_ip, import_job_desc, Clock
 from cola.core.logs import get_logger
 from cola.core.mq import MessageQueue
-from cola.core.dedup import FileBloomFilterDeduper, MapDeduper
+from cola.core.dedup import FileBloomFilterDeduper, MapDeduper, \
+    FingerprintDeduper, TTLBloomFilterDeduper
 from cola.core.rpc import ThreadedColaRPCServer, client_call
 from cola.core.zip import ZipHandler
 from cola.functions.budget import BudgetApplyServer
@@ -52,6 +53,8 @@ class ContextManager(multiprocessing.managers.SyncManager):
 
 ContextManager.register('FileBloomFilterDeduper', FileBloomFilterDeduper)
 ContextManager.register('MapDeduper', MapDeduper)
+ContextManager.register('FingerprintDeduper', FingerprintDeduper)
+ContextManager.register('TTLBloomFilterDeduper', TTLBloomFilterDeduper)
 ContextManager.register('mq', MessageQueue)
 ContextManager.register('budget_server', BudgetApplyServer)
 ContextManager.register('speed_server', SpeedControlServer)
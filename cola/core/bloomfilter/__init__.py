@@ -27,12 +27,23 @@ Uses SHA-1 from Python's hashlib, but you can swap that out with any other
 160-bit hash function. Also keep in mind that it starts off very sparse and
 become more dense (and false-positive-prone) as you add more elements.
 
+The bits are kept in a bytearray, and the positions are generated
+by the double hashing from a single digest, i.e. ``h1 + i * h2``.
+The filters saved by the old versions kept the bits in a single long
+and chopped the hex digest for the positions, they are converted
+to the bytearray when loaded and keep hashing in the old way.
+
 Modified from part of python-hashes by sangelone.
 """
 
 import math
 import hashlib
 import os
+import struct
+import binascii
+import mmap
+import fcntl
+import threading
 try:
     import cPickle as pickle
 except ImportError:
@@ -40,6 +51,45 @@ except ImportError:
 
 from cola.core.bloomfilter.hashtype import HashType
 
+# the positions of the legacy filters are from the SHA-1 hex digests,
+# the double hashing ones are from the SHA-1 digest,
+# and the digest ones are from the md5 digest which can be precomputed,
+# refer to :attr:`cola.core.unit.Unit.fingerprint`
+HASH_LEGACY, HASH_DOUBLE, HASH_DIGEST = range(3)
+
+
+def long_to_bits(num, size):
+    """
+    Convert the bits kept in a long to a bytearray of the size,
+    the bit ``i`` of the long is the bit ``i % 8`` of the byte ``i / 8``.
+    """
+    hex_str = '%x' % num
+    if len(hex_str) % 2:
+        hex_str = '0' + hex_str
+    bytes_ = binascii.unhexlify(hex_str)[::-1]
+    bits = bytearray(size)
+    bits[:min(len(bytes_), size)] = bytes_[:size]
+    return bits
+
+def bits_to_long(bits):
+    hex_str = binascii.hexlify(str(bits)[::-1])
+    return long(hex_str, 16) if hex_str else 0L
+
+# the byte is translated into the count of its bits set
+POPCOUNT_TABLE = ''.join(chr(bin(i).count('1')) for i in range(256))
+POPCOUNT_CHUNK_SIZE = 1 << 20
+
+def count_bits(bits, start=0):
+    """
+    Count the bits set of the bytearray, string or mmap from ``start``,
+    by the chunks, so the memory used is bounded.
+    """
+    n = 0
+    for i in xrange(start, len(bits), POPCOUNT_CHUNK_SIZE):
+        counts = str(bits[i:i+POPCOUNT_CHUNK_SIZE]).translate(POPCOUNT_TABLE)
+        n += sum(counts.count(chr(c)) * c for c in xrange(1, 9))
+    return n
+
 
 class BloomFilter(HashType):
     def __init__(self, value='', capacity=3000, false_positive_rate=0.01):
@@ -48,6 +98,7 @@ class BloomFilter(HashType):
         'capacity' is the expected upper limit on items inserted, and
         'false_positive_rate' is self-explanatory but the smaller it is, the larger your hashes!
         """
+        self.hash_version = HASH_DIGEST
         self.create_hash(value, capacity, false_positive_rate)
 
     def create_hash(self, initial, capacity, error):
@@ -57,8 +108,8 @@ class BloomFilter(HashType):
 
         Reference material: http://bitworking.org/news/380/bloom-filter-resources
         """
-        self.hash = 0L
         self.hashbits, self.num_hashes = self._optimal_size(capacity, error)
+        self.bits = bytearray((self.hashbits + 7) / 8)
 
         if len(initial):
             if type(initial) == str:
@@ -67,7 +118,35 @@ class BloomFilter(HashType):
                 for t in initial:
                     self.add(t)
     
-    def _hashes(self, item):
+    def _get_hash(self):
+        return bits_to_long(self.bits)
+    
+    def _set_hash(self, hash_):
+        self.bits = long_to_bits(hash_, len(self.bits))
+        
+    # the bits as a long, only for compatibility
+    hash = property(_get_hash, _set_hash)
+    
+    def _hashes(self, item, digest=None):
+        """
+        Double hashing, the two 64 bit values from the md5 hash
+        of the string generate the ``num_hashes`` positions.
+        
+        :param digest: the md5 digest of the item if computed,
+               only used by the filters of ``HASH_DIGEST`` version
+        """
+        if self.hash_version == HASH_LEGACY:
+            return self._legacy_hashes(item)
+        
+        if self.hash_version == HASH_DOUBLE:
+            digest = hashlib.sha1(item).digest()
+        elif digest is None:
+            digest = hashlib.md5(item).digest()
+        h1, h2 = struct.unpack_from('<QQ', digest)
+        m = self.hashbits
+        return [(h1 + i * h2) % m for i in xrange(self.num_hashes)]
+    
+    def _legacy_hashes(self, item):
         """
         To create the hash functions we use the SHA-1 hash of the
         string and chop that up into 20 bit values and then
@@ -98,47 +177,121 @@ class BloomFilter(HashType):
         return (int(m), int(k))
 
     
-    def add(self, item):
+    def add(self, item, digest=None):
         "Add an item (string) to the filter. Cannot be removed later!"
-        for pos in self._hashes(item):
-            self.hash |= (2 ** pos)
+        bits = self.bits
+        for pos in self._hashes(item, digest=digest):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def contains(self, name, digest=None):
+        bits = self.bits
+        for pos in self._hashes(name, digest=digest):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
 
     def __contains__(self, name):
         "This function is used by the 'in' keyword"
-        retval = True
-        for pos in self._hashes(name):
-            retval = retval and bool(self.hash & (2 ** pos))
-        return retval
+        return self.contains(name)
+    
+    def fill_ratio(self):
+        """
+        The ratio of the bits set.
+        """
+        return self.exact_fill_ratio()
+    
+    def exact_fill_ratio(self):
+        """
+        The ratio of the bits set, counted by all the bits.
+        """
+        return count_bits(self.bits) / float(self.hashbits)
+    
+    def estimated_false_positive_rate(self):
+        """
+        The false positive rate estimated by the bits set,
+        it grows above the expected one when overfilled.
+        """
+        return self.fill_ratio() ** self.num_hashes
+    
+    def verify(self, item, digest=None):
+        """
+        Add the item, and tell if it existed before, the positions
+        are only computed once.
+        """
+        bits = self.bits
+        exists = True
+        for pos in self._hashes(item, digest=digest):
+            idx, mask = pos >> 3, 1 << (pos & 7)
+            if not bits[idx] & mask:
+                exists = False
+                bits[idx] |= mask
+        return exists
 
 
 class BloomFilterFileDamage(Exception): pass
 
 
+def load_status(filename):
+    """
+    Load the status saved by :class:`FileBloomFilter`.
+    
+    :return: ``(capacity, false_positive_rate, bits, hash_version)``
+    """
+    with open(filename, 'rb') as f:
+        status = pickle.load(f)
+    if len(status) == 3:
+        # the bits kept in a long by the old versions
+        capacity, false_positive_rate, hash_ = status
+        bloom_filter = BloomFilter(capacity=capacity, 
+                                   false_positive_rate=false_positive_rate)
+        return capacity, false_positive_rate, \
+            long_to_bits(hash_, len(bloom_filter.bits)), HASH_LEGACY
+    capacity, false_positive_rate, bits, hash_version = status
+    return capacity, false_positive_rate, bytearray(bits), hash_version
+
+def dump_status(f, capacity, false_positive_rate, bits, hash_version):
+    pickle.dump((capacity, false_positive_rate, str(bits), hash_version), 
+                f, pickle.HIGHEST_PROTOCOL)
+
+def convert_file(filename):
+    """
+    Convert the file saved by the old versions, the filter keeps
+    hashing in the old way after converted.
+    
+    :return: True if converted
+    """
+    with open(filename, 'rb') as f:
+        if len(pickle.load(f)) != 3:
+            return False
+    
+    status = load_status(filename)
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        dump_status(f, *status)
+    os.rename(tmp_filename, filename)
+    return True
+
+
 class FileBloomFilter(BloomFilter):
     def __init__(self, filename, capacity, false_positive_rate=0.01):
         """
         A wrapper for :class:`~cola.core.bloomfilter.BloomFilter` with file persistence.
         When started, it will load the bits from file, at the same time,
         when shutdown, the bits will be saved into a file.
+        
+        The filter loaded never grows, the capacity and false positive rate
+        saved are kept even if the ones given are larger or smaller, 
+        since the bits set cannot be moved into a larger filter, 
+        use :class:`ScalableBloomFilter` to add more filters when full.
         """
         if os.path.exists(filename) and os.path.getsize(filename) > 0:
-            with open(filename) as f:
-                old_capcity, old_false_rate, hash_ = pickle.load(f)
-                    
-                if capacity > old_capcity or \
-                    false_positive_rate < old_false_rate:
-                    del hash_
-                    self.capacity, self.false_positive_rate = \
-                        capacity, false_positive_rate
-                else:
-                    self.capacity = old_capcity
-                    self.false_positive_rate = old_false_rate
-                
-                super(FileBloomFilter, self).__init__(
-                    capacity=self.capacity,
-                    false_positive_rate=self.false_positive_rate)
-                if 'hash_' in locals():
-                    self.hash = hash_
+            self.capacity, self.false_positive_rate, bits, hash_version = \
+                load_status(filename)
+            super(FileBloomFilter, self).__init__(
+                capacity=self.capacity,
+                false_positive_rate=self.false_positive_rate)
+            self.bits = bits
+            self.hash_version = hash_version
         else:
             self.capacity = capacity
             self.false_positive_rate = false_positive_rate
@@ -149,17 +302,15 @@ class FileBloomFilter(BloomFilter):
         dirname = os.path.dirname(filename)
         if not os.path.exists(dirname):
             os.makedirs(dirname)
-        self.f = open(filename, 'w+')
+        # keep the content until synced
+        self.f = open(filename, 'r+b' if os.path.exists(filename) else 'w+b')
         
-    def verify(self, item):
-        exists = item in self
-        if not exists:
-            self.add(item)
-        return exists
-    
     def sync(self):
-        pickle.dump((self.capacity, self.false_positive_rate, self.hash), 
-                    self.f)
+        self.f.seek(0)
+        self.f.truncate()
+        dump_status(self.f, self.capacity, self.false_positive_rate, 
+                    self.bits, self.hash_version)
+        self.f.flush()
     
     def close(self):
         self.f.close()
@@ -169,3 +320,402 @@ class FileBloomFilter(BloomFilter):
     
     def __exit__(self, type_, value, traceback):
         self.close()
+
+
+MMAP_MAGIC = 'CLBF'
+MMAP_VERSION = 1
+# ``<magic><version><hash version><padding><capacity>
+# <false positive rate><bits count><hashes count>``,
+# and the count of the items added at ``MMAP_COUNT_POS``
+MMAP_HEADER_FORMAT = '<4sBB2xQdQI'
+MMAP_COUNT_FORMAT = '<Q'
+MMAP_COUNT_POS = 40
+MMAP_HEADER_SIZE = 64
+DEFAULT_SYNC_INTERVAL = 5 # seconds
+
+
+class MmapBloomFilter(BloomFilter):
+    def __init__(self, filename, capacity, false_positive_rate=0.01,
+                 sync_interval=DEFAULT_SYNC_INTERVAL, legacy_filename=None):
+        """
+        The Bloom filter whose bits live in a file mapped by ``mmap``,
+        the processes which open the same file share the bits directly,
+        and the bits are persisted once set, even if the process crashes.
+        
+        The file is created completely before renamed to the filename,
+        so a half created file will never be opened. Only the writes are
+        locked across the processes, the bits are checked without lock.
+        
+        The existing file is never rewritten, since the bits set would be
+        lost and the file may have been mapped by the other processes,
+        so its capacity and false positive rate are kept even if the
+        configured ones are larger or smaller, use :class:`ScalableBloomFilter`
+        to add more filters when full.
+        
+        :param filename: the file to map
+        :param capacity: the capacity of the filter created,
+               ignored if the file exists
+        :param false_positive_rate: the false positive rate of the filter 
+               created, ignored if the file exists
+        :param sync_interval: seconds between the ``msync``, 0 means
+               never except closed
+        :param legacy_filename: the status file saved by 
+               :class:`FileBloomFilter`, the bits will be imported with
+               its capacity and false positive rate if the filename does not exist
+        """
+        self.filename = filename
+        self.sync_interval = sync_interval
+        
+        if os.path.exists(filename):
+            pass
+        elif legacy_filename is not None and os.path.exists(legacy_filename) \
+            and os.path.getsize(legacy_filename) > 0:
+            old_capacity, old_false_rate, bits, hash_version = \
+                load_status(legacy_filename)
+            self._create(old_capacity, old_false_rate, 
+                         bits=bits, hash_version=hash_version)
+        else:
+            self._create(capacity, false_positive_rate)
+            
+        self._open()
+        
+    def _read_header(self):
+        with open(self.filename, 'rb') as f:
+            header = f.read(MMAP_HEADER_SIZE)
+        if len(header) < MMAP_HEADER_SIZE:
+            raise BloomFilterFileDamage('Incomplete header of %s' % self.filename)
+        magic, version, hash_version, capacity, false_positive_rate, \
+            hashbits, _ = struct.unpack_from(MMAP_HEADER_FORMAT, header)
+        if magic != MMAP_MAGIC or version != MMAP_VERSION:
+            raise BloomFilterFileDamage('Unknown file: %s' % self.filename)
+        if os.path.getsize(self.filename) != MMAP_HEADER_SIZE + (hashbits + 7) / 8:
+            raise BloomFilterFileDamage('Size of %s does not match' % self.filename)
+        return capacity, false_positive_rate, hash_version
+    
+    def _create(self, capacity, false_positive_rate, bits=None, 
+                hash_version=HASH_DIGEST):
+        hashbits, num_hashes = self._optimal_size(capacity, false_positive_rate)
+        size = (hashbits + 7) / 8
+        count = 0
+        if bits is not None:
+            bits = bits[:size]
+            count = self._estimate_count(count_bits(bits), hashbits, 
+                                         num_hashes, capacity)
+        
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp_filename = '%s.%s.tmp' % (self.filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            header = bytearray(MMAP_HEADER_SIZE)
+            struct.pack_into(MMAP_HEADER_FORMAT, header, 0, MMAP_MAGIC, 
+                             MMAP_VERSION, hash_version, capacity, 
+                             false_positive_rate, hashbits, num_hashes)
+            struct.pack_into(MMAP_COUNT_FORMAT, header, MMAP_COUNT_POS, count)
+            f.write(str(header))
+            if bits is not None:
+                f.write(str(bits))
+            f.truncate(MMAP_HEADER_SIZE + size)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_filename, self.filename)
+        
+    def _estimate_count(self, n_set_bits, hashbits, num_hashes, capacity):
+        """
+        The count of the items imported is unknown, so it's estimated
+        by the bits set, i.e. ``-m / k * ln(1 - X / m)``.
+        """
+        if n_set_bits >= hashbits:
+            return capacity
+        return int(round(-float(hashbits) / num_hashes * \
+                         math.log(1 - float(n_set_bits) / hashbits)))
+        
+    def _open(self):
+        self.capacity, self.false_positive_rate, self.hash_version = \
+            self._read_header()
+        self.hashbits, self.num_hashes = self._optimal_size(
+            self.capacity, self.false_positive_rate)
+        
+        self.f = open(self.filename, 'r+b')
+        self.m = mmap.mmap(self.f.fileno(), 0)
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        
+        self.stopped = threading.Event()
+        self.sync_t = None
+        if self.sync_interval > 0:
+            self.sync_t = threading.Thread(target=self._sync_periodically)
+            self.sync_t.setDaemon(True)
+            self.sync_t.start()
+            
+    def _sync_periodically(self):
+        while not self.stopped.wait(self.sync_interval):
+            self.sync()
+            
+    def _check_process(self):
+        # the file lock is shared with the parent if forked,
+        # so the file is opened again
+        if os.getpid() != self.pid:
+            self.sync_interval = 0
+            self._open()
+            
+    def _positions(self, item, digest=None):
+        return [(MMAP_HEADER_SIZE + (pos >> 3), 1 << (pos & 7)) \
+                for pos in self._hashes(item, digest=digest)]
+        
+    @property
+    def count(self):
+        """
+        The count of the items added.
+        """
+        return struct.unpack_from(MMAP_COUNT_FORMAT, self.m, MMAP_COUNT_POS)[0]
+    
+    def fill_ratio(self):
+        """
+        The ratio of the bits set estimated by the count of the items,
+        i.e. ``1 - exp(-k * n / m)``, so the bits are not walked,
+        refer to :func:`exact_fill_ratio` to count them.
+        """
+        return 1 - math.exp(-float(self.num_hashes) * self.count / self.hashbits)
+    
+    def exact_fill_ratio(self):
+        return count_bits(self.m, start=MMAP_HEADER_SIZE) / float(self.hashbits)
+        
+    def _get_bits(self):
+        return bytearray(self.m[MMAP_HEADER_SIZE:])
+    
+    def _set_bits(self, bits):
+        self.m[MMAP_HEADER_SIZE:] = str(bits)
+        
+    bits = property(_get_bits, _set_bits)
+        
+    def contains(self, item, digest=None):
+        m = self.m
+        for idx, mask in self._positions(item, digest=digest):
+            if not ord(m[idx]) & mask:
+                return False
+        return True
+    
+    def __contains__(self, item):
+        return self.contains(item)
+    
+    def add(self, item, digest=None):
+        self.verify(item, digest=digest)
+    
+    def verify(self, item, digest=None):
+        self._check_process()
+        
+        positions = self._positions(item, digest=digest)
+        m = self.m
+        if all(ord(m[idx]) & mask for idx, mask in positions):
+            return True
+        
+        with self.lock:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+            try:
+                exists = True
+                for idx, mask in positions:
+                    byte = ord(m[idx])
+                    if not byte & mask:
+                        exists = False
+                        m[idx] = chr(byte | mask)
+                if not exists:
+                    struct.pack_into(MMAP_COUNT_FORMAT, m, MMAP_COUNT_POS,
+                                     self.count + 1)
+                return exists
+            finally:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+            
+    def sync(self):
+        with self.lock:
+            if not self.stopped.is_set():
+                self.m.flush()
+    
+    def close(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.sync_t is not None and self.pid == os.getpid():
+            self.sync_t.join()
+        
+        with self.lock:
+            self.m.flush()
+            self.m.close()
+            self.f.close()
+            
+    def __getstate__(self):
+        return {'filename': self.filename, 'capacity': self.capacity,
+                'false_positive_rate': self.false_positive_rate}
+        
+    def __setstate__(self, state):
+        # the process which created the filter takes charge of the msync
+        self.__init__(state['filename'], state['capacity'], 
+                      false_positive_rate=state['false_positive_rate'],
+                      sync_interval=0)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+
+DEFAULT_GROWTH = 2
+DEFAULT_TIGHTENING = 0.5
+
+
+class ScalableBloomFilter(object):
+    def __init__(self, filename, capacity, false_positive_rate=0.01,
+                 growth=DEFAULT_GROWTH, tightening=DEFAULT_TIGHTENING,
+                 sync_interval=DEFAULT_SYNC_INTERVAL, legacy_filename=None):
+        """
+        A chain of :class:`MmapBloomFilter`, once the last filter is full,
+        a new one with ``growth`` times of the capacity and ``tightening``
+        times of the false positive rate will be appended, so the
+        false positive rate of the whole chain is kept under the expected
+        one however many items are added.
+        
+        The first filter is mapped from the filename, so the file of
+        :class:`MmapBloomFilter` can be reused, and the following ones
+        are mapped from ``<filename>.<index>``. The existing filters are
+        always kept as they are, the capacity and false positive rate
+        only work for the ones created.
+        
+        :param filename: the file of the first filter
+        :param capacity: the capacity of the first filter
+        :param false_positive_rate: the expected rate of the whole chain
+        :param growth: the capacity ratio of a filter to the previous one
+        :param tightening: the false positive rate ratio of a filter 
+               to the previous one, must be in (0, 1)
+        :param sync_interval: refer to :class:`MmapBloomFilter`
+        :param legacy_filename: refer to :class:`MmapBloomFilter`
+        """
+        if not 0 < tightening < 1:
+            raise ValueError('tightening must be in (0, 1)')
+        self.filename = filename
+        self.false_positive_rate = false_positive_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.sync_interval = sync_interval
+        
+        if os.path.exists(filename):
+            first = MmapBloomFilter(filename, None, sync_interval=sync_interval)
+        else:
+            first = MmapBloomFilter(filename, capacity, 
+                                    false_positive_rate=self._false_positive_rate(0),
+                                    sync_interval=sync_interval,
+                                    legacy_filename=legacy_filename)
+        self.filters = [first, ]
+        self._load()
+        
+        self.lock = threading.Lock()
+        self.pid = None
+        self.lock_f = None
+        
+    def _false_positive_rate(self, idx):
+        # the sum of the rates is less than the expected one
+        return self.false_positive_rate * (1 - self.tightening) \
+            * self.tightening ** idx
+        
+    def _get_filename(self, idx):
+        if idx == 0:
+            return self.filename
+        return '%s.%s' % (self.filename, idx)
+    
+    def _load(self):
+        while os.path.exists(self._get_filename(len(self.filters))):
+            self.filters.append(MmapBloomFilter(
+                self._get_filename(len(self.filters)), None, 
+                sync_interval=self.sync_interval))
+            
+    def _grow(self):
+        # the filter is appended by only one of the processes
+        if self.pid != os.getpid():
+            self.lock_f = open(self.filename + '.lock', 'a+')
+            self.pid = os.getpid()
+        fcntl.flock(self.lock_f.fileno(), fcntl.LOCK_EX)
+        try:
+            self._load()
+            last = self.filters[-1]
+            if last.count >= last.capacity:
+                idx = len(self.filters)
+                self.filters.append(MmapBloomFilter(
+                    self._get_filename(idx), 
+                    self.filters[0].capacity * self.growth ** idx,
+                    false_positive_rate=self._false_positive_rate(idx),
+                    sync_interval=self.sync_interval))
+            return self.filters[-1]
+        finally:
+            fcntl.flock(self.lock_f.fileno(), fcntl.LOCK_UN)
+        
+    def contains(self, item, digest=None):
+        return any(bf.contains(item, digest=digest) for bf in self.filters)
+    
+    def __contains__(self, item):
+        return self.contains(item)
+    
+    def add(self, item, digest=None):
+        self.verify(item, digest=digest)
+    
+    def verify(self, item, digest=None):
+        last = self.filters[-1]
+        for bf in self.filters[:-1]:
+            if bf.contains(item, digest=digest):
+                return True
+        
+        if last.count >= last.capacity:
+            with self.lock:
+                last = self._grow()
+                for bf in self.filters[:-1]:
+                    if bf.contains(item, digest=digest):
+                        return True
+        return last.verify(item, digest=digest)
+    
+    def stats(self):
+        """
+        :return: dict of the ``filters``, ``capacity``, ``count``, 
+                 ``fill_ratio`` of all the bits, and ``false_positive_rate``
+                 of the chain, both estimated by the counts of the items
+        """
+        filters = list(self.filters)
+        n_set_bits = n_bits = 0
+        not_false_positive = 1.0
+        for bf in filters:
+            fill_ratio = bf.fill_ratio()
+            n_set_bits += fill_ratio * bf.hashbits
+            n_bits += bf.hashbits
+            not_false_positive *= 1 - fill_ratio ** bf.num_hashes
+        return {'filters': len(filters),
+                'capacity': sum(bf.capacity for bf in filters),
+                'count': sum(bf.count for bf in filters),
+                'fill_ratio': n_set_bits / n_bits,
+                'false_positive_rate': 1 - not_false_positive}
+    
+    def sync(self):
+        for bf in self.filters:
+            bf.sync()
+            
+    def close(self):
+        for bf in self.filters:
+            bf.close()
+        if self.lock_f is not None:
+            self.lock_f.close()
+            
+    def __getstate__(self):
+        return {'filename': self.filename, 
+                'capacity': self.filters[0].capacity,
+                'false_positive_rate': self.false_positive_rate,
+                'growth': self.growth, 'tightening': self.tightening}
+        
+    def __setstate__(self, state):
+        # the process which created the filter takes charge of the msync
+        self.__init__(state['filename'], state['capacity'], 
+                      false_positive_rate=state['false_positive_rate'],
+                      growth=state['growth'], tightening=state['tightening'],
+                      sync_interval=0)
+            
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type_, value, traceback):
+        self.close()
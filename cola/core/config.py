@@ -64,7 +64,8 @@ class PropertyObject(dict):
         if isinstance(v, dict):
             v = PropertyObject(v)
         elif isinstance(v, list):
-            v = [PropertyObject(itm) for itm in v]
+            v = [PropertyObject(itm) if isinstance(itm, dict) else itm \
+                 for itm in v]
         
         if k not in self or type(self[k]) != type(v):
             self[k] = v
@@ -21,23 +21,90 @@ Created on 2013-8-29
 '''
 
 import os
+import re
+import bisect
+import hashlib
+import heapq
+import struct
+import threading
+import time
+from array import array
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
-from cola.core.bloomfilter import FileBloomFilter
+from cola.core.bloomfilter import FileBloomFilter, MmapBloomFilter, \
+    ScalableBloomFilter, DEFAULT_SYNC_INTERVAL, DEFAULT_GROWTH, \
+    DEFAULT_TIGHTENING
 
 BLOOM_FILETER_STATUS_FILENAME = 'dedup.bloomfilter.status'
+MMAP_BLOOM_FILTER_FILENAME = 'dedup.bloomfilter.mmap'
 MAP_DEDUP_STATUS_FILENAME = 'dedup.map.status'
+FINGERPRINT_RUN_FILENAME_PREFIX = 'dedup.fingerprint.'
+FINGERPRINT_RUN_FILENAME_REGEX = re.compile(r'^dedup\.fingerprint\.(\d+)$')
+FINGERPRINT_LOG_FILENAME = 'dedup.fingerprint.log'
+FINGERPRINT_TMP_SUFFIX = '.tmp'
+TTL_BLOOM_FILTER_FILENAME_PREFIX = 'dedup.ttl.'
+TTL_BLOOM_FILTER_FILENAME_REGEX = re.compile(r'^dedup\.ttl\.(\d+)(\..+)?$')
+DEFAULT_TTL = 24 * 60 * 60 # seconds
+DEFAULT_TTL_GENERATIONS = 6
+FINGERPRINT_FORMAT = '=Q'
+FINGERPRINT_SIZE = struct.calcsize(FINGERPRINT_FORMAT)
+# the array of 64-bit unsigned integers, 'Q' is not supported by Python 2
+FINGERPRINT_TYPECODE = 'L' if array('L').itemsize == FINGERPRINT_SIZE else 'Q'
+
+def fingerprint(key, digest=None):
+    """
+    The 64-bit fingerprint of the key.
+    
+    :param digest: the md5 digest of the key if computed
+    """
+    if digest is None:
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        digest = hashlib.md5(key).digest()
+    return struct.unpack_from(FINGERPRINT_FORMAT, digest)[0]
 
 class Deduper(object):
+    # if True, the deduper can be used by multiple processes directly,
+    # else the proxy of the manager will be used under multi-process mode
+    process_shared = False
+    
     def __init__(self, working_dir, *args, **kwargs):
         self.working_dir = working_dir
     
     def exist(self, key):
         raise NotImplementedError
     
+    def exist_many(self, keys):
+        """
+        Check a batch of keys, a single call for all the keys
+        even if the deduper is a proxy of the manager.
+        
+        :return: list of the results of :func:`exist` in order
+        """
+        return [self.exist(key) for key in keys]
+    
+    def exist_digests(self, keys, digests):
+        """
+        Like :func:`exist_many`, the ``digests`` are the md5 digests
+        of the keys computed before, refer to 
+        :attr:`~cola.core.unit.Unit.fingerprint`, the dedupers hashing 
+        by md5 reuse them instead of hashing the keys again.
+        
+        :param digests: list of the digests, None if not computed
+        """
+        return self.exist_many(keys)
+    
+    def stats(self):
+        """
+        The health of the deduper which will be exported to the counter,
+        like the ``fill_ratio`` and the ``false_positive_rate``
+        of the Bloom filter.
+        """
+        return {}
+    
     def shutdown(self):
         pass
     
@@ -54,6 +121,18 @@ class FileBloomFilterDeduper(Deduper):
     def exist(self, key):
         return self.filter.verify(key)
     
+    def exist_many(self, keys):
+        verify = self.filter.verify
+        return [verify(key) for key in keys]
+    
+    def exist_digests(self, keys, digests):
+        verify = self.filter.verify
+        return [verify(key, digest=digest) for key, digest in zip(keys, digests)]
+    
+    def stats(self):
+        return {'fill_ratio': self.filter.fill_ratio(),
+                'false_positive_rate': self.filter.estimated_false_positive_rate()}
+    
     def shutdown(self):
         if self.is_shutdown is True:
             return
@@ -67,6 +146,193 @@ class FileBloomFilterDeduper(Deduper):
     def __del__(self):
         self.shutdown()
         
+class MmapBloomFilterDeduper(Deduper):
+    process_shared = True
+    
+    def __init__(self, working_dir, capacity, false_positive_rate=0.01,
+                 sync_interval=DEFAULT_SYNC_INTERVAL):
+        super(MmapBloomFilterDeduper, self).__init__(working_dir)
+        filename = os.path.join(self.working_dir, MMAP_BLOOM_FILTER_FILENAME)
+        # the status left by the FileBloomFilterDeduper is imported
+        legacy_filename = os.path.join(self.working_dir, 
+                                       BLOOM_FILETER_STATUS_FILENAME)
+        
+        self.filter = MmapBloomFilter(filename, capacity, 
+                                      false_positive_rate=false_positive_rate,
+                                      sync_interval=sync_interval,
+                                      legacy_filename=legacy_filename)
+        self.is_shutdown = False
+        
+    def exist(self, key):
+        return self.filter.verify(key)
+    
+    def exist_many(self, keys):
+        verify = self.filter.verify
+        return [verify(key) for key in keys]
+    
+    def exist_digests(self, keys, digests):
+        verify = self.filter.verify
+        return [verify(key, digest=digest) for key, digest in zip(keys, digests)]
+    
+    def stats(self):
+        return {'count': self.filter.count,
+                'fill_ratio': self.filter.fill_ratio(),
+                'false_positive_rate': self.filter.estimated_false_positive_rate()}
+    
+    def shutdown(self):
+        if self.is_shutdown is True:
+            return
+        self.is_shutdown = True
+        
+        self.filter.close()
+        
+    def __del__(self):
+        self.shutdown()
+        
+class ScalableBloomFilterDeduper(MmapBloomFilterDeduper):
+    """
+    The Bloom filter grows when the items exceed the capacity,
+    the file of :class:`MmapBloomFilterDeduper` is reused
+    as the first filter of the chain.
+    """
+    def __init__(self, working_dir, capacity, false_positive_rate=0.01,
+                 growth=DEFAULT_GROWTH, tightening=DEFAULT_TIGHTENING,
+                 sync_interval=DEFAULT_SYNC_INTERVAL):
+        Deduper.__init__(self, working_dir)
+        filename = os.path.join(self.working_dir, MMAP_BLOOM_FILTER_FILENAME)
+        legacy_filename = os.path.join(self.working_dir, 
+                                       BLOOM_FILETER_STATUS_FILENAME)
+        
+        self.filter = ScalableBloomFilter(filename, capacity, 
+                                          false_positive_rate=false_positive_rate,
+                                          growth=growth, tightening=tightening,
+                                          sync_interval=sync_interval,
+                                          legacy_filename=legacy_filename)
+        self.is_shutdown = False
+        
+    def stats(self):
+        return self.filter.stats()
+    
+class TTLBloomFilterDeduper(Deduper):
+    """
+    The deduper which forgets the keys after ``ttl`` seconds, so that
+    a url found again will be crawled only if it was put more than
+    ``ttl`` seconds ago, which fits the incremental recrawl.
+    
+    The time is split into ``generations`` periods of ``ttl / generations``
+    seconds, each period owns a :class:`~cola.core.bloomfilter.ScalableBloomFilter`
+    in the file ``dedup.ttl.<period>``. A new key is added to the filter
+    of the current period, and a key exists if it is in the filters of the
+    last ``generations`` periods, the expired filters are removed.
+    So a key is forgotten between ``ttl`` and ``ttl + ttl / generations``
+    seconds after added.
+    """
+    def __init__(self, working_dir, capacity, ttl=DEFAULT_TTL,
+                 generations=DEFAULT_TTL_GENERATIONS, false_positive_rate=0.01,
+                 sync_interval=DEFAULT_SYNC_INTERVAL):
+        """
+        :param working_dir: directory of the filters, 
+               will be made if not exists
+        :param capacity: the capacity of the first filter of a period,
+               the filter grows if more keys are added
+        :param ttl: seconds before a key is forgotten
+        :param generations: count of the filters to keep
+        :param false_positive_rate: the expected rate of a single period
+        :param sync_interval: refer to :class:`~cola.core.bloomfilter.MmapBloomFilter`
+        """
+        super(TTLBloomFilterDeduper, self).__init__(working_dir)
+        if not os.path.exists(self.working_dir):
+            os.makedirs(self.working_dir)
+        self.capacity = max(capacity // generations, 1)
+        self.ttl = ttl
+        self.generations = max(generations, 1)
+        self.period = float(ttl) / self.generations
+        self.false_positive_rate = false_positive_rate
+        self.sync_interval = sync_interval
+        
+        self.lock = threading.Lock()
+        self.filters = {} # period -> filter
+        self.current = None
+        self._rotate()
+        
+        self.is_shutdown = False
+        
+    def _get_filename(self, period):
+        return os.path.join(self.working_dir, 
+                            '%s%d' % (TTL_BLOOM_FILTER_FILENAME_PREFIX, period))
+        
+    def _rotate(self):
+        current = int(time.time() / self.period)
+        if current == self.current:
+            return
+        self.current = current
+        oldest = current - self.generations
+        
+        for period in [p for p in self.filters if p < oldest]:
+            self.filters.pop(period).close()
+        for filename in os.listdir(self.working_dir):
+            res = TTL_BLOOM_FILTER_FILENAME_REGEX.match(filename)
+            if res is None:
+                continue
+            period = int(res.group(1))
+            if period < oldest:
+                os.remove(os.path.join(self.working_dir, filename))
+            elif period not in self.filters and res.group(2) is None:
+                self.filters[period] = self._open(period)
+        if current not in self.filters:
+            self.filters[current] = self._open(current)
+            
+    def _open(self, period):
+        return ScalableBloomFilter(self._get_filename(period), self.capacity,
+                                   false_positive_rate=self.false_positive_rate,
+                                   sync_interval=self.sync_interval)
+        
+    def _exist(self, key, digest=None):
+        for period, bf in self.filters.iteritems():
+            if period != self.current and bf.contains(key, digest=digest):
+                return True
+        return self.filters[self.current].verify(key, digest=digest)
+        
+    def exist(self, key):
+        with self.lock:
+            self._rotate()
+            return self._exist(key)
+        
+    def exist_many(self, keys):
+        with self.lock:
+            self._rotate()
+            return [self._exist(key) for key in keys]
+        
+    def exist_digests(self, keys, digests):
+        with self.lock:
+            self._rotate()
+            return [self._exist(key, digest=digest) \
+                    for key, digest in zip(keys, digests)]
+        
+    def stats(self):
+        with self.lock:
+            filters = self.filters.values()
+            stats = [bf.stats() for bf in filters]
+        not_false_positive = 1.0
+        for stat in stats:
+            not_false_positive *= 1 - stat['false_positive_rate']
+        return {'generations': len(filters),
+                'count': sum(stat['count'] for stat in stats),
+                'false_positive_rate': 1 - not_false_positive}
+        
+    def shutdown(self):
+        if self.is_shutdown is True:
+            return
+        self.is_shutdown = True
+        
+        with self.lock:
+            for bf in self.filters.values():
+                bf.close()
+            
+    def __del__(self):
+        self.shutdown()
+        
+
 class MapDeduper(Deduper):
     def __init__(self, working_dir, capacity, holder=dict):
         super(MapDeduper, self).__init__(working_dir)
@@ -87,6 +353,16 @@ class MapDeduper(Deduper):
             self.container[key] = True
         return result
     
+    def exist_many(self, keys):
+        container = self.container
+        results = []
+        for key in keys:
+            result = key in container
+            if not result:
+                container[key] = True
+            results.append(result)
+        return results
+    
     def shutdown(self):
         if self.is_shutdown is True:
             return
@@ -96,4 +372,157 @@ class MapDeduper(Deduper):
             pickle.dump(dict(self.container), f)
             
     def __del__(self):
-        self.shutdown()
\ No newline at end of file
+        self.shutdown()
+
+
+class FingerprintDeduper(Deduper):
+    """
+    The exact deduper which keeps the 64-bit fingerprints of the keys
+    instead of the keys themselves, so each key costs about 8 bytes.
+    Two different keys are taken as the same one only if their
+    fingerprints collide, which is negligible for billions of keys.
+    
+    The new fingerprints are kept in a set as the buffer, and appended
+    to the log file at the same time. Once the buffer is full, it is
+    sorted into an ``array`` and written to a run file, the run files
+    are never changed after written. When a run is not less than
+    half of the previous one, the two are merged into a new run file,
+    so there are only O(log n) runs to look up by bisection.
+    
+    The log file is flushed after each call which adds new fingerprints,
+    so they are not lost if the process crashes.
+    """
+    def __init__(self, working_dir, capacity=None, buffer_size=100000):
+        """
+        :param working_dir: directory of the run files, 
+               will be made if not exists
+        :param capacity: not used, only for the compatibility
+        :param buffer_size: fingerprints kept in the buffer
+               before written into a run
+        """
+        super(FingerprintDeduper, self).__init__(working_dir)
+        if not os.path.exists(self.working_dir):
+            os.makedirs(self.working_dir)
+        self.buffer_size = buffer_size
+        self.lock = threading.Lock()
+        
+        self.runs = [] # list of ``(seq, array)`` from the oldest to the newest
+        self.seq = 0
+        self._load_runs()
+        
+        self.buffer = set()
+        self.log_file = os.path.join(self.working_dir, FINGERPRINT_LOG_FILENAME)
+        self._load_log()
+        self.log_f = open(self.log_file, 'ab')
+        
+        self.is_shutdown = False
+        
+    def _get_run_file(self, seq):
+        return os.path.join(self.working_dir, 
+                            '%s%d' % (FINGERPRINT_RUN_FILENAME_PREFIX, seq))
+        
+    def _load_runs(self):
+        seqs = []
+        for filename in os.listdir(self.working_dir):
+            res = FINGERPRINT_RUN_FILENAME_REGEX.match(filename)
+            if res is not None:
+                seqs.append(int(res.group(1)))
+            elif filename.endswith(FINGERPRINT_TMP_SUFFIX):
+                # unfinished run
+                os.remove(os.path.join(self.working_dir, filename))
+        
+        for seq in sorted(seqs):
+            run_file = self._get_run_file(seq)
+            run = array(FINGERPRINT_TYPECODE)
+            with open(run_file, 'rb') as f:
+                run.fromfile(f, os.path.getsize(run_file) // run.itemsize)
+            self.runs.append((seq, run))
+            self.seq = seq
+            
+    def _load_log(self):
+        if not os.path.exists(self.log_file):
+            return
+        with open(self.log_file, 'rb') as f:
+            content = f.read()
+        # the incomplete fingerprint at the tail is dropped
+        n = len(content) // FINGERPRINT_SIZE
+        log = array(FINGERPRINT_TYPECODE, content[:n * FINGERPRINT_SIZE])
+        self.buffer.update(fp for fp in log if not self._in_runs(fp))
+        
+    def _in_runs(self, fp):
+        for _, run in self.runs:
+            idx = bisect.bisect_left(run, fp)
+            if idx < len(run) and run[idx] == fp:
+                return True
+        return False
+    
+    def _write_run(self, run):
+        self.seq += 1
+        run_file = self._get_run_file(self.seq)
+        tmp_file = run_file + FINGERPRINT_TMP_SUFFIX
+        with open(tmp_file, 'wb') as f:
+            run.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_file, run_file)
+        self.runs.append((self.seq, run))
+        
+    def _flush_buffer(self):
+        if len(self.buffer) == 0:
+            return
+        
+        self._write_run(array(FINGERPRINT_TYPECODE, sorted(self.buffer)))
+        self.buffer.clear()
+        self.log_f.seek(0)
+        self.log_f.truncate()
+        
+        # merge the runs like the binary counter
+        while len(self.runs) >= 2 and \
+            len(self.runs[-1][1]) * 2 >= len(self.runs[-2][1]):
+            (seq1, run1), (seq2, run2) = self.runs.pop(-2), self.runs.pop()
+            self._write_run(array(FINGERPRINT_TYPECODE, heapq.merge(run1, run2)))
+            for seq in (seq1, seq2):
+                os.remove(self._get_run_file(seq))
+                
+    def _exist(self, fp):
+        if fp in self.buffer or self._in_runs(fp):
+            return True
+        
+        self.buffer.add(fp)
+        self.log_f.write(struct.pack(FINGERPRINT_FORMAT, fp))
+        if len(self.buffer) >= self.buffer_size:
+            self._flush_buffer()
+        return False
+        
+    def _exist_many(self, fps):
+        with self.lock:
+            results = [self._exist(fp) for fp in fps]
+            if not all(results):
+                self.log_f.flush()
+            return results
+        
+    def exist(self, key):
+        return self._exist_many([fingerprint(key)])[0]
+        
+    def exist_many(self, keys):
+        return self._exist_many([fingerprint(key) for key in keys])
+        
+    def exist_digests(self, keys, digests):
+        return self._exist_many([fingerprint(key, digest=digest) \
+                                 for key, digest in zip(keys, digests)])
+        
+    def stats(self):
+        with self.lock:
+            count = len(self.buffer) + sum(len(run) for _, run in self.runs)
+            return {'count': count, 'runs': len(self.runs)}
+        
+    def shutdown(self):
+        if self.is_shutdown is True:
+            return
+        self.is_shutdown = True
+        
+        with self.lock:
+            self.log_f.close()
+            
+    def __del__(self):
+        self.shutdown()
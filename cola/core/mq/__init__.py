@@ -24,9 +24,11 @@ import multiprocessing
 import threading
 
 from cola.core.mq.node import MessageQueueNodeProxy
+from cola.core.mq.store import Store, DEFAULT_LEASE_SECONDS
 from cola.core.mq.client import MessageQueueClient
 
-PUT, PUT_INC, GET, GET_INC, EXIST = range(5) # 5 operations now Cola MQ supports
+PUT, PUT_INC, GET, GET_INC, EXIST, \
+    GET_LEASED, GET_INC_LEASED, ACK, NACK, RENEW = range(10) # 10 operations now Cola MQ supports
 
 MessageQueueClient = MessageQueueClient
 
@@ -47,13 +49,17 @@ class MessageQueue(MessageQueueNodeProxy):
     Actually, this class is a wrapper for
     :class:`~cola.core.mq.node.MessageQueueNodeProxy`
     to provide the ability for cross-process call.
-    Five operations are supported include ``PUT``, ``PUT_INC``,
-    ``GET``, ``GET_INC`` and ``EXIST``.
+    Ten operations are supported include ``PUT``, ``PUT_INC``,
+    ``GET``, ``GET_INC``, ``EXIST``, ``GET_LEASED``, ``GET_INC_LEASED``,
+    ``ACK``, ``NACK`` and ``RENEW``.
     """
 
     def __init__(self, working_dir, rpc_server, addr, addrs, 
                  app_name=None, copies=1, n_priorities=3,
-                 deduper=None):
+                 deduper=None, durability=None, compress_threshold=None,
+                 segments=None, lease_timeout=DEFAULT_LEASE_SECONDS,
+                 store_cls=Store, canonicalizer=None, placement='ring',
+                 partitioner=None, batch=None):
         """
         Initialization method for the Cola message queue.
 
@@ -67,10 +73,41 @@ class MessageQueue(MessageQueueNodeProxy):
         :param n_priorities: the mq will include multiple priorities
         :param deduper: ``optional`` :class:`~cola.core.dedup.Deduper` instance
                for removing the duplication
+        :param durability: ``optional`` dict to decide when the mq flushes,
+               refer to :class:`~cola.core.mq.node.LocalMessageQueueNode`
+        :param compress_threshold: ``optional`` objects larger than it
+               after pickled will be compressed in the mq
+        :param segments: ``optional`` sizes of the store files,
+               refer to :class:`~cola.core.mq.node.LocalMessageQueueNode`
+        :param lease_timeout: seconds before the objects got with leases
+               are put back if not acknowledged
+        :param store_cls: the storage class, default as
+               :class:`~cola.core.mq.store.Store`
+        :param canonicalizer: ``optional`` callable to canonicalize the objects
+               before distributed and deduplicated, like
+               :class:`~cola.core.urls.UrlCanonicalizer`
+        :param placement: how the objects are placed on the nodes,
+               ``ring``, ``jump`` or ``rendezvous``, refer to
+               :class:`~cola.core.mq.distributor.Distributor`
+        :param partitioner: ``optional`` callable to get the partition key
+               of the objects which decides their nodes, like
+               :class:`~cola.core.urls.UrlPartitioner`
+        :param batch: ``optional`` dict to decide how the objects put are sent
+               to the nodes in batches, refer to
+               :class:`~cola.core.mq.node.MessageQueueNodeProxy`
         """
         super(MessageQueue, self).__init__(working_dir, rpc_server, addr, addrs,
                                            copies=copies, n_priorities=n_priorities,
-                                           deduper=deduper, app_name=app_name)
+                                           deduper=deduper, app_name=app_name,
+                                           durability=durability,
+                                           compress_threshold=compress_threshold,
+                                           segments=segments,
+                                           lease_timeout=lease_timeout,
+                                           store_cls=store_cls,
+                                           canonicalizer=canonicalizer,
+                                           placement=placement,
+                                           partitioner=partitioner,
+                                           batch=batch)
         
         self.stopped = multiprocessing.Event()
         self.agents = []
@@ -112,12 +149,23 @@ class MessageQueue(MessageQueueNodeProxy):
             elif action == GET_INC:
                 agent.send(self.get_inc(data))
             elif action == EXIST:
-                if not self.mq_node.deduper:
-                    agent.send(False)
-                else:
-                    agent.send(self.exist(str(data)))
+                agent.send(self.exist(data))
+            elif action == GET_LEASED:
+                size, priority, timeout = data
+                agent.send(self.get_leased(size=size, priority=priority,
+                                           timeout=timeout))
+            elif action == GET_INC_LEASED:
+                size, timeout = data
+                agent.send(self.get_inc_leased(size=size, timeout=timeout))
+            elif action == ACK:
+                agent.send(self.ack(data))
+            elif action == NACK:
+                agent.send(self.nack(data))
+            elif action == RENEW:
+                lease_ids, timeout = data
+                agent.send(self.renew(lease_ids, timeout=timeout))
             else:
-                raise ValueError('mq client can only put, put_inc, and get')
+                raise ValueError('mq client can only put, put_inc, get, ack, nack and renew')
             
     def _join(self):
         [t.join() for t in self.threads]
@@ -168,5 +216,32 @@ class MpMessageQueueClient(object):
 
     @lock
     def exist(self, obj):
-        self.conn.send((EXIST, str(obj)))
+        if not isinstance(obj, list):
+            obj = str(obj)
+        self.conn.send((EXIST, obj))
+        return self.conn.recv()
+
+    @lock
+    def get_leased(self, size=1, priority=0, timeout=None):
+        self.conn.send((GET_LEASED, (size, priority, timeout)))
+        return self.conn.recv()
+
+    @lock
+    def get_inc_leased(self, size=1, timeout=None):
+        self.conn.send((GET_INC_LEASED, (size, timeout)))
+        return self.conn.recv()
+
+    @lock
+    def ack(self, lease_ids):
+        self.conn.send((ACK, lease_ids))
+        return self.conn.recv()
+
+    @lock
+    def nack(self, lease_ids):
+        self.conn.send((NACK, lease_ids))
+        return self.conn.recv()
+
+    @lock
+    def renew(self, lease_ids, timeout=None):
+        self.conn.send((RENEW, (lease_ids, timeout)))
         return self.conn.recv()
\ No newline at end of file
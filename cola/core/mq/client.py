@@ -32,9 +32,12 @@ from cola.core.mq.distributor import Distributor
 
 class MessageQueueClient(object):
     
-    def __init__(self, addrs, app_name=None, copies=1):
+    def __init__(self, addrs, app_name=None, copies=1, placement='ring',
+                 partitioner=None):
         self.addrs = addrs
-        self.distributors = Distributor(addrs, copies=copies)
+        self.distributors = Distributor(addrs, copies=copies,
+                                        placement=placement,
+                                        partitioner=partitioner)
         self.prefix = get_rpc_prefix(app_name, 'mq')
         
     def put(self, objs):
@@ -72,4 +75,14 @@ class MessageQueueClient(object):
             if len(results) == 0:
                 return
             return results[0]
-        return results
\ No newline at end of file
+        return results
+    
+    def stats(self):
+        """
+        Get the statistics of all the mq nodes,
+        refer to :func:`~cola.core.mq.node.LocalMessageQueueNode.stats`.
+
+        :return: dict keyed by the node address
+        """
+        return dict((addr, pickle.loads(client_call(addr, self.prefix+'stats'))) \
+                    for addr in self.addrs)
\ No newline at end of file
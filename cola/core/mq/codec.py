@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-12
+
+@author: chine
+'''
+
+import marshal
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from cola.core.unit import Url
+
+MARSHAL, PICKLE, URL, COMPRESSED = 'm', 'p', 'u', 'z'
+
+URL_FORCE, URL_UNICODE = 1, 2 # flags of the url codec
+URL_ATTRS = frozenset(['item', 'url', 'force', 'priority'])
+
+# types which can always be serialized by marshal
+MARSHAL_TYPES = (str, unicode, int, long, float, bool, type(None))
+
+
+def encode_varint(num):
+    buf = []
+    while True:
+        byte = num & 0x7f
+        num >>= 7
+        if num:
+            buf.append(chr(byte | 0x80))
+        else:
+            buf.append(chr(byte))
+            return ''.join(buf)
+
+def decode_varint(src_str, pos=0):
+    num, shift = 0, 0
+    while True:
+        byte = ord(src_str[pos])
+        pos += 1
+        num |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return num, pos
+        shift += 7
+
+
+class Codec(object):
+    """
+    A codec serializes the objects into strings and vice versa,
+    each codec owns a single type indicator which will be
+    written in front of the serialized content.
+    """
+    type_ = None
+
+    def accept(self, obj):
+        return True
+
+    def encode(self, obj):
+        raise NotImplementedError
+
+    def decode(self, str_):
+        raise NotImplementedError
+
+
+class MarshalCodec(Codec):
+    type_ = MARSHAL
+
+    def encode(self, obj):
+        return marshal.dumps(obj)
+
+    def decode(self, str_):
+        return marshal.loads(str_)
+
+
+class PickleCodec(Codec):
+    type_ = PICKLE
+
+    def encode(self, obj):
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, str_):
+        return pickle.loads(str_)
+
+
+class UrlCodec(Codec):
+    """
+    Compact codec for :class:`~cola.core.unit.Url`, the content is
+    ``<varint priority><flags><utf-8 url>``. Only the plain ``Url``
+    without any other attributes is accepted, e.g. the ``Url``
+    carries ``error_times`` will be pickled.
+    """
+    type_ = URL
+
+    def accept(self, obj):
+        if type(obj) is not Url:
+            return False
+        if not URL_ATTRS.issuperset(obj.__dict__):
+            return False
+        priority = obj.priority
+        return isinstance(priority, (int, long)) and priority >= 0 and \
+            obj.item is obj.url and isinstance(obj.url, basestring)
+
+    def encode(self, obj):
+        url = obj.url
+        flags = URL_FORCE if obj.force else 0
+        if isinstance(url, unicode):
+            flags |= URL_UNICODE
+            url = url.encode('utf-8')
+        return encode_varint(obj.priority) + chr(flags) + url
+
+    def decode(self, str_):
+        priority, pos = decode_varint(str_)
+        flags = ord(str_[pos])
+        url = str_[pos+1:]
+        if flags & URL_UNICODE:
+            url = url.decode('utf-8')
+        return Url(url, force=bool(flags & URL_FORCE), priority=priority)
+
+
+class CompressedCodec(PickleCodec):
+    """
+    Pickle and then compress by zlib, only used for the large objects
+    like the :class:`~cola.core.unit.Bundle` with lots of urls.
+    """
+    type_ = COMPRESSED
+
+    def encode(self, obj):
+        return zlib.compress(super(CompressedCodec, self).encode(obj))
+
+    def decode(self, str_):
+        return super(CompressedCodec, self).decode(zlib.decompress(str_))
+
+
+class Codecs(object):
+    """
+    The registry of codecs keyed by the type indicator.
+
+    To encode an object, the codec registered for the object's type
+    will be tried first, then the ``marshal`` and at last the ``pickle``.
+    If the ``compress_threshold`` is set, the pickled content larger than
+    the threshold will be compressed.
+    """
+    def __init__(self, compress_threshold=None):
+        self.compress_threshold = compress_threshold
+
+        self.codecs = {}
+        self.type_codecs = {}
+
+        self.marshal_codec = MarshalCodec()
+        self.pickle_codec = PickleCodec()
+        self.compressed_codec = CompressedCodec()
+        for codec in (self.marshal_codec, self.pickle_codec,
+                      self.compressed_codec):
+            self.register(codec)
+        for type_ in MARSHAL_TYPES:
+            self.register(self.marshal_codec, type_)
+        self.register(UrlCodec(), Url)
+
+    def register(self, codec, type_=None):
+        """
+        :param codec: instance of :class:`Codec`
+        :param type_: if set, objects of exactly this type
+               will be encoded by the codec
+        """
+        if codec.type_ in self.codecs and \
+            self.codecs[codec.type_].__class__ != codec.__class__:
+            raise ValueError('Type indicator %s has been registered.' % codec.type_)
+        self.codecs[codec.type_] = codec
+        if type_ is not None:
+            self.type_codecs[type_] = codec
+
+    def _pickle(self, obj):
+        str_ = self.pickle_codec.encode(obj)
+        if self.compress_threshold is not None and \
+            self.compress_threshold >= 0 and \
+            len(str_) > self.compress_threshold:
+            return COMPRESSED + zlib.compress(str_)
+        return PICKLE + str_
+
+    def encode(self, obj):
+        codec = self.type_codecs.get(type(obj))
+        if codec is not None and codec.accept(obj):
+            return codec.type_ + codec.encode(obj)
+
+        if codec is None:
+            try:
+                return MARSHAL + self.marshal_codec.encode(obj)
+            except ValueError:
+                pass
+        return self._pickle(obj)
+
+    def decode(self, src_str):
+        if len(src_str) < 2:
+            raise ValueError('String length must be at least 2.')
+
+        codec = self.codecs.get(src_str[0])
+        if codec is None:
+            raise ValueError('String must contain a right type indicator.')
+        return codec.decode(src_str[1:])
@@ -24,17 +24,69 @@ from collections import defaultdict
 
 from cola.core.utils import iterable
 from cola.core.mq.hash_ring import HashRing
-from cola.core.mq.utils import labelize
+from cola.core.mq.placement import Placement, JumpHash, RendezvousHash
+from cola.core.mq.utils import get_digest
+
+PLACEMENTS = {
+    'ring': HashRing,
+    'jump': JumpHash,
+    'rendezvous': RendezvousHash
+}
+PARTITION_DIGESTS_SIZE = 100000 # the digests of partition keys cached
 
 
 class Distributor(object):
     """
     Given several objects, to decides which message queue node each one belong to.
+    If the ``canonicalizer`` is set, the objects will be canonicalized before
+    distributed, refer to :class:`~cola.core.urls.UrlCanonicalizer`.
+    
+    The ``placement`` can be ``ring`` for the consistent hash ring,
+    ``jump`` for the :class:`~cola.core.mq.placement.JumpHash`
+    or ``rendezvous`` for the :class:`~cola.core.mq.placement.RendezvousHash`,
+    the latter two apply the nodes added or removed in place.
+    All the nodes of a job must use the same placement.
+    
+    The ``weights`` decide the shares of the nodes, which are not
+    supported by the ``jump`` placement.
+    
+    If the ``partitioner`` is set, the objects are placed by their partition
+    keys instead of themselves, e.g. all the urls of a host are on
+    the same node, refer to :class:`~cola.core.urls.UrlPartitioner`.
     """
-    def __init__(self, addrs, copies=1):
+    def __init__(self, addrs, copies=1, canonicalizer=None, placement='ring',
+                 weights=None, partitioner=None):
+        if placement not in PLACEMENTS:
+            raise ValueError('Placement must be one of %s.' % \
+                             ', '.join(sorted(PLACEMENTS)))
         self.nodes = list(addrs)
-        self.hash_ring = HashRing(self.nodes)
-        self.copies = min(copies, len(self.nodes)-1)
+        self.copies = max(min(copies, len(self.nodes)-1), 0)
+        self.placement = placement
+        self.weights = dict(weights or {})
+        self.hash_ring = self._create_hash_ring()
+        self.canonicalizer = canonicalizer
+        self.partitioner = partitioner
+        self.partition_digests = {}
+        
+    def _create_hash_ring(self):
+        placement_cls = PLACEMENTS[self.placement]
+        if placement_cls is HashRing:
+            # only the primary and backup nodes are precomputed
+            return HashRing(self.nodes, weights=self.weights, 
+                            successors=self.copies+1)
+        return placement_cls(self.nodes, weights=self.weights)
+    
+    def _get_digest(self, obj):
+        key = self.partitioner(obj)
+        if key is None:
+            return get_digest(obj)
+        
+        digest = self.partition_digests.get(key)
+        if digest is None:
+            if len(self.partition_digests) >= PARTITION_DIGESTS_SIZE:
+                self.partition_digests.clear()
+            digest = self.partition_digests[key] = get_digest(key)
+        return digest
         
     def distribute(self, objs):
         """
@@ -49,29 +101,54 @@ class Distributor(object):
         if isinstance(objs, basestring) or not iterable(objs):
             objs = [objs, ]
         
+        canonicalizer = self.canonicalizer
+        get_nodes = self.hash_ring.get_nodes
+        size = self.copies + 1
+        digest_of = get_digest if self.partitioner is None else self._get_digest
         for obj in objs:
-            str_ = labelize(obj)
-            
-            it = self.hash_ring.iterate_nodes(str_)
+            if canonicalizer is not None:
+                obj = canonicalizer(obj)
+            nodes = get_nodes(None, size, digest=digest_of(obj))
             
             # put obj into an mq node.
-            put_node = next(it)
+            put_node = nodes[0]
             node_objs[put_node].append(obj)
             
-            for _ in xrange(self.copies):
-                backup_node = next(it)
-                if backup_node is None: continue
-                
+            for backup_node in nodes[1:]:
                 backup_node_objs[backup_node][put_node].append(obj)
         
         return node_objs, backup_node_objs
     
+    def set_weights(self, weights):
+        """
+        Set the weights of the nodes, the ones not given are weighted 1.
+        The ``rendezvous`` placement moves only the objects whose nodes'
+        weights changed, while the ``ring`` is rebuilt and the virtual
+        nodes of all the nodes are changed in proportion.
+        """
+        weights = dict(weights)
+        if weights == self.weights:
+            return
+        
+        if isinstance(self.hash_ring, Placement):
+            self.hash_ring.set_weights(weights)
+            self.weights = weights
+        else:
+            self.weights = weights
+            self.hash_ring = self._create_hash_ring()
+    
     def remove_node(self, addr):
         if addr in self.nodes:
             self.nodes.remove(addr)
-            self.hash_ring = HashRing(self.nodes)
+            if isinstance(self.hash_ring, Placement):
+                self.hash_ring.remove_node(addr)
+            else:
+                self.hash_ring = self._create_hash_ring()
             
     def add_node(self, addr):
         if addr not in self.nodes:
             self.nodes.append(addr)
-            self.hash_ring = HashRing(self.nodes)
\ No newline at end of file
+            if isinstance(self.hash_ring, Placement):
+                self.hash_ring.add_node(addr)
+            else:
+                self.hash_ring = self._create_hash_ring()
\ No newline at end of file
@@ -47,6 +47,7 @@ limitations under the License.
 """
 
 import math
+import struct
 import sys
 from bisect import bisect
 
@@ -59,13 +60,17 @@ else:
 
 class HashRing(object):
 
-    def __init__(self, nodes=None, weights=None):
+    def __init__(self, nodes=None, weights=None, successors=None):
         """`nodes` is a list of objects that have a proper __str__ representation.
         `weights` is dictionary that sets weights to the nodes.  The default
         weight is that all nodes are equal.
+        `successors` is the count of the distinct nodes precomputed for each
+        point on the ring, all the nodes as default.
         """
         self.ring = dict()
         self._sorted_keys = []
+        self._successors = []
+        self._n_nodes = 0
 
         self.nodes = nodes
 
@@ -74,6 +79,7 @@ class HashRing(object):
         self.weights = weights
 
         self._generate_circle()
+        self._generate_successors(successors)
 
     def _generate_circle(self):
         """Generates the circle.
@@ -100,6 +106,36 @@ class HashRing(object):
 
         self._sorted_keys.sort()
 
+    def _generate_successors(self, successors=None):
+        """Generates the distinct nodes from each point on the ring in order,
+        so that the nodes for a key are got by a single bisect.
+        """
+        self._n_nodes = n_nodes = len(set(self.ring.itervalues()))
+        size = n_nodes if successors is None else min(successors, n_nodes)
+        self._successors = []
+        if not self._sorted_keys or size <= 0:
+            return
+
+        points = [self.ring[key] for key in self._sorted_keys]
+        # walk from the last point to get its successors,
+        # then each point's successors are the next point's ones
+        # with the point's node moved ahead
+        last = []
+        for node in points[-1:] + points:
+            if node not in last:
+                last.append(node)
+                if len(last) == size:
+                    break
+
+        successors = [None] * len(points)
+        successors[-1] = nxt = tuple(last)
+        for i in xrange(len(points) - 2, -1, -1):
+            node = points[i]
+            if nxt[0] != node:
+                nxt = ((node, ) + tuple(n for n in nxt if n != node))[:size]
+            successors[i] = nxt
+        self._successors = successors
+
     def get_node(self, string_key):
         """Given a string key a corresponding node in the hash ring is returned.
 
@@ -110,7 +146,7 @@ class HashRing(object):
             return None
         return self.ring[ self._sorted_keys[pos] ]
 
-    def get_node_pos(self, string_key):
+    def get_node_pos(self, string_key, digest=None):
         """Given a string key a corresponding node in the hash ring is returned
         along with it's position in the ring.
 
@@ -119,7 +155,7 @@ class HashRing(object):
         if not self.ring:
             return None
 
-        key = self.gen_key(string_key)
+        key = self.gen_key(string_key, digest=digest)
 
         nodes = self._sorted_keys
         pos = bisect(nodes, key)
@@ -129,7 +165,24 @@ class HashRing(object):
         else:
             return pos
 
-    def iterate_nodes(self, string_key, distinct=True):
+    def get_nodes(self, string_key, size, digest=None):
+        """Given a string key it returns at most `size` distinct nodes
+        in the order of :func:`iterate_nodes`.
+        """
+        if self._successors:
+            successors = self._successors[self.get_node_pos(string_key, digest=digest)]
+            if len(successors) >= size or len(successors) == self._n_nodes:
+                return successors[:size]
+
+        nodes = []
+        if size > 0 and self.ring:
+            for node in self.iterate_nodes(string_key, digest=digest):
+                nodes.append(node)
+                if len(nodes) == size:
+                    break
+        return tuple(nodes)
+
+    def iterate_nodes(self, string_key, distinct=True, digest=None):
         """Given a string key it returns the nodes as a generator that can hold the key.
 
         The generator iterates one time through the ring
@@ -137,17 +190,29 @@ class HashRing(object):
 
         if `distinct` is set, then the nodes returned will be unique,
         i.e. no virtual copies will be returned.
+
+        if `digest` is set, it will be used as the md5 digest of the key.
         """
         if not self.ring:
             yield None, None
 
         returned_values = set()
+        if distinct and self._successors:
+            pos = self.get_node_pos(string_key, digest=digest)
+            successors = self._successors[pos]
+            for node in successors:
+                yield node
+            if len(successors) == self._n_nodes:
+                return
+            # not all the nodes are precomputed
+            returned_values.update(str(node) for node in successors)
+
         def distinct_filter(value):
             if str(value) not in returned_values:
                 returned_values.add(str(value))
                 return value
 
-        pos = self.get_node_pos(string_key)
+        pos = self.get_node_pos(string_key, digest=digest)
         for key in self._sorted_keys[pos:]:
             val = distinct_filter(self.ring[key])
             if val:
@@ -159,14 +224,17 @@ class HashRing(object):
                 if val:
                     yield val
 
-    def gen_key(self, key):
+    def gen_key(self, key, digest=None):
         """Given a string key it returns a long value,
         this long value represents a place on the hash ring.
 
-        md5 is currently used because it mixes well.
+        md5 is currently used because it mixes well,
+        the `digest` is used if it has been computed.
         """
-        b_key = self._hash_digest(key)
-        return self._hash_val(b_key, lambda x: x)
+        if digest is None:
+            digest = md5_constructor(key).digest()
+        # the same as the `_hash_val` of the first 4 bytes
+        return struct.unpack_from('<I', digest)[0]
 
     def _hash_val(self, b_key, entry_fn):
         return (( b_key[entry_fn(3)] << 24)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-22
+
+@author: chine
+'''
+
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from cola.core.utils import iterable
+from cola.core.mq.store import BaseStore, DEFAULT_LEASE_SECONDS
+
+SNAPSHOT_FILENAME = 'snapshot'
+SNAPSHOT_TMP_SUFFIX = '.tmp'
+
+
+class MemoryStore(BaseStore):
+    """
+    The storage which keeps the serialized objects in a deque,
+    nothing is written to the disk while running, so it fits the
+    local mode and the short-lived jobs.
+
+    If ``snapshot`` is True, the objects left, including the ones leased
+    but not acknowledged, will be saved into the working directory when
+    shutdown, and loaded back when initialized next time.
+    """
+    def __init__(self, working_dir, deduper=None, compress_threshold=None,
+                 lease_timeout=DEFAULT_LEASE_SECONDS, snapshot=False, **kwargs):
+        """
+        :param working_dir: directory for the snapshot,
+               will be made only when the snapshot is saved
+        :param deduper: instance of :class:`~cola.core.dedup.Deduper`
+        :param compress_threshold: if set, the pickled objects larger than it
+               will be compressed
+        :param lease_timeout: default seconds before the objects got
+               by :func:`get_leased` are put back if not acknowledged
+        :param snapshot: save the objects left when shutdown if True
+        """
+        super(MemoryStore, self).__init__(working_dir, deduper=deduper,
+                                          compress_threshold=compress_threshold)
+        self.lock = threading.Lock()
+        self.lease_timeout = lease_timeout
+        self.snapshot = snapshot
+        self.snapshot_file = os.path.join(self.dir_, SNAPSHOT_FILENAME)
+
+        self.queue = deque()
+        self.n_bytes = 0
+        self._init_leases()
+
+        self.stopped = False
+        self.inited = False
+
+    def init(self):
+        with self.lock:
+            if self.inited: return
+
+            if os.path.exists(self.snapshot_file):
+                self._write(self._load_snapshot())
+                os.remove(self.snapshot_file)
+
+            self.inited = True
+
+    def _load_snapshot(self):
+        with open(self.snapshot_file, 'rb') as f:
+            content = f.read()
+
+        # the records are packed in the same way as the store files
+        obj_strs, pos = [], 0
+        while True:
+            obj_str, pos = self._unpack_record(content, pos)
+            if obj_str is None:
+                break
+            obj_strs.append(obj_str)
+        return obj_strs
+
+    def _save_snapshot(self):
+        obj_strs = [record for _, record in self.leases.itervalues()]
+        obj_strs.extend(self.queue)
+        if len(obj_strs) == 0:
+            return
+
+        if not os.path.exists(self.dir_):
+            os.makedirs(self.dir_)
+        tmp_file = self.snapshot_file + SNAPSHOT_TMP_SUFFIX
+        with open(tmp_file, 'wb') as f:
+            for obj_str in obj_strs:
+                f.write(self._pack_record(obj_str))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_file, self.snapshot_file)
+
+    def shutdown(self):
+        if self.stopped: return
+        self.stopped = True
+
+        with self.lock:
+            if self.inited and self.snapshot:
+                self._save_snapshot()
+            self.queue.clear()
+            self.leases.clear()
+        self.inited = False
+
+    def _write(self, obj_strs):
+        self.queue.extend(obj_strs)
+        self.n_bytes += sum(len(obj_str) for obj_str in obj_strs)
+
+    def _read(self, size):
+        obj_strs = []
+        for _ in xrange(min(size, len(self.queue))):
+            obj_strs.append(self.queue.popleft())
+        self.n_bytes -= sum(len(obj_str) for obj_str in obj_strs)
+        return obj_strs
+
+    def _release(self, lease_ids, requeue=False):
+        obj_strs = [obj_str for _, obj_str in self._pop_leases(lease_ids)]
+
+        if requeue and len(obj_strs) > 0:
+            # put back to the head of the queue
+            self.queue.extendleft(reversed(obj_strs))
+            self.n_bytes += sum(len(obj_str) for obj_str in obj_strs)
+        return len(obj_strs)
+
+    def put_one(self, obj, force=False, commit=True):
+        if self.stopped: return
+        self.init()
+
+        if not self._filter(obj, force=force):
+            return
+        obj_str = self._stringfy(obj)
+
+        with self.lock:
+            self._write([obj_str, ])
+        return obj
+
+    def put(self, objects, force=False, commit=True):
+        if self.stopped: return
+        self.init()
+
+        if isinstance(objects, basestring) or not iterable(objects):
+            return self.put_one(objects, force, commit)
+
+        remains = self._filter_many(objects, force=force)
+        obj_strs = [self._stringfy(obj) for obj in remains]
+
+        with self.lock:
+            self._write(obj_strs)
+        return remains
+
+    def get_one(self, commit=True):
+        if self.stopped: return
+        self.init()
+
+        with self.lock:
+            self._requeue_expired()
+            obj_strs = self._read(1)
+        if len(obj_strs) > 0:
+            return self._destringfy(obj_strs[0])
+
+    def get(self, size=1):
+        if size <= 1:
+            return self.get_one()
+
+        if self.stopped: return []
+        self.init()
+
+        with self.lock:
+            self._requeue_expired()
+            obj_strs = self._read(size)
+        return [self._destringfy(obj_str) for obj_str in obj_strs]
+
+    def get_leased(self, size=1, timeout=None):
+        if self.stopped: return []
+        self.init()
+
+        timeout = self.lease_timeout if timeout is None else timeout
+        results = []
+        with self.lock:
+            self._requeue_expired()
+            deadline = time.time() + timeout
+            for obj_str in self._read(max(size, 1)):
+                lease_id = uuid.uuid4().hex
+                self._add_lease(lease_id, deadline, obj_str)
+                results.append((lease_id, obj_str))
+        return [(lease_id, self._destringfy(obj_str)) \
+                for lease_id, obj_str in results]
+
+    def ack(self, lease_ids):
+        if self.stopped: return 0
+        self.init()
+
+        if isinstance(lease_ids, basestring):
+            lease_ids = [lease_ids, ]
+        with self.lock:
+            return self._release(lease_ids)
+
+    def nack(self, lease_ids):
+        if self.stopped: return 0
+        self.init()
+
+        if isinstance(lease_ids, basestring):
+            lease_ids = [lease_ids, ]
+        with self.lock:
+            return self._release(lease_ids, requeue=True)
+
+    def renew(self, lease_ids, timeout=None):
+        if self.stopped: return 0
+        self.init()
+
+        if isinstance(lease_ids, basestring):
+            lease_ids = [lease_ids, ]
+        timeout = self.lease_timeout if timeout is None else timeout
+        with self.lock:
+            return len(self._renew_leases(lease_ids, time.time() + timeout))
+
+    def stats(self):
+        """
+        The ``segments`` is always 0 since nothing is on the disk.
+        """
+        if not self.stopped:
+            self.init()
+
+        with self.lock:
+            return {'messages': len(self.queue),
+                    'bytes': self.n_bytes,
+                    'segments': 0,
+                    'inflight': len(self.leases)}
@@ -31,8 +31,15 @@ import socket
 
 from cola.core.rpc import client_call
 from cola.core.utils import get_rpc_prefix
-from cola.core.mq.store import Store
+from cola.core.errors import ConfigurationError
+from cola.core.mq.store import Store, DEFAULT_LEASE_SECONDS, \
+    DURABILITY_ALWAYS, DURABILITY_EVERY_N_OPS, DURABILITY_INTERVAL_MS, \
+    DURABILITY_MODES
 from cola.core.mq.distributor import Distributor
+from cola.core.mq.sender import BatchSender, DEFAULT_BATCH_COUNT, \
+    DEFAULT_BATCH_SIZE, DEFAULT_LINGER_MS, DEFAULT_BUFFER_COUNT, \
+    DEFAULT_PUT_TIMEOUT
+from cola.core.mq.utils import labelize, get_digest
     
 MQ_STATUS_FILENAME = 'mq.status' # file name of message queue status
 
@@ -40,7 +47,20 @@ PRIORITY_STORE_FN = 'store'
 BACKUP_STORE_FN = 'backup'
 INCR_STORE_FN = 'inc'
 
-CACHE_SIZE = 20
+STOP_SENDER_TIMEOUT = 30 # seconds to send the objects left when shutdown
+
+DEFAULT_FLUSH_OPS = 100
+DEFAULT_FLUSH_INTERVAL_MS = 200
+
+# KB of a single store file for each kind of storage
+DEFAULT_SEGMENT_SIZES = {
+    PRIORITY_STORE_FN: 4 * 1024,
+    BACKUP_STORE_FN: 512,
+    INCR_STORE_FN: 4 * 1024
+}
+DEFAULT_WARM_SEGMENTS = 1
+
+INC_LEASE_KEY = 'inc' # the store key in the lease id for the incremental store
 
 
 class LocalMessageQueueNode(object):
@@ -51,10 +71,34 @@ class LocalMessageQueueNode(object):
     for each priority, incremental storage as well as the
     backup storage. Each storage is an instance of
     :class:`~cola.core.mq.store.Store`.
+
+    The ``durability`` decides when the storages flush,
+    it's a dict with the ``mode`` which is one of ``always``,
+    ``every_n_ops``, ``interval_ms`` and ``os``, the ``ops``
+    for the ``every_n_ops`` mode and the ``interval`` in milliseconds
+    for the ``interval_ms`` mode. Under the ``interval_ms`` mode,
+    a background thread will flush all the storages periodically.
+
+    If ``compress_threshold`` is set, the objects in the storages which are
+    larger than it after pickled will be compressed.
+
+    The ``segments`` is a dict which decides the size in KB of a single store
+    file for the priority ``store``, ``backup`` and ``inc`` storages, and the
+    ``warm`` count of the files prepared ahead for each storage.
+
+    The objects got by :func:`get_leased` should be acknowledged by :func:`ack`
+    in ``lease_timeout`` seconds, or they will be put back into the storage.
+    The lease id is ``<priority or inc>:<lease id of the storage>``.
+
+    The ``store_cls`` decides the storage backend, any subclass of
+    :class:`~cola.core.mq.store.BaseStore` like
+    :class:`~cola.core.mq.sqlite_store.SqliteStore` can be used.
     """
     def __init__(self, base_dir, rpc_server, addr, addrs,
                  copies=1, n_priorities=3, deduper=None,
-                 app_name=None):
+                 app_name=None, durability=None, compress_threshold=None,
+                 segments=None, lease_timeout=DEFAULT_LEASE_SECONDS,
+                 store_cls=Store):
         self.dir_ = base_dir
         self.rpc_server = rpc_server
         
@@ -67,8 +111,36 @@ class LocalMessageQueueNode(object):
         self.n_priorities = max(n_priorities, 1)
         self.deduper = deduper
         self.app_name = app_name
+        self.compress_threshold = compress_threshold
+        
+        durability = durability or {}
+        self.durability = durability.get('mode', DURABILITY_ALWAYS)
+        if self.durability not in DURABILITY_MODES:
+            raise ConfigurationError(
+                'durability mode must be one of %s' % ', '.join(DURABILITY_MODES))
+        self.flush_ops = durability.get('ops', DEFAULT_FLUSH_OPS)
+        self.flush_interval = durability.get('interval', 
+                                             DEFAULT_FLUSH_INTERVAL_MS) / 1000.0
+        if self.durability == DURABILITY_ALWAYS:
+            self.flush_every = 1
+        elif self.durability == DURABILITY_EVERY_N_OPS:
+            self.flush_every = max(self.flush_ops, 1)
+        else:
+            self.flush_every = 0
+            
+        segments = segments or {}
+        self.segment_sizes = dict(
+            (fn, segments.get(fn, size) * 1024)
+            for fn, size in DEFAULT_SEGMENT_SIZES.iteritems())
+        if any(size <= 0 for size in self.segment_sizes.values()):
+            raise ConfigurationError('segment size must be greater than 0')
+        self.warm_segments = max(segments.get('warm', DEFAULT_WARM_SEGMENTS), 0)
+        self.lease_timeout = lease_timeout
+        self.store_cls = store_cls
         
         self._lock = threading.Lock()
+        self._flush_stopped = threading.Event()
+        self._flush_t = None
         
         self._register_rpc()
         
@@ -80,9 +152,9 @@ class LocalMessageQueueNode(object):
             
             get_priority_store_dir = lambda priority: os.path.join(self.dir_, 
                                         PRIORITY_STORE_FN, str(priority))
-            self.priority_stores = [Store(get_priority_store_dir(i), 
-                                          deduper=self.deduper,
-                                          mkdirs=True) \
+            self.priority_stores = [self._create_store(get_priority_store_dir(i),
+                                                       PRIORITY_STORE_FN,
+                                                       deduper=self.deduper) \
                                     for i in range(self.n_priorities)]
             
     
@@ -91,13 +163,43 @@ class LocalMessageQueueNode(object):
             for backup_addr in self.other_addrs:
                 backup_node_dir = backup_addr.replace(':', '_')
                 backup_path = os.path.join(backup_store_dir, backup_node_dir)
-                self.backup_stores[backup_addr] = Store(backup_path, 
-                                                       size=512*1024, mkdirs=True)
+                self.backup_stores[backup_addr] = self._create_store(
+                    backup_path, BACKUP_STORE_FN)
                 
             inc_store_dir = os.path.join(self.dir_, INCR_STORE_FN)
-            self.inc_store = Store(inc_store_dir, mkdirs=True)
+            self.inc_store = self._create_store(inc_store_dir, INCR_STORE_FN)
+            
+            if self.durability == DURABILITY_INTERVAL_MS:
+                self._flush_t = threading.Thread(target=self._flush_periodically)
+                self._flush_t.setDaemon(True)
+                self._flush_t.start()
                     
             self.inited = True
+            
+    def _create_store(self, store_dir, kind, deduper=None):
+        return self.store_cls(store_dir, size=self.segment_sizes[kind],
+                              deduper=deduper, mkdirs=True,
+                              flush_every=self.flush_every,
+                              durability=self.durability,
+                              compress_threshold=self.compress_threshold,
+                              warm_files=self.warm_segments,
+                              lease_timeout=self.lease_timeout)
+            
+    def _flush_periodically(self):
+        while not self._flush_stopped.wait(self.flush_interval):
+            self.flush()
+            
+    def flush(self):
+        """
+        Force all the storages to flush.
+        """
+        if not self.inited: return
+        
+        for store in self.priority_stores:
+            store.flush()
+        for backup_store in self.backup_stores.values():
+            backup_store.flush()
+        self.inc_store.flush()
         
     def _register_rpc(self):
         if self.rpc_server:
@@ -116,6 +218,16 @@ class LocalMessageQueueNode(object):
                                      prefix=prefix)
         rpc_server.register_function(node.exist, name='exist',
                                      prefix=prefix)
+        rpc_server.register_function(node.stats_proxy, name='stats',
+                                     prefix=prefix)
+        rpc_server.register_function(node.get_leased_proxy, name='get_leased',
+                                     prefix=prefix)
+        rpc_server.register_function(node.ack, name='ack',
+                                     prefix=prefix)
+        rpc_server.register_function(node.nack, name='nack',
+                                     prefix=prefix)
+        rpc_server.register_function(node.renew, name='renew',
+                                     prefix=prefix)
 
     def put(self, objs, force=False, priority=0):
         self.init()
@@ -212,6 +324,106 @@ class LocalMessageQueueNode(object):
         
         return self.inc_store.get(size=size)
     
+    def _lease_store(self, key, results):
+        return [('%s:%s' % (key, lease_id), obj) for lease_id, obj in results]
+        
+    def get_leased(self, size=1, priority=0, timeout=None):
+        """
+        Get the objects with leases from the specific priority queue.
+
+        :param size: the max count of objects to get
+        :param priority: the priority queue to get from
+        :param timeout: seconds of the leases
+        :return: list of the ``(lease_id, obj)``
+        """
+        self.init()
+        
+        priority = max(min(priority, self.n_priorities-1), 0)
+        priority_store = self.priority_stores[priority]
+        return self._lease_store(priority, 
+            priority_store.get_leased(size=size, timeout=timeout))
+        
+    def get_leased_proxy(self, size=1, priority=0, timeout=None):
+        return pickle.dumps(self.get_leased(size=size, priority=priority, 
+                                            timeout=timeout))
+    
+    def get_inc_leased(self, size=1, timeout=None):
+        self.init()
+        
+        return self._lease_store(INC_LEASE_KEY, 
+            self.inc_store.get_leased(size=size, timeout=timeout))
+    
+    def _group_leases(self, lease_ids):
+        stores_lease_ids = defaultdict(list)
+        for lease_id in lease_ids:
+            key, _, store_lease_id = lease_id.partition(':')
+            if key == INC_LEASE_KEY:
+                store = self.inc_store
+            elif key.isdigit() and int(key) < self.n_priorities:
+                store = self.priority_stores[int(key)]
+            else:
+                continue
+            stores_lease_ids[store].append(store_lease_id)
+        return stores_lease_ids.iteritems()
+    
+    def ack(self, lease_ids):
+        """
+        Acknowledge that the objects got with leases have been finished.
+
+        :param lease_ids: list of lease ids
+        :return: count of the leases acknowledged
+        """
+        self.init()
+        
+        return sum(store.ack(ids) for store, ids in self._group_leases(lease_ids))
+    
+    def nack(self, lease_ids):
+        """
+        Put the objects got with leases back at once.
+
+        :param lease_ids: list of lease ids
+        :return: count of the objects put back
+        """
+        self.init()
+        
+        return sum(store.nack(ids) for store, ids in self._group_leases(lease_ids))
+    
+    def renew(self, lease_ids, timeout=None):
+        """
+        Extend the leases of the objects which are still being handled.
+
+        :param lease_ids: list of lease ids
+        :param timeout: seconds of the leases from now
+        :return: count of the leases renewed
+        """
+        self.init()
+        
+        return sum(store.renew(ids, timeout=timeout) \
+                   for store, ids in self._group_leases(lease_ids))
+        
+    def stats(self):
+        """
+        Get the statistics of all the storages, each one is a dict
+        of the ``messages``, ``bytes`` and ``segments`` in the storage,
+        refer to :func:`~cola.core.mq.store.Store.stats`.
+
+        :return: dict of the ``priorities`` list, the ``backups`` dict keyed
+                 by the address and the ``inc``
+        """
+        self.init()
+        
+        return {'priorities': [store.stats() for store in self.priority_stores],
+                'backups': dict((addr, store.stats()) for addr, store \
+                                in self.backup_stores.iteritems()),
+                'inc': self.inc_store.stats()}
+        
+    def stats_proxy(self):
+        """
+        The statistics are pickled, for the bytes may exceed
+        the integer limit of the remote call.
+        """
+        return pickle.dumps(self.stats())
+    
     def add_node(self, addr):
         """
         When a new message queue node is in, firstly will add the address
@@ -224,8 +436,8 @@ class LocalMessageQueueNode(object):
         backup_store_dir = os.path.join(self.dir_, BACKUP_STORE_FN)
         backup_node_dir = addr.replace(':', '_')
         backup_path = os.path.join(backup_store_dir, backup_node_dir)
-        self.backup_stores[addr] = Store(backup_path, 
-                                         size=512*1024, mkdirs=True)
+        self.backup_stores[addr] = self._create_store(backup_path, 
+                                                      BACKUP_STORE_FN)
         
     def remove_node(self, addr):
         """
@@ -239,13 +451,28 @@ class LocalMessageQueueNode(object):
         del self.backup_stores[addr]
         
     def exist(self, obj):
+        """
+        :param obj: if a list, the objects will be checked in a batch,
+               and the list of results returned
+        """
+        if isinstance(obj, list):
+            if self.deduper:
+                return self.deduper.exist_digests([labelize(o) for o in obj],
+                                                  [get_digest(o) for o in obj])
+            return [False] * len(obj)
+        
         if self.deduper:
-            return self.deduper.exist(str(obj))
+            return self.deduper.exist_digests([labelize(obj)], 
+                                              [get_digest(obj)])[0]
         return False
     
     def shutdown(self):
         if not self.inited: return
         
+        if self._flush_t is not None:
+            self._flush_stopped.set()
+            self._flush_t.join()
+        
         [store.shutdown() for store in self.priority_stores]
         for backup_store in self.backup_stores.values():
             backup_store.shutdown()
@@ -262,24 +489,54 @@ class MessageQueueNodeProxy(object):
 
     Besides, this class also maintains an instance of :class:`~cola.core.mq.distributor.Distributor`
     which holds a hash ring. To an object of `PUT` operation, the object should be distributed to
-    the destination according to the mechanism of the hash ring. Remember, a cache will be created
+    the destination according to the mechanism of the hash ring. Remember, the objects are
+    sent to each node in batches by a background :class:`~cola.core.mq.sender.BatchSender`
     to avoid the frequent write operations which may cause high burden of a message queue node.
     To `GET` operation, the mq will just fetch an object from the local node,
     or request from other nodes if local one's objects are exhausted.
+
+    The ``batch`` is a dict which decides the ``count`` of the objects and
+    the ``size`` in KB of a batch at most, the ``linger`` milliseconds
+    an object waits at most before sent, and the ``buffer`` count of the objects
+    pending for a node at most, the puts are blocked when the buffer is full.
+    If still full after the ``timeout`` seconds, e.g. the node is dead, the objects
+    are put into the local node instead, a negative ``timeout`` means waiting forever.
     """
     def __init__(self, base_dir, rpc_server, addr, addrs,
                  copies=1, n_priorities=3, deduper=None,
-                 app_name=None, logger=None):
+                 app_name=None, logger=None, durability=None,
+                 compress_threshold=None, segments=None,
+                 lease_timeout=DEFAULT_LEASE_SECONDS, store_cls=Store,
+                 canonicalizer=None, placement='ring', partitioner=None,
+                 batch=None):
         self.dir_ = base_dir
         self.addr_ = addr
         self.addrs = list(addrs)
         self.mq_node = LocalMessageQueueNode(
             base_dir, rpc_server, addr, addrs, 
             copies=copies, n_priorities=n_priorities, deduper=deduper,
-            app_name=app_name)
-        self.distributor = Distributor(addrs, copies=copies)
+            app_name=app_name, durability=durability,
+            compress_threshold=compress_threshold, segments=segments,
+            lease_timeout=lease_timeout, store_cls=store_cls)
+        self.distributor = Distributor(addrs, copies=copies,
+                                       canonicalizer=canonicalizer,
+                                       placement=placement,
+                                       partitioner=partitioner)
+        self.canonicalizer = canonicalizer
         self.logger = logger
         
+        batch = batch or {}
+        self.batch_count = batch.get('count', DEFAULT_BATCH_COUNT)
+        self.batch_size = batch.get('size', DEFAULT_BATCH_SIZE) * 1024
+        self.batch_linger = batch.get('linger', DEFAULT_LINGER_MS) / 1000.0
+        self.batch_buffer = batch.get('buffer', DEFAULT_BUFFER_COUNT)
+        self.batch_timeout = batch.get('timeout', DEFAULT_PUT_TIMEOUT)
+        if self.batch_timeout < 0:
+            self.batch_timeout = None
+        if self.batch_count <= 0 or self.batch_size <= 0 or \
+            self.batch_buffer <= 0:
+            raise ConfigurationError('batch count, size and buffer must be greater than 0')
+        
         self.prefix = get_rpc_prefix(app_name, 'mq')
         
         self._lock = threading.Lock()
@@ -294,35 +551,63 @@ class MessageQueueNodeProxy(object):
         with self._lock:
             if self.inited: return
             
-            self.load()
-            if not hasattr(self, 'caches'):
-                self.caches = dict((addr, []) for addr in self.addrs)
-            if not hasattr(self, 'caches_inited'):
-                self.caches_inited = dict((addr, False) for addr in self.addrs)
-            if not hasattr(self, 'backup_caches'):
-                self.backup_caches = dict((addr, {}) for addr in self.addrs)
-                for addr in self.addrs:
-                    for other_addr in [n for n in self.addrs if addr != n]:
-                        self.backup_caches[addr][other_addr] = []
-                
             self.mq_node.init()
+            self.senders = dict((addr, self._create_sender(addr)) \
+                                for addr in self.addrs)
+            self.load()
             self.inited = True
+            
+    def _create_sender(self, addr):
+        send = lambda objs: self._remote_or_local_batch_put(addr, objs)
+        send_backup = lambda backup_addr, objs: \
+            self._remote_or_local_put_backup(addr, backup_addr, objs)
+        return BatchSender(send, send_backup, max_count=self.batch_count,
+                           max_bytes=self.batch_size, linger=self.batch_linger,
+                           buffer_size=self.batch_buffer, logger=self.logger)
         
     def load(self):
+        """
+        The objects left unsent last time are put into the senders.
+        """
         save_file = os.path.join(self.dir_, MQ_STATUS_FILENAME)
         if not os.path.exists(save_file):
             return
         
         with open(save_file, 'r') as f:
-            self.caches, self.caches_inited, self.backup_caches = pickle.load(f)
+            caches, _, backup_caches = pickle.load(f)
+        for addr, objs in caches.iteritems():
+            # the objects of the nodes removed are kept locally
+            sender = self.senders.get(addr, self.senders[self.addr_])
+            sender.put(objs, block=False)
+        for addr, m in backup_caches.iteritems():
+            if addr not in self.senders:
+                continue
+            for backup_addr, objs in m.iteritems():
+                if backup_addr in self.addrs:
+                    self.senders[addr].put(objs, backup_addr=backup_addr, 
+                                           block=False)
+        os.remove(save_file)
     
     def save(self):
+        """
+        Save the objects which are not sent, 
+        the senders should have been stopped.
+        """
         if not self.inited:
             return
         
+        caches, backup_caches = {}, {}
+        for addr, sender in self.senders.iteritems():
+            caches[addr], backup_caches[addr] = sender.pending()
+        if sum(len(objs) for objs in caches.itervalues()) + \
+            sum(len(objs) for m in backup_caches.itervalues() \
+                for objs in m.itervalues()) == 0:
+            return
+        
         save_file = os.path.join(self.dir_, MQ_STATUS_FILENAME)
         with open(save_file, 'w') as f:
-            t = (self.caches, self.caches_inited, self.backup_caches)
+            # the same format as the caches of the old versions
+            t = (caches, dict((addr, True) for addr in caches), backup_caches)
             pickle.dump(t, f)
         
     def _check_empty(self, objs):
@@ -356,14 +641,24 @@ class MessageQueueNodeProxy(object):
         else:
             objs = pickle.loads(client_call(addr, self.prefix+'get', 
                                             size, priority))
-        
-        addr_caches = self.caches.get(addr, [])
-        if size == 1 and objs is None and len(addr_caches) > 0:
-            return addr_caches.pop(0)
-        elif size > 1 and len(objs) == 0 and len(addr_caches) > 0:
-            return addr_caches[:size]
-        
         return objs
+    
+    def _remote_or_local_get_leased(self, addr, size=1, priority=0, timeout=None):
+        if addr == self.addr_:
+            results = self.mq_node.get_leased(size=size, priority=priority, 
+                                              timeout=timeout)
+        else:
+            args = (size, priority) if timeout is None else \
+                    (size, priority, timeout)
+            results = pickle.loads(client_call(addr, self.prefix+'get_leased', 
+                                               *args))
+        return [('%s@%s' % (lease_id, addr), obj) for lease_id, obj in results]
+    
+    def _remote_or_local_lease_call(self, addr, func_name, lease_ids, *args):
+        if addr == self.addr_:
+            return getattr(self.mq_node, func_name)(lease_ids, *args)
+        else:
+            return client_call(addr, self.prefix+func_name, lease_ids, *args)
             
     def _remote_or_local_put_backup(self, addr, backup_addr, objs, 
                                     force=False):
@@ -385,51 +680,47 @@ class MessageQueueNodeProxy(object):
 
         :param objects: objects to put into mq, an object is mostly the instance of
                :class:`~cola.core.unit.Url` or :class:`~cola.core.unit.Bundle`
-        :param flush: flush out the cache all if set to true
+        :param flush: send all the objects pending and wait until sent if set to true
         """
         self.init()
         
         addrs_objs, backup_addrs_objs = \
             self.distributor.distribute(objects)
             
-        if flush is True:
-            for addr in self.addrs:
-                if addr not in addrs_objs:
-                    addrs_objs[addr] = []
-                if addr not in backup_addrs_objs:
-                    backup_addrs_objs[addr] = {}
-            
         for addr, objs in addrs_objs.iteritems():
-            self.caches[addr].extend(objs)
-            if not self.caches_inited[addr] or \
-                len(self.caches[addr]) >= CACHE_SIZE or flush:
-                try:
-                    self._remote_or_local_batch_put(addr, self.caches[addr])
-                except socket.error, e:
-                    if self.logger:
-                        self.logger.exception(e)
-                else:
-                    self.caches[addr] = []
-                
-            if not self.caches_inited[addr]:
-                self.caches_inited[addr] = True
-        
+            if not self.senders[addr].put(objs, timeout=self.batch_timeout):
+                self._spill(addr, objs)
         for addr, m in backup_addrs_objs.iteritems():
             for backup_addr, objs in m.iteritems():
-                self.backup_caches[addr][backup_addr].extend(objs)
+                if not self.senders[addr].put(objs, backup_addr=backup_addr,
+                                              timeout=self.batch_timeout):
+                    self._spill(addr, objs, backup_addr=backup_addr)
+                
+        if flush is True:
+            self._flush_senders()
             
-            size = sum([len(obs) for obs in \
-                            self.backup_caches[addr].values()])
-            if size >= CACHE_SIZE or flush:
-                for backup_addr, objs in self.backup_caches[addr].iteritems():
-                    try:
-                        self._remote_or_local_put_backup(
-                            addr, backup_addr, objs)
-                    except socket.error, e:
-                        if self.logger:
-                            self.logger.exception(e)
-                    else:
-                        self.backup_caches[addr][backup_addr] = []
+    def _spill(self, addr, objs, backup_addr=None):
+        """
+        Put the objects into the local node when the sender's buffer
+        of the node ``addr`` keeps full, the backups of the local node
+        itself are dropped since the objects are here.
+        """
+        if self.logger:
+            self.logger.warning('mq node %s is too slow, %s objects are put '
+                                'into the local node' % (addr, len(objs)))
+        if backup_addr is None:
+            self.mq_node.batch_put(objs)
+        elif backup_addr != self.addr_:
+            self.mq_node.put_backup(backup_addr, objs)
+            
+    def _flush_senders(self, timeout=None):
+        """
+        :return: True if there were objects pending
+        """
+        senders = [sender for sender in self.senders.values() if len(sender) > 0]
+        for sender in senders:
+            sender.flush(timeout=timeout)
+        return len(senders) > 0
             
     def get(self, size=1, priority=0):
         """
@@ -444,34 +735,127 @@ class MessageQueueNodeProxy(object):
         self.init()
         
         if size < 1: size = 1
+        def _get(addr, left):
+            objs = self._remote_or_local_get(addr, size=left, 
+                                             priority=priority)
+            if objs is None:
+                return []
+            if not isinstance(objs, list):
+                objs = [objs, ]
+            return objs
+        results = self._get_from_addrs(_get, size)
+        
+        if size == 1:
+            if len(results) == 0:
+                return
+            return results[0]
+        return results
+    
+    def get_leased(self, size=1, priority=0, timeout=None):
+        """
+        Like :func:`get`, but the objects are got with leases, each one
+        should be acknowledged by :func:`ack` when finished, or it will be
+        put back into the message queue after the timeout.
+
+        :param size: the objects wish to fetch
+        :param priority: the priority queue which wants to fetch from
+        :param timeout: seconds of the leases
+        :return: list of the ``(lease_id, obj)``
+        """
+        self.init()
+        
+        if size < 1: size = 1
+        _get = lambda addr, left: self._remote_or_local_get_leased(
+            addr, size=left, priority=priority, timeout=timeout)
+        return self._get_from_addrs(_get, size)
+    
+    def _get_from_addrs(self, get, size):
+        """
+        Fetch from the local node first, then the other nodes.
+        If not enough, the objects pending in the senders are
+        sent at once and fetched again.
+        """
         results = []
         _addrs = sorted(self.addrs, key=lambda k: k==self.addr_, 
                              reverse=True)
         
-        for addr in _addrs:
-            left = size - len(results)
-            if left <= 0:
+        for i in range(2):
+            if i > 0 and not self._flush_senders():
                 break
             
-            objs = None
+            for addr in _addrs:
+                left = size - len(results)
+                if left <= 0:
+                    return results
+                
+                try:
+                    results.extend(get(addr, left))
+                except socket.error, e:
+                    if self.logger:
+                        self.logger.exception(e)
+        return results
+    
+    def get_inc_leased(self, size=1, timeout=None):
+        return [('%s@%s' % (lease_id, self.addr_), obj) for lease_id, obj \
+                in self.mq_node.get_inc_leased(size=size, timeout=timeout)]
+    
+    def _call_leases(self, func_name, lease_ids, *args):
+        if isinstance(lease_ids, basestring):
+            lease_ids = [lease_ids, ]
+        
+        addrs_lease_ids = defaultdict(list)
+        for lease_id in lease_ids:
+            node_lease_id, _, addr = lease_id.rpartition('@')
+            addrs_lease_ids[addr].append(node_lease_id)
+            
+        count = 0
+        for addr, ids in addrs_lease_ids.iteritems():
+            if addr not in self.addrs:
+                continue
             try:
-                objs = self._remote_or_local_get(addr, size=left, 
-                                                 priority=priority)
+                count += self._remote_or_local_lease_call(addr, func_name, 
+                                                          ids, *args)
             except socket.error, e:
                 if self.logger:
                     self.logger.exception(e)
-                    
-            if objs is None:
-                continue
-            if not isinstance(objs, list):
-                objs = [objs, ]
-            results.extend(objs)
+        return count
+    
+    def ack(self, lease_ids):
+        """
+        Acknowledge that the objects got by :func:`get_leased` are finished.
+
+        :param lease_ids: a lease id or the list of lease ids
+        :return: count of the leases acknowledged
+        """
+        self.init()
         
-        if size == 1:
-            if len(results) == 0:
-                return
-            return results[0]
-        return results
+        return self._call_leases('ack', lease_ids)
+    
+    def nack(self, lease_ids):
+        """
+        Put the objects got by :func:`get_leased` back at once.
+
+        :param lease_ids: a lease id or the list of lease ids
+        :return: count of the objects put back
+        """
+        self.init()
+        
+        return self._call_leases('nack', lease_ids)
+    
+    def renew(self, lease_ids, timeout=None):
+        """
+        Extend the leases of the objects got by :func:`get_leased`
+        which are still being handled, so that they are not put back.
+
+        :param lease_ids: a lease id or the list of lease ids
+        :param timeout: seconds of the leases from now,
+               ``lease_timeout`` of the storages as default
+        :return: count of the leases renewed
+        """
+        self.init()
+        
+        args = () if timeout is None else (timeout, )
+        return self._call_leases('renew', lease_ids, *args)
     
     def put_inc(self, objs):
         self.mq_node.put_inc(objs)
@@ -489,17 +873,17 @@ class MessageQueueNodeProxy(object):
         
         self.distributor.add_node(addr)
         self.addrs.append(addr)
-                
-        self.caches[addr] = []
-        self.caches_inited[addr] = False
-        self.backup_caches[addr] = {}
-        for o_addr in self.addrs:
-            if o_addr != addr:
-                self.backup_caches[addr][o_addr] = []
-                self.backup_caches[o_addr][addr] = []
+        self.senders[addr] = self._create_sender(addr)
                 
         self.mq_node.add_node(addr)
     
+    def set_weights(self, weights):
+        """
+        Set the weights of the mq nodes deciding their shares of the objects,
+        refer to :func:`~cola.core.mq.distributor.Distributor.set_weights`.
+        """
+        self.distributor.set_weights(weights)
+    
     def remove_node(self, addr):
         if addr not in self.addrs: return
         
@@ -507,16 +891,14 @@ class MessageQueueNodeProxy(object):
         
         self.distributor.remove_node(addr)
         self.addrs.remove(addr)
-                
-        self.mq_node.batch_put(self.caches[addr])
-        del self.caches[addr]
-        del self.caches_inited[addr]
-        del self.backup_caches[addr]
-        for o_addr in self.addrs:
-            if o_addr != addr:
-                del self.backup_caches[o_addr][addr]
-         
-        self.flush()
+        
+        # the removed node may be unreachable, so the flush will not wait long
+        self._flush_senders(timeout=STOP_SENDER_TIMEOUT)
+        sender = self.senders.pop(addr)
+        sender.stop(timeout=STOP_SENDER_TIMEOUT)
+        self.mq_node.batch_put(sender.pending()[0])
+        for o_sender in self.senders.itervalues():
+            o_sender.discard_backups(addr)
         
         BATCH_SIZE = 10
         objs = self.mq_node.get_backup(addr, size=BATCH_SIZE)
@@ -527,13 +909,25 @@ class MessageQueueNodeProxy(object):
         self.mq_node.remove_node(addr)
         
     def exist(self, obj):
+        """
+        :param obj: if a list, all the objects are checked by the deduper
+               in a single call, and the list of results returned
+        """
+        if self.canonicalizer is not None:
+            if isinstance(obj, list):
+                obj = [self.canonicalizer(o) for o in obj]
+            else:
+                obj = self.canonicalizer(obj)
         return self.mq_node.exist(obj)
     
     def shutdown(self):
         if not self.inited: return
         
-        self.mq_node.shutdown()
+        # the senders may put into the local node, so stop them first
+        for sender in self.senders.itervalues():
+            sender.stop(timeout=STOP_SENDER_TIMEOUT)
         self.save()
+        self.mq_node.shutdown()
         
     def __enter__(self):
         return self
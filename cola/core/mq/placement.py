@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-28
+
+@author: chine
+'''
+
+import math
+import struct
+import hashlib
+import heapq
+
+MASK_64 = 0xffffffffffffffff
+GOLDEN_GAMMA = 0x9e3779b97f4a7c15
+JUMP_MULTIPLIER = 2862933155777618773
+
+
+def mix64(num):
+    """
+    The finalizer of the splitmix64, mixes a 64-bit integer well
+    with only a few multiplies.
+    """
+    num = ((num ^ (num >> 30)) * 0xbf58476d1ce4e5b9) & MASK_64
+    num = ((num ^ (num >> 27)) * 0x94d049bb133111eb) & MASK_64
+    return num ^ (num >> 31)
+
+def jump_hash(key, n_buckets):
+    """
+    The jump consistent hash by Lamping and Veach,
+    maps the 64-bit key to a bucket in ``[0, n_buckets)``.
+    """
+    b, j = -1, 0
+    while j < n_buckets:
+        b = j
+        key = (key * JUMP_MULTIPLIER + 1) & MASK_64
+        j = int((b + 1) * (2147483648.0 / ((key >> 33) + 1)))
+    return b
+
+def hash64(key, digest=None):
+    """
+    The 64-bit hash of the key, taken from the md5 digest,
+    the ``digest`` is used if it has been computed.
+    """
+    if digest is None:
+        digest = hashlib.md5(key).digest()
+    # the first 8 bytes are the fingerprint of the deduper
+    return struct.unpack_from('<Q', digest, 8)[0]
+
+
+class Placement(object):
+    """
+    Decides the nodes for the keys without materializing a ring, so
+    a node added or removed is applied in place instead of rebuilding.
+    The interface is the same as :class:`~cola.core.mq.hash_ring.HashRing`.
+    """
+    def __init__(self, nodes=None, weights=None):
+        self.nodes = []
+        self.weights = dict(weights or {})
+        for node in nodes or []:
+            self.add_node(node)
+
+    def get_node(self, string_key, digest=None):
+        for node in self.iterate_nodes(string_key, digest=digest):
+            return node
+
+    def get_nodes(self, string_key, size, digest=None):
+        """
+        :return: tuple of at most ``size`` distinct nodes for the key
+        """
+        raise NotImplementedError
+
+    def iterate_nodes(self, string_key, distinct=True, digest=None):
+        return iter(self.get_nodes(string_key, len(self.nodes), digest=digest))
+
+    def add_node(self, node):
+        raise NotImplementedError
+
+    def remove_node(self, node):
+        raise NotImplementedError
+
+    def set_weights(self, weights):
+        raise NotImplementedError
+
+
+class JumpHash(Placement):
+    """
+    Places the keys by the :func:`jump_hash`, which costs
+    O(log n) per key and no memory besides the nodes list.
+
+    The buckets are the positions in the nodes list, so the nodes
+    must be added and removed in the same order on all the workers.
+    A removed node's position is taken by the last node, hence the keys
+    of both the removed node and the last one are moved.
+    The weights are not supported.
+    """
+    def __init__(self, nodes=None, weights=None):
+        if weights:
+            raise ValueError('Weights are not supported by the jump hash.')
+        super(JumpHash, self).__init__(nodes)
+
+    def get_nodes(self, string_key, size, digest=None):
+        nodes = self.nodes
+        n_nodes = len(nodes)
+        key = hash64(string_key, digest=digest)
+        if size == 1 and n_nodes > 0:
+            return (nodes[jump_hash(key, n_nodes)], )
+        if size == 2 and n_nodes > 1:
+            pos = jump_hash(key, n_nodes)
+            next_pos = jump_hash(mix64((key + GOLDEN_GAMMA) & MASK_64), n_nodes - 1)
+            if next_pos == pos:
+                next_pos = n_nodes - 1
+            return nodes[pos], nodes[next_pos]
+
+        # the distinct nodes are picked from the rest ones
+        # like the Fisher-Yates shuffle, the swaps are kept in a dict
+        results, swaps = [], {}
+        for i in xrange(min(size, n_nodes)):
+            if i > 0:
+                key = mix64((key + i * GOLDEN_GAMMA) & MASK_64)
+            pos = jump_hash(key, n_nodes - i)
+            last = n_nodes - i - 1
+            results.append(nodes[swaps.get(pos, pos)])
+            swaps[pos] = swaps.get(last, last)
+        return tuple(results)
+
+    def add_node(self, node):
+        if node not in self.nodes:
+            self.nodes.append(node)
+
+    def remove_node(self, node):
+        if node not in self.nodes:
+            return
+        pos = self.nodes.index(node)
+        last = self.nodes.pop()
+        if pos < len(self.nodes):
+            self.nodes[pos] = last
+
+    def set_weights(self, weights):
+        if weights:
+            raise ValueError('Weights are not supported by the jump hash.')
+
+
+class RendezvousHash(Placement):
+    """
+    The weighted rendezvous (highest random weight) hashing, each node
+    scores the key by mixing the key's hash and its own, and the ones
+    of the highest scores are chosen. With the weights, the score is
+    ``-weight / ln(hash)`` so that a node gets the keys in proportion
+    to its weight.
+
+    It costs O(n) per key, but the placement never depends on the order
+    of the nodes, and only the keys of the node added or removed are moved.
+    When a node's weight changes, only the keys won or lost by
+    that node are moved.
+    """
+    def __init__(self, nodes=None, weights=None):
+        self.node_hashes = []
+        self.weighted = False
+        super(RendezvousHash, self).__init__(nodes, weights=weights)
+
+    def _update_weighted(self):
+        # the plain hashes are compared if all the weights are equal
+        self.weighted = len(set(self.weights.get(node, 1) \
+                                for node in self.nodes)) > 1
+
+    def _score(self, num, weight):
+        return -weight / math.log((num + .5) / (MASK_64 + 1.))
+
+    def get_nodes(self, string_key, size, digest=None):
+        key = hash64(string_key, digest=digest)
+        scores = []
+        # the mix64 is inlined since it is called for every node
+        for node_hash, node in self.node_hashes:
+            num = key ^ node_hash
+            num = ((num ^ (num >> 30)) * 0xbf58476d1ce4e5b9) & MASK_64
+            num = ((num ^ (num >> 27)) * 0x94d049bb133111eb) & MASK_64
+            scores.append((num ^ (num >> 31), node))
+        if self.weighted:
+            weights, score = self.weights, self._score
+            scores = [(score(num, weights.get(node, 1)), node) \
+                      for num, node in scores]
+
+        if size == 1 and scores:
+            return (max(scores)[1], )
+        return tuple(node for _, node in heapq.nlargest(size, scores))
+
+    def add_node(self, node):
+        if node not in self.nodes:
+            self.nodes.append(node)
+            self.node_hashes.append((hash64(str(node)), node))
+        self._update_weighted()
+
+    def remove_node(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        self.node_hashes = [(node_hash, n) for node_hash, n \
+                            in self.node_hashes if n != node]
+        self.weights.pop(node, None)
+        self._update_weighted()
+
+    def set_weights(self, weights):
+        """
+        :param weights: dict from the node to its weight,
+               the nodes not in it are weighted 1
+        """
+        self.weights = dict(weights)
+        self._update_weighted()
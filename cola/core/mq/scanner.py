@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-24
+
+@author: chine
+'''
+
+import os
+import re
+import math
+import mmap
+import random
+import struct
+import zlib
+from collections import defaultdict
+
+from cola.core.mq.store import LEGAL_STORE_FILE_REGEX, STORE_FILE_MAGIC, \
+    STORE_FILE_VERSION, HEADER_FORMAT, HEADER_SIZE, \
+    RECORD_HEADER_FORMAT, RECORD_HEADER_SIZE
+from cola.core.mq.codec import Codecs, URL, MARSHAL, PICKLE, COMPRESSED
+
+HOST_PATTERN = r'[a-zA-Z][a-zA-Z0-9+.\-]*://(?:[^@/?#]*@)?([^:/?#]*)'
+HOST_REGEX = re.compile(HOST_PATTERN)
+# the host of a record is matched in place, in front of the url is
+# the varint priority and the flags for the url codec,
+# or the type and length of the string for the marshal
+RECORD_HOST_REGEX = re.compile(
+    r'(?:%s[\x80-\xff]*[\x00-\x7f][\x00-\x03]|%s[stu][\x00-\xff]{4})%s' % \
+    (URL, MARSHAL, HOST_PATTERN), re.DOTALL)
+RAW_PREFIX_SIZE = 32 # bytes of the undecodable record shown
+
+
+class UndecodableRecord(object):
+    """
+    The record failed to decode, e.g. the pickled object of a class
+    which cannot be imported, only its type, length and raw prefix are kept.
+    """
+    __slots__ = ('type', 'length', 'prefix', 'error')
+
+    def __init__(self, data, error):
+        self.type = data[:1]
+        self.length = len(data)
+        self.prefix = data[1:RAW_PREFIX_SIZE+1]
+        self.error = error
+
+    def __repr__(self):
+        return '<undecodable record type=%r length=%s prefix=%r error=%r>' % \
+            (self.type, self.length, self.prefix, self.error)
+
+
+class StoreScanner(object):
+    """
+    Read-only scanner of the store files written by
+    :class:`~cola.core.mq.store.Store`. The files are mapped with
+    ``ACCESS_READ``, and the records are walked by ``struct.unpack_from``
+    on the map, so nothing is copied unless the record is decoded,
+    and the store files are never changed.
+
+    The store files of old versions are skipped, they will be migrated
+    when the store initialized next time.
+    """
+    def __init__(self, working_dir, verify=False):
+        """
+        :param working_dir: directory of a single store
+        :param verify: check the crc32 of every record if True
+        """
+        self.dir_ = working_dir
+        self.verify = verify
+        self.codecs = Codecs()
+
+        self.skipped_files = []
+        self.broken_files = []
+
+    def files(self):
+        """
+        :return: the store files from the oldest to the newest
+        """
+        files = [fi for fi in os.listdir(self.dir_) \
+                 if LEGAL_STORE_FILE_REGEX.match(fi) is not None]
+        return [os.path.join(self.dir_, fi) for fi in \
+                sorted(files, key=lambda fi: int(fi), reverse=True)]
+
+    def iter_file(self, m):
+        """
+        Iterate the records of a mapped store file.
+
+        :return: iterator of ``(start, end)`` of the encoded objects
+        """
+        _, _, read_pos, write_pos = struct.unpack_from(HEADER_FORMAT, m)[:4]
+        pos, write_pos = max(read_pos, HEADER_SIZE), min(write_pos, len(m))
+        while pos + RECORD_HEADER_SIZE <= write_pos:
+            length, crc = struct.unpack_from(RECORD_HEADER_FORMAT, m, pos)
+            start = pos + RECORD_HEADER_SIZE
+            end = start + length
+            if length == 0 or end > write_pos:
+                break
+            if self.verify and \
+                zlib.crc32(buffer(m, start, length)) & 0xffffffff != crc:
+                raise ValueError('Broken record at offset %s' % pos)
+            yield start, end
+            pos = end
+
+    def iter_maps(self):
+        """
+        Map the store files one by one, the map is only valid before
+        the next one is yielded.
+        """
+        for file_path in self.files():
+            if os.path.getsize(file_path) < HEADER_SIZE:
+                self.skipped_files.append(file_path)
+                continue
+            with open(file_path, 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    if m[:len(STORE_FILE_MAGIC)] != STORE_FILE_MAGIC or \
+                        ord(m[len(STORE_FILE_MAGIC)]) != STORE_FILE_VERSION:
+                        self.skipped_files.append(file_path)
+                        continue
+                    yield file_path, m
+                finally:
+                    m.close()
+
+    def count(self):
+        """
+        Count the records by the headers only, without walking them.
+
+        :return: dict of the ``files``, ``messages`` and ``bytes``
+        """
+        self.skipped_files, self.broken_files = [], []
+        n_files = n_messages = n_bytes = 0
+        for _, m in self.iter_maps():
+            _, _, read_pos, write_pos, _, _, read_count, write_count = \
+                struct.unpack_from(HEADER_FORMAT, m)
+            n_files += 1
+            n_messages += write_count - read_count
+            n_bytes += write_pos - read_pos
+        return {'files': n_files, 'messages': n_messages, 'bytes': n_bytes,
+                'skipped': list(self.skipped_files)}
+
+    def iter_records(self):
+        """
+        :return: iterator of ``(map, start, end)`` of the encoded objects
+        """
+        for file_path, m in self.iter_maps():
+            try:
+                for start, end in self.iter_file(m):
+                    yield m, start, end
+            except ValueError:
+                self.broken_files.append(file_path)
+
+    def _decode(self, data):
+        try:
+            return self.codecs.decode(data)
+        except Exception, e:
+            return UndecodableRecord(data, '%s: %s' % (e.__class__.__name__, e))
+
+    def decode(self, m, start, end):
+        """
+        :return: the object, or :class:`UndecodableRecord` if failed to decode
+        """
+        return self._decode(m[start:end])
+
+    def host(self, m, start, end, decode=False):
+        """
+        Get the host of the url record without decoding it.
+
+        :param decode: if True, the pickled objects will be decoded
+               to find the host from their ``url`` attribute
+        """
+        res = RECORD_HOST_REGEX.match(m, start, end)
+        if res is not None:
+            return res.group(1).lower()
+
+        if decode and m[start] in (PICKLE, COMPRESSED):
+            host = self._obj_host(self.decode(m, start, end))
+            if host is not None:
+                return host.lower()
+
+    def _obj_host(self, obj):
+        url = getattr(obj, 'url', obj)
+        if isinstance(url, basestring):
+            res = HOST_REGEX.match(url)
+            if res is not None:
+                return res.group(1)
+
+    def summarize(self, n_hosts=10, n_samples=5, decode=False, seed=None):
+        """
+        Walk all the records once.
+
+        :param n_hosts: count of the top hosts
+        :param n_samples: count of the records sampled uniformly
+        :param decode: refer to :func:`host`
+        :return: dict of the ``files``, ``messages``, ``bytes``, ``types``,
+                 ``sizes`` which is the histogram keyed by the power of 2
+                 upper bound, ``hosts``, ``samples``, ``undecodable`` which
+                 is the count of the records failed to decode among the ones
+                 decoded, ``skipped`` and ``broken``
+        """
+        self.skipped_files, self.broken_files = [], []
+        rand = random.Random(seed)
+        n_files = n_messages = n_bytes = 0
+        types = defaultdict(int)
+        sizes = defaultdict(int)
+        hosts = defaultdict(int)
+        # the samples are ``(record key, data)``, the record key is
+        # ``(file_path, start)`` to count the undecodable records once
+        samples = []
+        undecodable = set()
+        # the reservoir sampling by skips, so the random numbers are
+        # generated only when the sample replaced
+        skip = lambda w: int(math.log(rand.random() or 1e-300) / math.log(1 - w))
+        weight = math.exp(math.log(rand.random() or 1e-300) / max(n_samples, 1))
+        next_sample = n_samples + skip(weight)
+        match_host = RECORD_HOST_REGEX.match
+
+        for file_path, m in self.iter_maps():
+            n_files += 1
+            try:
+                for start, end in self.iter_file(m):
+                    length = end - start
+                    n_messages += 1
+                    n_bytes += RECORD_HEADER_SIZE + length
+                    types[m[start]] += 1
+                    sizes[1 << (length - 1).bit_length()] += 1
+
+                    if n_hosts > 0:
+                        res = match_host(m, start, end)
+                        if res is not None:
+                            # lowered when counted up
+                            hosts[res.group(1)] += 1
+                        elif decode and m[start] in (PICKLE, COMPRESSED):
+                            obj = self.decode(m, start, end)
+                            if isinstance(obj, UndecodableRecord):
+                                undecodable.add((file_path, start))
+                            else:
+                                host = self._obj_host(obj)
+                                if host is not None:
+                                    hosts[host] += 1
+
+                    # the record is copied only if chosen
+                    if n_messages <= n_samples:
+                        samples.append(((file_path, start), m[start:end]))
+                    elif n_messages - 1 == next_sample and n_samples > 0:
+                        samples[rand.randrange(n_samples)] = \
+                            ((file_path, start), m[start:end])
+                        weight *= math.exp(math.log(rand.random() or 1e-300) / n_samples)
+                        next_sample += skip(weight) + 1
+            except ValueError:
+                self.broken_files.append(file_path)
+
+        decoded_samples = []
+        for key, data in samples:
+            obj = self._decode(data)
+            if isinstance(obj, UndecodableRecord):
+                undecodable.add(key)
+            decoded_samples.append(obj)
+
+        lowered_hosts = defaultdict(int)
+        for host, count in hosts.iteritems():
+            lowered_hosts[host.lower()] += count
+        top_hosts = sorted(lowered_hosts.iteritems(), key=lambda it: (-it[1], it[0]))
+        return {'files': n_files,
+                'messages': n_messages,
+                'bytes': n_bytes,
+                'types': dict(types),
+                'sizes': dict(sizes),
+                'hosts': top_hosts[:n_hosts],
+                'samples': decoded_samples,
+                'undecodable': len(undecodable),
+                'skipped': list(self.skipped_files),
+                'broken': list(self.broken_files)}
+
+
+def find_store_dirs(path):
+    """
+    Find the directories which contain store files under the path,
+    e.g. the ``mq`` directory of a job.
+    """
+    store_dirs = []
+    for dir_path, _, file_names in os.walk(path):
+        if any(LEGAL_STORE_FILE_REGEX.match(fn) is not None \
+               for fn in file_names):
+            store_dirs.append(dir_path)
+    return sorted(store_dirs)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-30
+
+@author: chine
+'''
+
+import time
+import threading
+from collections import deque, defaultdict
+
+from cola.core.mq.utils import labelize
+
+DEFAULT_BATCH_COUNT = 200
+DEFAULT_BATCH_SIZE = 1024 # KB
+DEFAULT_LINGER_MS = 100
+DEFAULT_BUFFER_COUNT = 10000
+DEFAULT_PUT_TIMEOUT = 10 # seconds
+RETRY_INTERVAL = 1 # seconds before sending again after failed
+
+
+class BatchSender(object):
+    """
+    Send the objects put into the mq to a single node in batches
+    by a background thread, so that the puts return at once.
+
+    A batch is sent when the objects pending reach ``max_count``
+    or ``max_bytes``, or the oldest one has waited for ``linger`` seconds.
+    The bytes are estimated by the labels of the objects, e.g. the urls.
+    If more than ``buffer_size`` objects are pending, the puts are blocked
+    until the objects are sent, or the timeout passed if set.
+
+    The objects failed to send are kept in order and sent again later,
+    the ones left when stopped can be got by :func:`pending`, including
+    the batch being sent if the sending thread is not finished.
+    """
+    def __init__(self, send, send_backup, max_count=DEFAULT_BATCH_COUNT,
+                 max_bytes=DEFAULT_BATCH_SIZE*1024,
+                 linger=DEFAULT_LINGER_MS/1000.0,
+                 buffer_size=DEFAULT_BUFFER_COUNT, logger=None):
+        """
+        :param send: function to send the objects to the node
+        :param send_backup: function to send the backup objects of
+               the ``backup_addr`` to the node
+        :param max_count: objects of a batch at most
+        :param max_bytes: estimated bytes of a batch at most
+        :param linger: seconds an object waits at most before sent
+        :param buffer_size: objects pending at most before the puts blocked
+        """
+        self.send = send
+        self.send_backup = send_backup
+        self.max_count = max(max_count, 1)
+        self.max_bytes = max(max_bytes, 1)
+        self.linger = linger
+        self.buffer_size = max(buffer_size, 1)
+        self.logger = logger
+
+        self.cond = threading.Condition()
+        # the items are ``(backup_addr, obj, n_bytes)``,
+        # the ``backup_addr`` is None for the objects put into the node
+        self.items = deque()
+        self.n_bytes = 0
+        self.first_time = None
+        # the items of the batch being sent
+        self.sending = []
+        self.n_flushing = 0
+        self.n_failures = 0
+        self.stopped = False
+
+        self.sender_t = threading.Thread(target=self._run)
+        self.sender_t.setDaemon(True)
+        self.sender_t.start()
+
+    def put(self, objs, backup_addr=None, block=True, timeout=None):
+        """
+        :param backup_addr: if set, the objects are the backups of this node
+        :param block: wait if the buffer is full
+        :param timeout: seconds to wait at most if block, None means forever
+        :return: False if the buffer is still full after the ``timeout``
+                 seconds, then the objects are not put
+        """
+        if len(objs) == 0:
+            return True
+
+        items = [(backup_addr, obj, len(labelize(obj))) for obj in objs]
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.cond:
+            while block and not self.stopped and \
+                len(self.items) >= self.buffer_size:
+                if deadline is None:
+                    self.cond.wait()
+                    continue
+                left = deadline - time.time()
+                if left <= 0:
+                    return False
+                self.cond.wait(left)
+
+            first = len(self.items) == 0
+            if first:
+                self.first_time = time.time()
+            self.items.extend(items)
+            self.n_bytes += sum(item[2] for item in items)
+            # the sending thread waits without timeout when nothing pending
+            if first or len(self.items) >= self.max_count or \
+                self.n_bytes >= self.max_bytes:
+                self.cond.notify_all()
+            return True
+
+    def _ready(self):
+        if len(self.items) == 0:
+            return False
+        return self.stopped or self.n_flushing > 0 or \
+            len(self.items) >= self.max_count or \
+            self.n_bytes >= self.max_bytes or \
+            time.time() - self.first_time >= self.linger
+
+    def _take(self):
+        batch, n_bytes = [], 0
+        while len(self.items) > 0 and len(batch) < self.max_count:
+            if len(batch) > 0 and n_bytes + self.items[0][2] > self.max_bytes:
+                break
+            item = self.items.popleft()
+            batch.append(item)
+            n_bytes += item[2]
+        self.n_bytes -= n_bytes
+        self.first_time = time.time() if len(self.items) > 0 else None
+        return batch
+
+    def _send(self, batch):
+        """
+        :return: the items failed to send
+        """
+        objs, backups = [], defaultdict(list)
+        for backup_addr, obj, _ in batch:
+            if backup_addr is None:
+                objs.append(obj)
+            else:
+                backups[backup_addr].append(obj)
+
+        failed = set()
+        for backup_addr, backup_objs in [(None, objs)] + backups.items():
+            if len(backup_objs) == 0:
+                continue
+            try:
+                if backup_addr is None:
+                    self.send(backup_objs)
+                else:
+                    self.send_backup(backup_addr, backup_objs)
+            except Exception, e:
+                failed.add(backup_addr)
+                if self.logger:
+                    self.logger.exception(e)
+        return [item for item in batch if item[0] in failed]
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self._ready():
+                    if self.stopped:
+                        return
+                    timeout = None
+                    if len(self.items) > 0:
+                        timeout = self.first_time + self.linger - time.time()
+                    self.cond.wait(timeout)
+                batch = self.sending = self._take()
+                self.cond.notify_all()
+
+            failed = self._send(batch)
+
+            with self.cond:
+                self.sending = []
+                if len(failed) > 0:
+                    self.n_failures += 1
+                    # put back in order and wait before sending again
+                    self.items.extendleft(reversed(failed))
+                    self.n_bytes += sum(item[2] for item in failed)
+                    self.first_time = time.time()
+                self.cond.notify_all()
+                if len(failed) > 0:
+                    if self.stopped:
+                        return
+                    self.cond.wait(RETRY_INTERVAL)
+
+    def flush(self, timeout=None):
+        """
+        Send all the objects pending at once, and wait until they are sent,
+        or failed to send, or the ``timeout`` seconds passed.
+
+        :return: True if all the objects are sent
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.cond:
+            n_failures = self.n_failures
+            self.n_flushing += 1
+            self.cond.notify_all()
+            try:
+                while (len(self.items) > 0 or len(self.sending) > 0) and \
+                    self.n_failures == n_failures and self.sender_t.is_alive():
+                    if deadline is None:
+                        self.cond.wait()
+                    else:
+                        left = deadline - time.time()
+                        if left <= 0:
+                            break
+                        self.cond.wait(left)
+                return len(self.items) == 0 and len(self.sending) == 0
+            finally:
+                self.n_flushing -= 1
+
+    def stop(self, timeout=None):
+        """
+        Stop after the objects pending are tried to send once,
+        the ones failed are left in :func:`pending`, so are the ones
+        being sent if the ``timeout`` seconds passed.
+        """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.sender_t.join(timeout)
+
+    def pending(self):
+        """
+        :return: tuple of the objects pending and
+                 the dict from the backup address to the backups pending
+        """
+        with self.cond:
+            objs, backups = [], defaultdict(list)
+            for backup_addr, obj, _ in self.sending + list(self.items):
+                if backup_addr is None:
+                    objs.append(obj)
+                else:
+                    backups[backup_addr].append(obj)
+            return objs, dict(backups)
+
+    def discard_backups(self, backup_addr):
+        """
+        Discard the backups of the node pending, e.g. when it is removed.
+        """
+        with self.cond:
+            self.items = deque(item for item in self.items \
+                               if item[0] != backup_addr)
+            self.n_bytes = sum(item[2] for item in self.items)
+            self.cond.notify_all()
+
+    def __len__(self):
+        with self.cond:
+            return len(self.items) + len(self.sending)
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-20
+
+@author: chine
+'''
+
+import os
+import threading
+import time
+import uuid
+import sqlite3
+
+from cola.core.utils import iterable
+from cola.core.mq.store import BaseStore, DEFAULT_LEASE_SECONDS, \
+    DURABILITY_OS
+
+SQLITE_STORE_FILENAME = 'store.db'
+
+
+class SqliteStore(BaseStore):
+    """
+    The storage built on the SQLite in WAL mode. The objects are kept
+    in the ``queue`` table ordered by the rowid, the ones got with leases
+    are moved into the ``inflight`` table until acknowledged.
+
+    The objects of a single put or get are handled in one transaction
+    which is committed at once, so a crash loses nothing committed.
+    How the commits are synced to the disk is decided by the ``PRAGMA
+    synchronous``: ``FULL`` if flushing every time, ``OFF`` under the ``os``
+    durability, or else ``NORMAL``, then the WAL is synced when checkpointed
+    every ``flush_every`` operations or by :func:`flush`. Unlike the mmap storage,
+    the objects can be peeked by :func:`peek`, and the ones put back
+    by :func:`nack` keep their positions in the queue.
+    """
+    def __init__(self, working_dir, deduper=None, mkdirs=False,
+                 flush_every=1, compress_threshold=None,
+                 lease_timeout=DEFAULT_LEASE_SECONDS, durability=None, **kwargs):
+        """
+        :param working_dir: working directory of this storage
+        :param deduper: instance of :class:`~cola.core.dedup.Deduper`
+        :param mkdirs: force to make the working directory if True
+        :param flush_every: the puts or gets before the WAL is checkpointed,
+               1 means syncing every commit, 0 means only when :func:`flush`
+        :param compress_threshold: if set, the pickled objects larger than it
+               will be compressed
+        :param lease_timeout: default seconds before the objects got
+               by :func:`get_leased` are put back if not acknowledged
+        :param durability: the durability mode of the mq, nothing is synced
+               by the SQLite under the ``os`` mode
+        """
+        super(SqliteStore, self).__init__(working_dir, deduper=deduper,
+                                          mkdirs=mkdirs,
+                                          compress_threshold=compress_threshold)
+        self.lock = threading.Lock()
+        self.flush_every = flush_every
+        self.lease_timeout = lease_timeout
+        self.durability = durability
+        self.unsynced = 0
+
+        self.db_file = os.path.join(self.dir_, SQLITE_STORE_FILENAME)
+        self.conn = None
+
+        self.n_messages = self.n_bytes = self.n_inflight = 0
+
+        self.stopped = False
+        self.inited = False
+
+    def init(self):
+        with self.lock:
+            if self.inited: return
+
+            self.conn = sqlite3.connect(self.db_file, isolation_level=None,
+                                        check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=%s' % self._synchronous())
+            # the rowid will never be reused, so the object put back
+            # can take its original position
+            self.conn.execute('CREATE TABLE IF NOT EXISTS queue ('
+                              'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                              'data BLOB NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS inflight ('
+                              'lease_id TEXT PRIMARY KEY, '
+                              'id INTEGER NOT NULL, '
+                              'deadline REAL NOT NULL, '
+                              'data BLOB NOT NULL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS inflight_deadline '
+                              'ON inflight (deadline)')
+
+            self._load_counts()
+
+            self.inited = True
+
+    def _load_counts(self):
+        self.n_messages, self.n_bytes = self.conn.execute(
+            'SELECT count(*), ifnull(sum(length(data)), 0) FROM queue').fetchone()
+        self.n_inflight, = self.conn.execute(
+            'SELECT count(*) FROM inflight').fetchone()
+
+    def _synchronous(self):
+        if self.durability == DURABILITY_OS:
+            return 'OFF'
+        # the WAL is synced on every commit only if flushing every time
+        return 'FULL' if self.flush_every == 1 else 'NORMAL'
+
+    def _transact(self, func, *args):
+        """
+        Call the function in a transaction which is committed at once,
+        or rolled back if failed.
+
+        :param func: returns the tuple of the result and
+               the count of operations done
+        :return: the result of the function
+        """
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            result, ops = func(*args)
+        except:
+            self.conn.execute('ROLLBACK')
+            # the counts may have been changed before failed
+            self._load_counts()
+            raise
+        self.conn.execute('COMMIT')
+
+        self.unsynced += ops
+        if self.flush_every > 1 and self.unsynced >= self.flush_every:
+            self._flush()
+        return result
+
+    def _flush(self):
+        if self.unsynced > 0:
+            # the WAL is synced before checkpointed
+            self.conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        self.unsynced = 0
+
+    def flush(self):
+        """
+        Force the commits to be synced to the disk.
+        """
+        if self.stopped or not self.inited: return
+
+        with self.lock:
+            self._flush()
+
+    def shutdown(self):
+        if self.stopped: return
+        self.stopped = True
+
+        with self.lock:
+            if self.conn is not None:
+                self._flush()
+                self.conn.close()
+                self.conn = None
+        self.inited = False
+
+    def _write(self, obj_strs):
+        self.conn.executemany('INSERT INTO queue (data) VALUES (?)',
+                              [(sqlite3.Binary(obj_str), ) for obj_str in obj_strs])
+        self.n_messages += len(obj_strs)
+        self.n_bytes += sum(len(obj_str) for obj_str in obj_strs)
+
+    def _read(self, size):
+        """
+        Remove at most ``size`` rows from the head of the queue.
+
+        :return: list of the ``(id, obj_str)``
+        """
+        rows = self.conn.execute('SELECT id, data FROM queue ORDER BY id LIMIT ?',
+                                 (size, )).fetchall()
+        if len(rows) > 0:
+            self.conn.execute('DELETE FROM queue WHERE id <= ?', (rows[-1][0], ))
+            self.n_messages -= len(rows)
+            self.n_bytes -= sum(len(data) for _, data in rows)
+        return [(id_, str(data)) for id_, data in rows]
+
+    def _release(self, lease_ids, requeue=False):
+        rows = []
+        for lease_id in lease_ids:
+            row = self.conn.execute('SELECT id, data FROM inflight WHERE lease_id = ?',
+                                    (lease_id, )).fetchone()
+            if row is not None:
+                rows.append((lease_id, row[0], row[1]))
+        if len(rows) == 0:
+            return 0
+
+        if requeue:
+            self.conn.executemany('INSERT INTO queue (id, data) VALUES (?, ?)',
+                                  [(id_, data) for _, id_, data in rows])
+            self.n_messages += len(rows)
+            self.n_bytes += sum(len(data) for _, _, data in rows)
+        self.conn.executemany('DELETE FROM inflight WHERE lease_id = ?',
+                              [(lease_id, ) for lease_id, _, _ in rows])
+        self.n_inflight -= len(rows)
+        return len(rows)
+
+    def _requeue_expired(self):
+        if self.n_inflight == 0:
+            return
+        rows = self.conn.execute('SELECT lease_id FROM inflight WHERE deadline <= ?',
+                                 (time.time(), )).fetchall()
+        if len(rows) > 0:
+            self._release([lease_id for lease_id, in rows], requeue=True)
+
+    def _parse_lease_ids(self, lease_ids):
+        if isinstance(lease_ids, basestring):
+            return [lease_ids, ]
+        return list(lease_ids)
+
+    def put_one(self, obj, force=False, commit=True):
+        if self.stopped: return
+        self.init()
+
+        if not self._filter(obj, force=force):
+            return
+        return self._put([obj, ], commit=commit)[0]
+
+    def _put(self, objs, commit=True):
+        obj_strs = [self._stringfy(obj) for obj in objs]
+        def _write():
+            self._write(obj_strs)
+            return objs, len(objs) if commit is True else 0
+
+        with self.lock:
+            return self._transact(_write)
+
+    def put(self, objects, force=False, commit=True):
+        if self.stopped: return
+        self.init()
+
+        if isinstance(objects, basestring) or not iterable(objects):
+            return self.put_one(objects, force, commit)
+
+        remains = self._filter_many(objects, force=force)
+        if len(remains) > 0:
+            self._put(remains, commit=commit)
+        return remains
+
+    def _get(self, size):
+        def _read():
+            self._requeue_expired()
+            rows = self._read(size)
+            return rows, len(rows)
+
+        with self.lock:
+            rows = self._transact(_read)
+        return [self._destringfy(obj_str) for _, obj_str in rows]
+
+    def get_one(self, commit=True):
+        if self.stopped: return
+        self.init()
+
+        objs = self._get(1)
+        if len(objs) > 0:
+            return objs[0]
+
+    def get(self, size=1):
+        if size <= 1:
+            return self.get_one()
+
+        if self.stopped: return []
+        self.init()
+
+        return self._get(size)
+
+    def peek(self, size=1):
+        """
+        Get the objects at the head of the queue without removing them.
+
+        :return: the objects list
+        """
+        if self.stopped: return []
+        self.init()
+
+        with self.lock:
+            rows = self.conn.execute('SELECT data FROM queue ORDER BY id LIMIT ?',
+                                     (max(size, 1), )).fetchall()
+        return [self._destringfy(str(data)) for data, in rows]
+
+    def get_leased(self, size=1, timeout=None):
+        if self.stopped: return []
+        self.init()
+
+        timeout = self.lease_timeout if timeout is None else timeout
+        def _lease():
+            self._requeue_expired()
+            rows = self._read(max(size, 1))
+            deadline = time.time() + timeout
+            leases = [(uuid.uuid4().hex, id_, deadline, sqlite3.Binary(obj_str)) \
+                      for id_, obj_str in rows]
+            if len(leases) > 0:
+                self.conn.executemany('INSERT INTO inflight (lease_id, id, deadline, data) '
+                                      'VALUES (?, ?, ?, ?)', leases)
+                self.n_inflight += len(leases)
+            return [(lease[0], obj_str) for lease, (_, obj_str) in zip(leases, rows)], \
+                len(leases)
+
+        with self.lock:
+            results = self._transact(_lease)
+        return [(lease_id, self._destringfy(obj_str)) for lease_id, obj_str in results]
+
+    def _release_leases(self, lease_ids, requeue=False):
+        def _release():
+            n_leases = self._release(self._parse_lease_ids(lease_ids),
+                                     requeue=requeue)
+            return n_leases, n_leases
+
+        with self.lock:
+            return self._transact(_release)
+
+    def ack(self, lease_ids):
+        if self.stopped: return 0
+        self.init()
+
+        return self._release_leases(lease_ids)
+
+    def nack(self, lease_ids):
+        if self.stopped: return 0
+        self.init()
+
+        return self._release_leases(lease_ids, requeue=True)
+
+    def renew(self, lease_ids, timeout=None):
+        if self.stopped: return 0
+        self.init()
+
+        timeout = self.lease_timeout if timeout is None else timeout
+        def _renew():
+            deadline = time.time() + timeout
+            n_renews = 0
+            for lease_id in self._parse_lease_ids(lease_ids):
+                n_renews += self.conn.execute(
+                    'UPDATE inflight SET deadline = ? WHERE lease_id = ?',
+                    (deadline, lease_id)).rowcount
+            return n_renews, n_renews
+
+        with self.lock:
+            return self._transact(_renew)
+
+    def stats(self):
+        """
+        The counts are loaded from the tables once when initialized,
+        the ``segments`` is always 1 for the single database file.
+        """
+        if not self.stopped:
+            self.init()
+
+        with self.lock:
+            return {'messages': self.n_messages,
+                    'bytes': self.n_bytes,
+                    'segments': 1,
+                    'inflight': self.n_inflight}
@@ -25,16 +25,18 @@ import re
 import threading
 import mmap
 import sys
-from collections import defaultdict
+import time
+import uuid
+import heapq
+from collections import defaultdict, OrderedDict
+import itertools
 import struct
-import marshal
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
+import zlib
     
 from cola.core.utils import iterable
+from cola.core.unit import Unit
 from cola.core.mq.utils import labelize
+from cola.core.mq.codec import Codecs
 
 class StoreExistsError(Exception): pass
 
@@ -44,13 +46,261 @@ class StoreNoSpaceForPut(Exception): pass
 
 STORE_FILE_SIZE = 4 * 1024 * 1024 # single store file must be less than 4M.
 LEGAL_STORE_FILE_REGEX = re.compile("^\d+$")
+MIGRATE_FILE_SUFFIX = '.migrate'
+WARM_FILE_SUFFIX = '.warm'
+
+# Every store file starts with a fixed size header,
+# ``<magic><version><padding><read offset><write offset>
+# <synced offset><synced count><read count><write count>``,
+# the counts are the numbers of records before the offsets,
+# the rest of the header is reserved.
+STORE_FILE_MAGIC = 'CLMQ'
+STORE_FILE_VERSION = 1
+HEADER_FORMAT = '4sB3xIIIIII'
+OFFSETS_FORMAT = 'II'
+OFFSETS_POS = 8
+SYNCED_POS = 16
+COUNTS_POS = 24
+HEADER_SIZE = 64
+
+# Every record is ``<length><crc32 of the content><content>``
+RECORD_HEADER_FORMAT = 'II'
+RECORD_HEADER_SIZE = 8
+
+# The objects got with leases are logged into the in-flight log,
+# the entries are ``<l><lease id><deadline><record>`` when leased,
+# and ``<r><lease id>`` when acknowledged or put back.
+INFLIGHT_FILENAME = 'inflight'
+LEASE_ENTRY, RELEASE_ENTRY = 'l', 'r'
+LEASE_ENTRY_FORMAT = '<c16sd'
+LEASE_ENTRY_SIZE = struct.calcsize(LEASE_ENTRY_FORMAT)
+RELEASE_ENTRY_FORMAT = '<c16s'
+RELEASE_ENTRY_SIZE = struct.calcsize(RELEASE_ENTRY_FORMAT)
+DEFAULT_LEASE_SECONDS = 15 * 60
+
+# durability modes, decide when the mq stores flush to the disk
+DURABILITY_ALWAYS = 'always' # flush on every put or get
+DURABILITY_EVERY_N_OPS = 'every_n_ops' # flush every n puts or gets
+DURABILITY_INTERVAL_MS = 'interval_ms' # flush periodically by a background thread
+DURABILITY_OS = 'os' # leave it to the operating system, flush only at shutdown
+DURABILITY_MODES = (DURABILITY_ALWAYS, DURABILITY_EVERY_N_OPS, 
+                    DURABILITY_INTERVAL_MS, DURABILITY_OS)
 
 READ_ENTRANCE, WRITE_ENTRANCE = range(2)
 
-MARSHAL, PICKLE = 'm', 'p'
 
+class BaseStore(object):
+    """
+    The interface of the storage for a single priority queue,
+    the backup or the incremental queue of a
+    :class:`~cola.core.mq.node.LocalMessageQueueNode`.
+    The implementation is decided by ``job.components.store.cls``.
+    """
+    def __init__(self, working_dir, deduper=None, mkdirs=False, 
+                 compress_threshold=None, **kwargs):
+        self.dir_ = working_dir
+        self.deduper = deduper
+        self.codecs = Codecs(compress_threshold=compress_threshold)
+        
+        if mkdirs and not os.path.exists(self.dir_):
+            os.makedirs(self.dir_)
+            
+    def _stringfy(self, obj):
+        return self.codecs.encode(obj)
+        
+    def _destringfy(self, src_str):
+        return self.codecs.decode(src_str)
+    
+    def _crc(self, obj_str):
+        return zlib.crc32(obj_str) & 0xffffffff
+    
+    def _pack_record(self, obj_str):
+        return struct.pack(RECORD_HEADER_FORMAT, len(obj_str), 
+                           self._crc(obj_str)) + obj_str
+    
+    def _unpack_record(self, content, pos, end=None):
+        """
+        Read the record packed by :func:`_pack_record`.
+        
+        :param end: the records end before it, default the end of content
+        :return: the serialized object and the end of the record,
+                 the object is None if the record is incomplete or broken
+        """
+        end = len(content) if end is None else end
+        if pos + RECORD_HEADER_SIZE > end:
+            return None, pos
+        length, crc = struct.unpack_from(RECORD_HEADER_FORMAT, content, pos)
+        start = pos + RECORD_HEADER_SIZE
+        if length == 0 or start + length > end:
+            return None, pos
+        obj_str = content[start:start+length]
+        if self._crc(obj_str) != crc:
+            return None, pos
+        return obj_str, start + length
+    
+    def _filter(self, obj, force=False):
+        if isinstance(obj, str) and obj.strip() == '':
+            return False
+        
+        if not force and self.deduper is not None:
+            prop = labelize(obj)
+            if isinstance(obj, Unit):
+                # reuse the fingerprint of the unit
+                exist = self.deduper.exist_digests([prop], [obj.fingerprint])[0]
+            else:
+                exist = self.deduper.exist(prop)
+            if exist:
+                return False
+        return True
+    
+    def _filter_many(self, objects, force=False):
+        """
+        Filter the objects like :func:`_filter`, but the deduper
+        is asked only once for the whole batch.
+        """
+        objects = [obj for obj in objects \
+                   if not isinstance(obj, str) or obj.strip() != '']
+        if force or self.deduper is None or len(objects) == 0:
+            return objects
+        
+        keys = [labelize(obj) for obj in objects]
+        digests = [obj.fingerprint if isinstance(obj, Unit) else None \
+                   for obj in objects]
+        if any(digest is not None for digest in digests):
+            exists = self.deduper.exist_digests(keys, digests)
+        else:
+            exists = self.deduper.exist_many(keys)
+        return [obj for obj, exist in zip(objects, exists) if not exist]
+    
+    def _init_leases(self):
+        """
+        The leases kept in the memory for the storages which implement
+        :func:`_release`, each one is ``(deadline, record)`` keyed by the
+        lease id. The leases are kept in order, so that the expired ones
+        with the same deadline are put back in the order got.
+        The deadlines are kept in a heap, the stale ones of the leases
+        renewed or released are skipped when popped.
+        """
+        self.leases = OrderedDict()
+        self.lease_deadlines = []
+        self.lease_seq = itertools.count()
+        
+    def _heapify_leases(self):
+        self.lease_deadlines = [(deadline, next(self.lease_seq), lease_id) \
+                                for lease_id, (deadline, _) in self.leases.iteritems()]
+        heapq.heapify(self.lease_deadlines)
+        
+    def _add_lease(self, lease_id, deadline, record):
+        self.leases[lease_id] = (deadline, record)
+        heapq.heappush(self.lease_deadlines, 
+                       (deadline, next(self.lease_seq), lease_id))
+        
+    def _pop_leases(self, lease_ids):
+        """
+        :return: list of the ``(lease_id, record)`` removed
+        """
+        popped = []
+        for lease_id in lease_ids:
+            lease = self.leases.pop(lease_id, None)
+            if lease is not None:
+                popped.append((lease_id, lease[1]))
+        if len(self.leases) == 0:
+            self.lease_deadlines = []
+        return popped
+    
+    def _renew_leases(self, lease_ids, deadline):
+        """
+        :return: list of the ``(lease_id, record)`` renewed
+        """
+        renewed = []
+        for lease_id in lease_ids:
+            lease = self.leases.get(lease_id)
+            if lease is not None:
+                self._add_lease(lease_id, deadline, lease[1])
+                renewed.append((lease_id, lease[1]))
+        return renewed
+    
+    def _release(self, lease_ids, requeue=False):
+        """
+        Release the leases, and put the records back if ``requeue``.
 
-class Store(object):
+        :return: count of the leases released
+        """
+        raise NotImplementedError
+        
+    def _requeue_expired(self):
+        expired = []
+        now = time.time()
+        while len(self.lease_deadlines) > 0 and \
+            self.lease_deadlines[0][0] <= now:
+            deadline, _, lease_id = heapq.heappop(self.lease_deadlines)
+            lease = self.leases.get(lease_id)
+            if lease is not None and lease[0] == deadline:
+                expired.append(lease_id)
+        if len(expired) > 0:
+            self._release(expired, requeue=True)
+    
+    def init(self):
+        pass
+    
+    def put_one(self, obj, force=False, commit=True):
+        raise NotImplementedError
+    
+    def put(self, objects, force=False, commit=True):
+        """
+        :return: the objects actually put into the storage
+        """
+        raise NotImplementedError
+    
+    def get_one(self, commit=True):
+        raise NotImplementedError
+    
+    def get(self, size=1):
+        """
+        :param size: if size <= 1 the right object will be returned,
+               else will be the objects list
+        """
+        raise NotImplementedError
+    
+    def get_leased(self, size=1, timeout=None):
+        """
+        :return: list of the ``(lease_id, obj)``
+        """
+        raise NotImplementedError
+    
+    def ack(self, lease_ids):
+        raise NotImplementedError
+    
+    def nack(self, lease_ids):
+        raise NotImplementedError
+    
+    def renew(self, lease_ids, timeout=None):
+        """
+        :return: count of the leases renewed
+        """
+        raise NotImplementedError
+    
+    def stats(self):
+        """
+        :return: dict of the ``messages``, ``bytes``,
+                 ``segments`` and ``inflight``
+        """
+        raise NotImplementedError
+    
+    def flush(self):
+        pass
+    
+    def shutdown(self):
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type_, value, traceback):
+        self.shutdown()
+
+
+class Store(BaseStore):
     """
     The class is actually in charge of handling the storage
     for objects which belong to a single priority queue or
@@ -60,38 +310,84 @@ class Store(object):
     the first and the last of the block will be mapped to the memory
     by using the ``mmap`` mechanism.
 
+    Each block starts with a small header which records the read offset
+    and the write offset of the block, the content area follows the header.
     When an object need to :func:`put` into the storage, if no block exist,
-    a file with default size 4M fulled with \x01 will be touched firstly,
-    and mmap the file to the memory, then the object will be serialized and
-    written into the block in the form of ``<length><serialization method><content>``,
-    The serialization method means either ``marshal`` or ``pickle``,
+    a file with the header and the content area of default size 4M fulled
+    with \x00 will be touched firstly, and mmap the file to the memory,
+    then the object will be serialized and written at the write offset
+    in the form of ``<length><crc32><serialization method><content>``,
+    and the write offset will be moved forward.
+    The serialization method is decided by :class:`~cola.core.mq.codec.Codecs`,
+    a compact codec is used for :class:`~cola.core.unit.Url`, then ``marshal``,
     if ``marshal`` failed, the ``pickle`` method will be used instead.
     Until the block is full, it will be closed and released,
     and another block will be touched.
 
     To the :func:`get` function, firstly will check if there is any block,
     if yes and the block is not open, it will be mapped to the memory,
-    then read the length of the serialized object as well as the
-    serialization method, at last, the content will be read out.
+    then read the length of the serialized object at the read offset
+    as well as the serialization method, at last, the content will be read out
+    and the read offset will be moved forward, so the block is never rewritten.
     The object will be un-serialized and returned back.
+    A block will be removed only when it is fully consumed.
+
+    The blocks written by the old versions will be converted
+    when the storage is initialized.
+
+    Every time the blocks are flushed, the write offset is recorded
+    as the synced offset in the header of the write block. If the storage
+    did not shutdown safely, only the records between the synced offset
+    and the write offset of the write block will be checked by the crc32,
+    the block is truncated at the first broken record,
+    the unfinished files left in the working directory are removed.
+
+    The header also records the counts of records before the read offset
+    and the write offset, so that the messages and bytes in the storage
+    are known from the headers without reading the records,
+    refer to :func:`stats`.
+
+    The block files are preallocated as sparse files, or by ``posix_fallocate``
+    if available, instead of being written with \x00. If ``warm_files`` is set,
+    a background thread will keep the blocks prepared ahead in the working
+    directory, so that the writer only need to rename one when a block is full.
+
+    Objects can also be got with leases by :func:`get_leased`, the records
+    are kept in the in-flight log until acknowledged by :func:`ack`,
+    or put back by :func:`nack`. The leases not acknowledged before
+    the deadline will be put back when the storage is got next time.
+    The leases are restored from the in-flight log when initialized.
     """
     def __init__(self, working_dir, size=STORE_FILE_SIZE, 
                  deduper=None, mkdirs=False, 
-                 create_lock_file=False):
+                 create_lock_file=False, flush_every=1,
+                 compress_threshold=None, warm_files=0,
+                 lease_timeout=DEFAULT_LEASE_SECONDS, **kwargs):
         """
         :param working_dir: working directory of this storage
         :param size: single block size, 4M as default
         :param deduper: instance of :class:`~cola.core.dedup.Deduper`
         :param mkdirs: force to make the working directory if True
         :param create_lock_file: create the lock file if set to True
+        :param flush_every: the committed puts or gets before the mmap
+               is forced to flush, 1 as default means flushing every time,
+               0 means never flushing unless :func:`flush` is called
+        :param compress_threshold: if set, the pickled objects larger than it
+               will be compressed
+        :param warm_files: count of the blocks prepared ahead
+               by a background thread, 0 as default means
+               creating the block only when needed
+        :param lease_timeout: default seconds before the objects got
+               by :func:`get_leased` are put back if not acknowledged
         """
+        super(Store, self).__init__(working_dir, deduper=deduper, mkdirs=mkdirs,
+                                    compress_threshold=compress_threshold)
         self.lock = threading.Lock()
         self.store_file_size = size
-        self.deduper = deduper
-        
-        self.dir_ = working_dir
-        if mkdirs and not os.path.exists(self.dir_):
-            os.makedirs(self.dir_)
+        self.flush_every = flush_every
+        self.uncommitted = 0
+        self.warm_files = warm_files
+        self.lease_timeout = lease_timeout
             
         self.create_lock_file = create_lock_file
         self.lock_file = os.path.join(self.dir_, 'lock')
@@ -108,12 +404,34 @@ class Store(object):
         self.legal_files = []
         self.file_handles = defaultdict(lambda: None)
         self.map_handles = defaultdict(lambda: None)
+        
+        # cursors of the read and write blocks, which are kept in the memory
+        # and written back into the block header on every change
+        self.read_pos = self.read_end = self.write_pos = HEADER_SIZE
+        self.read_count = self.write_count = 0
+        # messages and bytes of the whole storage
+        self.n_messages = self.n_bytes = 0
+        
+        self.warm_pool = []
+        self.warm_cond = threading.Condition()
+        self.warm_t = None
+        
+        self.inflight_file = os.path.join(self.dir_, INFLIGHT_FILENAME)
+        self.inflight_handle = None
+        # size of the in-flight log, and the size of the leases alive in it
+        self.inflight_size = self.inflight_live_size = 0
+        self._init_leases()
             
     def shutdown(self):
         if self.stopped: return
         self.stopped = True
         
         try:
+            self._stop_warming()
+            with self.lock:
+                self._flush()
+            if self.inflight_handle is not None:
+                self.inflight_handle.close()
             for handle in self.map_handles.values():
                 if handle is not None:
                     handle.close()
@@ -136,29 +454,359 @@ class Store(object):
                 if fi == 'lock': continue
                 
                 file_path = os.path.join(self.dir_, fi)
-                if not os.path.isfile(file_path) or \
-                    LEGAL_STORE_FILE_REGEX.match(fi) is None:
-                    raise StoreNotSafetyShutdown('Store did not shutdown safety last time.')
-                else:
+                if not os.path.isfile(file_path):
+                    continue
+                if fi.endswith(WARM_FILE_SUFFIX) or \
+                    fi.endswith(MIGRATE_FILE_SUFFIX):
+                    # the prepared blocks contain nothing, and the block
+                    # is still there if not migrated completely
+                    os.remove(file_path)
+                elif LEGAL_STORE_FILE_REGEX.match(fi) is not None:
                     self.legal_files.append(file_path)
                     
             self.legal_files = sorted(self.legal_files, key=lambda k: int(os.path.basename(k)))
+            for file_path in self.legal_files:
+                if self._get_version(file_path) != STORE_FILE_VERSION:
+                    self._migrate_file(file_path)
             
             if len(self.legal_files) > 0:
                 read_file_handle = self.file_handles[READ_ENTRANCE] \
                     = open(self.legal_files[-1], 'r+')
-                self.map_handles[READ_ENTRANCE] = mmap.mmap(read_file_handle.fileno(), 
-                                                            self.store_file_size)
+                self.map_handles[READ_ENTRANCE] = mmap.mmap(read_file_handle.fileno(), 0)
                 if len(self.legal_files) == 1:
                     self.file_handles[WRITE_ENTRANCE] = self.file_handles[READ_ENTRANCE]
                     self.map_handles[WRITE_ENTRANCE] = self.map_handles[READ_ENTRANCE]
                 else:
                     write_file_handle = self.file_handles[WRITE_ENTRANCE] \
                         = open(self.legal_files[0], 'r+')
-                    self.map_handles[WRITE_ENTRANCE] = mmap.mmap(write_file_handle.fileno(),
-                                                                 self.store_file_size)
+                    self.map_handles[WRITE_ENTRANCE] = mmap.mmap(write_file_handle.fileno(), 0)
+                self._recover()
+                self._load_read_cursor()
+                self._load_stats()
+            self._load_leases()
+                
+            if self.warm_files > 0:
+                self.warm_t = threading.Thread(target=self._prepare_warm_files)
+                self.warm_t.setDaemon(True)
+                self.warm_t.start()
                     
             self.inited = True
+            
+    def _get_version(self, file_path):
+        """
+        Get the version of the block, None if the block has no header.
+        """
+        with open(file_path, 'rb') as f:
+            header = f.read(len(STORE_FILE_MAGIC) + 1)
+        if len(header) <= len(STORE_FILE_MAGIC) or \
+            not header.startswith(STORE_FILE_MAGIC):
+            return
+        return ord(header[-1])
+        
+    def _migrate_file(self, file_path):
+        """
+        Convert the block written by the old versions to the current one.
+        In the blocks without header, the objects are placed from
+        the very beginning and end up with a zero length.
+        """
+        version = self._get_version(file_path)
+        if version is not None:
+            raise StoreNotSafetyShutdown(
+                'Unknown version %s of store file: %s' % (version, file_path))
+        
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        
+        records = []
+        pos, end = 0, len(content)
+        while pos + 4 <= end:
+            size, = struct.unpack_from('I', content, pos)
+            start = pos + 4
+            if size == 0 or start + size > end:
+                break
+            records.append(self._pack_record(content[start:start+size]))
+            pos = start + size
+        n_records = len(records)
+        records = ''.join(records)
+        
+        size = max(self.store_file_size, len(records))
+        migrate_file_path = file_path + MIGRATE_FILE_SUFFIX
+        with open(migrate_file_path, 'wb') as f:
+            f.write(self._pack_header(HEADER_SIZE + len(records), n_records))
+            f.write(records)
+            f.truncate(HEADER_SIZE + size)
+        os.rename(migrate_file_path, file_path)
+        
+    def _recover(self):
+        """
+        Check the records of the write block which may be broken
+        if not flushed completely. The records before the synced offset
+        have been flushed, so only the ones between the synced offset
+        and the write offset need to be checked,
+        the block will be truncated at the first broken record.
+        """
+        m = self.map_handles[WRITE_ENTRANCE]
+        read_pos, write_pos = self._get_offsets(m)
+        pos, count = struct.unpack_from('II', m, SYNCED_POS)
+        
+        write_pos = min(max(write_pos, HEADER_SIZE), len(m))
+        if pos < HEADER_SIZE or pos > write_pos:
+            pos, count = HEADER_SIZE, 0
+        while True:
+            obj_str, pos = self._unpack_record(m, pos, write_pos)
+            if obj_str is None:
+                break
+            count += 1
+            
+        self.write_pos, self.write_count = pos, count
+        self._set_write_offset(m, pos, count)
+        self._set_synced_offset(m, pos, count)
+        if self._is_single_block() and read_pos > pos:
+            self._set_read_offset(m, pos, count)
+        m.flush()
+        
+    def _load_stats(self):
+        self.n_messages = self.n_bytes = 0
+        for idx, file_path in enumerate(self.legal_files):
+            if idx == 0:
+                header = self.map_handles[WRITE_ENTRANCE][:HEADER_SIZE]
+            elif idx == len(self.legal_files) - 1:
+                header = self.map_handles[READ_ENTRANCE][:HEADER_SIZE]
+            else:
+                with open(file_path, 'rb') as f:
+                    header = f.read(HEADER_SIZE)
+            _, _, read_pos, write_pos, _, _, read_count, write_count = \
+                struct.unpack_from(HEADER_FORMAT, header)
+            self.n_messages += write_count - read_count
+            self.n_bytes += write_pos - read_pos
+        
+    def _load_leases(self):
+        """
+        Replay the in-flight log, the leases not released are restored
+        with their deadlines, then the log is rewritten with them only.
+        """
+        if not os.path.exists(self.inflight_file):
+            return
+        with open(self.inflight_file, 'rb') as f:
+            content = f.read()
+            
+        pos = 0
+        while pos < len(content):
+            if content[pos] == LEASE_ENTRY and \
+                pos + LEASE_ENTRY_SIZE + RECORD_HEADER_SIZE <= len(content):
+                _, lease_id, deadline = struct.unpack_from(
+                    LEASE_ENTRY_FORMAT, content, pos)
+                start = pos + LEASE_ENTRY_SIZE
+                obj_str, end = self._unpack_record(content, start)
+                if obj_str is None:
+                    break
+                self.leases[lease_id] = (deadline, content[start:end])
+                pos = end
+            elif content[pos] == RELEASE_ENTRY and \
+                pos + RELEASE_ENTRY_SIZE <= len(content):
+                _, lease_id = struct.unpack_from(RELEASE_ENTRY_FORMAT, content, pos)
+                self.leases.pop(lease_id, None)
+                pos += RELEASE_ENTRY_SIZE
+            else:
+                # the torn tail
+                break
+            
+        self._heapify_leases()
+        self._rewrite_inflight()
+        
+    def _pack_lease(self, lease_id, deadline, record):
+        return struct.pack(LEASE_ENTRY_FORMAT, LEASE_ENTRY, 
+                           lease_id, deadline) + record
+        
+    def _rewrite_inflight(self):
+        if self.inflight_handle is not None:
+            self.inflight_handle.close()
+            self.inflight_handle = None
+            
+        entries = ''.join(self._pack_lease(lease_id, deadline, record) \
+                          for lease_id, (deadline, record) in self.leases.iteritems())
+        migrate_file_path = self.inflight_file + MIGRATE_FILE_SUFFIX
+        with open(migrate_file_path, 'wb') as f:
+            f.write(entries)
+        os.rename(migrate_file_path, self.inflight_file)
+        self.inflight_size = self.inflight_live_size = len(entries)
+        
+    def _log_inflight(self, entries):
+        if self.inflight_handle is None:
+            self.inflight_handle = open(self.inflight_file, 'ab')
+        if len(self.leases) == 0:
+            # nothing in flight, the log can be cleared
+            self.inflight_handle.truncate(0)
+            self.inflight_size = self.inflight_live_size = 0
+            return
+        
+        entries = ''.join(entries)
+        self.inflight_handle.write(entries)
+        self.inflight_handle.flush()
+        self.inflight_size += len(entries)
+        if self.inflight_size > 2 * max(self.inflight_live_size, 
+                                        self.store_file_size):
+            self._rewrite_inflight()
+            
+    def _lease(self, records, deadline):
+        results, entries = [], []
+        for record in records:
+            lease_id = uuid.uuid4().bytes
+            self._add_lease(lease_id, deadline, record)
+            entries.append(self._pack_lease(lease_id, deadline, record))
+            self.inflight_live_size += LEASE_ENTRY_SIZE + len(record)
+            obj = self._destringfy(record[RECORD_HEADER_SIZE:])
+            results.append((lease_id.encode('hex'), obj))
+        self._log_inflight(entries)
+        return results
+    
+    def _release(self, lease_ids, requeue=False):
+        records, entries = [], []
+        for lease_id, record in self._pop_leases(lease_ids):
+            records.append(record)
+            entries.append(struct.pack(RELEASE_ENTRY_FORMAT, 
+                                       RELEASE_ENTRY, lease_id))
+            self.inflight_live_size -= LEASE_ENTRY_SIZE + len(record)
+        
+        # put back before the leases are released,
+        # so that nothing is lost if crashed between
+        if requeue and len(records) > 0:
+            self._write(records)
+        if len(entries) > 0:
+            self._log_inflight(entries)
+        return len(entries)
+    
+    def _renew(self, lease_ids, deadline):
+        # replayed later than the old entries, so the new deadlines win
+        entries = [self._pack_lease(lease_id, deadline, record) for lease_id, record \
+                   in self._renew_leases(lease_ids, deadline)]
+        if len(entries) > 0:
+            self._log_inflight(entries)
+        return len(entries)
+            
+    def _parse_lease_ids(self, lease_ids):
+        if isinstance(lease_ids, basestring):
+            lease_ids = [lease_ids, ]
+        parsed = []
+        for lease_id in lease_ids:
+            try:
+                parsed.append(lease_id.decode('hex'))
+            except TypeError:
+                continue
+        return parsed
+        
+    def _create_file(self, file_path):
+        """
+        Create an empty block, the content area is left as a hole
+        of the sparse file, and is reserved on the disk
+        if ``posix_fallocate`` is supported.
+        """
+        file_size = HEADER_SIZE + self.store_file_size
+        with open(file_path, 'wb') as f:
+            f.write(self._pack_header())
+            f.truncate(file_size)
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, file_size)
+                except OSError:
+                    # not supported by the file system, keep it sparse
+                    pass
+                
+    def _prepare_warm_files(self):
+        seq = 0
+        while True:
+            with self.warm_cond:
+                while not self.stopped and \
+                    len(self.warm_pool) >= self.warm_files:
+                    self.warm_cond.wait()
+                if self.stopped:
+                    return
+                
+            seq += 1
+            file_path = os.path.join(self.dir_, str(seq) + WARM_FILE_SUFFIX)
+            self._create_file(file_path)
+            with self.warm_cond:
+                self.warm_pool.append(file_path)
+                
+    def _pop_warm_file(self):
+        with self.warm_cond:
+            if len(self.warm_pool) == 0:
+                return
+            file_path = self.warm_pool.pop(0)
+            self.warm_cond.notify()
+            return file_path
+        
+    def _stop_warming(self):
+        with self.warm_cond:
+            self.warm_cond.notify_all()
+        if self.warm_t is not None:
+            self.warm_t.join()
+            self.warm_t = None
+        for file_path in self.warm_pool:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        self.warm_pool = []
+        
+    def _pack_header(self, write_pos=HEADER_SIZE, write_count=0):
+        # nothing read, and the records written are synced
+        header = struct.pack(HEADER_FORMAT, STORE_FILE_MAGIC, 
+                             STORE_FILE_VERSION, HEADER_SIZE, write_pos,
+                             write_pos, write_count, 0, write_count)
+        return header + '\x00' * (HEADER_SIZE - len(header))
+    
+    def _get_offsets(self, map_handle):
+        return struct.unpack_from(OFFSETS_FORMAT, map_handle, OFFSETS_POS)
+    
+    def _set_read_offset(self, map_handle, read_pos, read_count):
+        struct.pack_into('I', map_handle, OFFSETS_POS, read_pos)
+        struct.pack_into('I', map_handle, COUNTS_POS, read_count)
+        
+    def _set_write_offset(self, map_handle, write_pos, write_count):
+        struct.pack_into('I', map_handle, OFFSETS_POS + 4, write_pos)
+        struct.pack_into('I', map_handle, COUNTS_POS + 4, write_count)
+        
+    def _set_synced_offset(self, map_handle, synced_pos, synced_count):
+        struct.pack_into('II', map_handle, SYNCED_POS, synced_pos, synced_count)
+        
+    def _load_read_cursor(self):
+        # the write offset of the block which is not being written
+        # will never change, so it's safe to be cached
+        m = self.map_handles[READ_ENTRANCE]
+        self.read_pos, self.read_end = self._get_offsets(m)
+        self.read_count, = struct.unpack_from('I', m, COUNTS_POS)
+            
+    def _is_single_block(self):
+        return len(self.legal_files) == 1
+    
+    def _commit(self, ops=1):
+        self.uncommitted += ops
+        if self.flush_every > 0 and self.uncommitted >= self.flush_every:
+            self._flush()
+            
+    def _flush(self):
+        if self.uncommitted == 0:
+            return
+        for entrance in (READ_ENTRANCE, WRITE_ENTRANCE):
+            m = self.map_handles[entrance]
+            if m is not None:
+                m.flush()
+        # the records before the write offset are safe now,
+        # the synced offset will be flushed next time
+        m = self.map_handles[WRITE_ENTRANCE]
+        if m is not None:
+            self._set_synced_offset(m, self.write_pos, self.write_count)
+        if self.inflight_handle is not None:
+            os.fsync(self.inflight_handle.fileno())
+        self.uncommitted = 0
+        
+    def flush(self):
+        """
+        Force the modified blocks to flush.
+        """
+        if self.stopped: return
+        
+        with self.lock:
+            self._flush()
     
     def _generate_file(self):
         prev = None
@@ -171,16 +819,24 @@ class Store(object):
             self.map_handles[WRITE_ENTRANCE].close()
             self.file_handles[WRITE_ENTRANCE].close()
         self.legal_files.insert(0, file_path)
-        open(file_path, 'w').close()
+        warm_file_path = self._pop_warm_file()
+        if warm_file_path is not None:
+            os.rename(warm_file_path, file_path)
+        else:
+            self._create_file(file_path)
         write_file_handle = self.file_handles[WRITE_ENTRANCE] = open(file_path, 'r+')
-        write_file_handle.write('\x00'*self.store_file_size)
-        write_file_handle.flush()
-        self.map_handles[WRITE_ENTRANCE] = mmap.mmap(write_file_handle.fileno(),
-                                                     self.store_file_size)
+        self.map_handles[WRITE_ENTRANCE] = mmap.mmap(write_file_handle.fileno(), 0)
         
         if len(self.legal_files) == 1:
             self.map_handles[READ_ENTRANCE] = self.map_handles[WRITE_ENTRANCE]
             self.file_handles[READ_ENTRANCE] = self.file_handles[WRITE_ENTRANCE]
+            self.read_pos = HEADER_SIZE
+            self.read_count = 0
+        elif len(self.legal_files) == 2:
+            # the read block is not written any more
+            self.read_end = self.write_pos
+        self.write_pos = HEADER_SIZE
+        self.write_count = 0
         
     def _destroy_file(self):
         if len(self.legal_files) == 0:
@@ -198,41 +854,98 @@ class Store(object):
         else:
             read_file_handle = self.file_handles[READ_ENTRANCE] \
                 = open(self.legal_files[-2], 'r+')
-            self.map_handles[READ_ENTRANCE] = mmap.mmap(read_file_handle.fileno(),
-                                                        self.store_file_size)
-        self.legal_files.pop(-1)
-        
-    def _stringfy(self, obj):
-        try:
-            return MARSHAL + marshal.dumps(obj)
-        except ValueError:
-            return PICKLE + pickle.dumps(obj)
+            self.map_handles[READ_ENTRANCE] = mmap.mmap(read_file_handle.fileno(), 0)
+        os.remove(self.legal_files.pop(-1))
+        if len(self.legal_files) > 0:
+            self._load_read_cursor()
         
-    def _destringfy(self, src_str):
-        if len(src_str) < 2:
-            raise ValueError('String length must be at least 2.')
-        
-        t, str_ = src_str[0], src_str[1:]
-        if t == MARSHAL:
-            obj = marshal.loads(str_)
-        elif t == PICKLE:
-            obj = pickle.loads(str_)
-        else:
-            raise ValueError('String must contain a right type indicator.')
-        return obj
+    def _stringfy_for_put(self, obj):
+        record = self._pack_record(self._stringfy(obj))
+        # If no file has enough space
+        if len(record) > self.store_file_size:
+            raise StoreNoSpaceForPut('No enouph space for this put.')
+        return record
+    
+    def _write(self, records):
+        """
+        Append the packed records to the write block,
+        the records which fit in one block are joined
+        and copied into the mmap by a single slice assignment.
+        """
+        i = 0
+        while i < len(records):
+            if len(self.legal_files) == 0:
+                self._generate_file()
+                
+            m = self.map_handles[WRITE_ENTRANCE]
+            pos = end = self.write_pos
+            buf = []
+            while i < len(records) and end + len(records[i]) <= len(m):
+                buf.append(records[i])
+                end += len(records[i])
+                i += 1
+                
+            if end == pos:
+                m.flush()
+                self._generate_file()
+                continue
             
-    def _seek_writable_pos(self, map_handle):
-        pos = 0
-        while True:
-            if pos + 4 <= self.store_file_size:
-                size, = struct.unpack('I', map_handle[pos:pos+4])
-                if size == 0:
-                    return pos
-                pos += (4 + size)
+            m[pos:end] = ''.join(buf)
+            self.write_pos = end
+            self.write_count += len(buf)
+            self._set_write_offset(m, end, self.write_count)
+            self.n_messages += len(buf)
+            self.n_bytes += end - pos
+            
+    def _read(self, size, lease_deadline=None):
+        """
+        Read at most ``size`` objects consecutively from the read blocks,
+        the read offset of a block is written back only once.
+        If ``lease_deadline`` is set, the records are logged as leases
+        before the read offset moves, and ``(lease_id, obj)`` are returned.
+        """
+        results = []
+        m = self.map_handles[READ_ENTRANCE]
+        while m is not None and len(results) < size:
+            is_single = self._is_single_block()
+            read_end = self.write_pos if is_single else self.read_end
+            start = pos = self.read_pos
+            if pos >= read_end:
+                # the block being written cannot be removed
+                if is_single:
+                    break
+                self._destroy_file()
+                m = self.map_handles[READ_ENTRANCE]
+                continue
+            
+            n_results = len(results)
+            if lease_deadline is None:
+                while pos < read_end and len(results) < size:
+                    length, = struct.unpack_from('I', m, pos)
+                    pos += RECORD_HEADER_SIZE
+                    results.append(self._destringfy(m[pos:pos+length]))
+                    pos += length
             else:
-                return -1
-        
-        return -1
+                records = []
+                while pos < read_end and len(results) + len(records) < size:
+                    length, = struct.unpack_from('I', m, pos)
+                    end = pos + RECORD_HEADER_SIZE + length
+                    records.append(m[pos:end])
+                    pos = end
+                results.extend(self._lease(records, lease_deadline))
+                
+            self.read_pos = pos
+            self.read_count += len(results) - n_results
+            self.n_messages -= len(results) - n_results
+            self.n_bytes -= pos - start
+            if is_single and self.read_pos == self.write_pos:
+                # all consumed, rewind to reuse the block
+                self.read_pos = self.write_pos = HEADER_SIZE
+                self.read_count = self.write_count = 0
+                self._set_write_offset(m, self.write_pos, self.write_count)
+                self._set_synced_offset(m, self.write_pos, self.write_count)
+            self._set_read_offset(m, self.read_pos, self.read_count)
+        return results
     
     def put_one(self, obj, force=False, commit=True):
         """
@@ -241,107 +954,176 @@ class Store(object):
         :param obj: the object to put into
         :param force: if True, the deduper will not check if the obj has been
                put into the entire message queue before
-        :param commit: if True, the mmap will be forced to flush
+        :param commit: if True, the mmap will be flushed
+               according to the ``flush_every`` of the storage
         """
         if self.stopped: return
 #         self.init()
         
-        if isinstance(obj, str) and obj.strip() == '':
+        if not self._filter(obj, force=force):
             return
-        
-        if not force and self.deduper is not None:
-            prop = labelize(obj)
-            if self.deduper.exist(prop):
-                return
-        if len(self.legal_files) == 0:
-            self._generate_file()
-            
-        obj_str = self._stringfy(obj)
-        # If no file has enough space
-        if len(obj_str) + 4 > self.store_file_size:
-            raise StoreNoSpaceForPut('No enouph space for this put.')
+        record = self._stringfy_for_put(obj)
         
         with self.lock:
-            m = self.map_handles[WRITE_ENTRANCE]
-            pos = self._seek_writable_pos(m)
-            size = pos + 4 + len(obj_str)
-            
-            if pos < 0 or size > self.store_file_size:
-                m.flush()
-                self._generate_file()
-                pos = 0
-                size = 4 + len(obj_str)
-                m = self.map_handles[WRITE_ENTRANCE]
-            
-            m[:size] = m[:pos] + struct.pack('I', len(obj_str)) + obj_str
+            self._write([record, ])
             if commit is True:
-                m.flush()
+                self._commit()
                 
         return obj
                     
     def put(self, objects, force=False, commit=True):
+        """
+        Put objects into the storage, unlike calling :func:`put_one`
+        for each object, all the objects are serialized first,
+        then written under a single lock.
+
+        :return: the objects actually put into the storage
+        """
         if self.stopped: return
         self.init()
         
         if isinstance(objects, basestring) or not iterable(objects):
             return self.put_one(objects, force, commit)
             
-        remains = []
-        for obj in objects:
-            result = self.put_one(obj, force, commit=False)
-            if result is not None:
-                remains.append(result)
+        remains = self._filter_many(objects, force=force)
+        records = [self._stringfy_for_put(obj) for obj in remains]
         
-        m = self.map_handles[WRITE_ENTRANCE]
-        if len(remains) > 0 and m is not None:
+        if len(remains) > 0:
             with self.lock:
-                m.flush()
+                self._write(records)
+                if commit is True:
+                    self._commit(len(remains))
         return remains
                     
     def get_one(self, commit=True):
         """
         Get one object from the storage.
 
-        :param commit: if set to True will force the mmap flush.
+        :param commit: if set to True the mmap will be flushed
+               according to the ``flush_every`` of the storage.
         :return: the right object to fetch
         """
         if self.stopped: return
         self.init()
         
-        m = self.map_handles[READ_ENTRANCE]
-        while m is not None:
-            with self.lock:
-                size, = struct.unpack('I', m[:4])
-                if size == 0:
-                    self._destroy_file()
-                    m = self.map_handles[READ_ENTRANCE]
-                else:
-                    obj = self._destringfy(m[4:4+size])
-                    m[:] = m[4+size:] + '\x00' * (4+size)
-                    if commit is True:
-                        m.flush()
-                    return obj
+        with self.lock:
+            self._requeue_expired()
+            results = self._read(1)
+            if len(results) == 0:
+                return
+            if commit is True:
+                self._commit()
+            return results[0]
         
     def get(self, size=1):
+        """
+        Get objects from the storage, all the objects
+        are read under a single lock.
+
+        :param size: if size <= 1 the right object will be returned,
+               else will be the objects list
+        """
         if size <= 1:
             return self.get_one()
         
+        if self.stopped: return []
         self.init()
         
-        results = []
-        for _ in range(size):
-            obj = self.get_one()
-            if obj is not None:
-                results.append(obj)
-        m = self.map_handles[READ_ENTRANCE]
-        if m is not None:
-            with self.lock:
-                m.flush()
+        with self.lock:
+            self._requeue_expired()
+            results = self._read(size)
+            if len(results) > 0:
+                self._commit(len(results))
         return results
+    
+    def get_leased(self, size=1, timeout=None):
+        """
+        Get objects from the storage with leases, the objects will be put back
+        into the storage if not acknowledged by :func:`ack` before the timeout.
+
+        :param size: the max count of objects to get
+        :param timeout: seconds of the leases, ``lease_timeout``
+               of the storage as default
+        :return: list of the ``(lease_id, obj)``
+        """
+        if self.stopped: return []
+        self.init()
         
+        timeout = self.lease_timeout if timeout is None else timeout
+        with self.lock:
+            self._requeue_expired()
+            results = self._read(max(size, 1), 
+                                 lease_deadline=time.time()+timeout)
+            if len(results) > 0:
+                self._commit(len(results))
+        return results
+    
+    def ack(self, lease_ids):
+        """
+        Acknowledge that the objects got with leases have been finished.
+
+        :param lease_ids: a lease id or the list of lease ids
+        :return: count of the leases acknowledged, the expired ones
+                 which have been put back are not included
+        """
+        if self.stopped: return 0
+        self.init()
         
-    def __enter__(self):
-        return self
+        with self.lock:
+            n_acks = self._release(self._parse_lease_ids(lease_ids))
+            if n_acks > 0:
+                self._commit(n_acks)
+        return n_acks
     
-    def __exit__(self, type_, value, traceback):
-        self.shutdown()
+    def nack(self, lease_ids):
+        """
+        Put the objects got with leases back into the storage at once.
+
+        :param lease_ids: a lease id or the list of lease ids
+        :return: count of the objects put back
+        """
+        if self.stopped: return 0
+        self.init()
+        
+        with self.lock:
+            n_nacks = self._release(self._parse_lease_ids(lease_ids), 
+                                    requeue=True)
+            if n_nacks > 0:
+                self._commit(n_nacks)
+        return n_nacks
+    
+    def renew(self, lease_ids, timeout=None):
+        """
+        Extend the leases which are not released yet, so that the objects
+        taking long to finish will not be put back.
+
+        :param lease_ids: a lease id or the list of lease ids
+        :param timeout: seconds of the leases from now, ``lease_timeout``
+               of the storage as default
+        :return: count of the leases renewed
+        """
+        if self.stopped: return 0
+        self.init()
+        
+        timeout = self.lease_timeout if timeout is None else timeout
+        with self.lock:
+            return self._renew(self._parse_lease_ids(lease_ids), 
+                               time.time()+timeout)
+        
+        
+    def stats(self):
+        """
+        Get the statistics of the storage without reading the records.
+
+        :return: dict of the ``messages`` and ``bytes`` in the storage,
+                 the count of blocks as the ``segments``, and
+                 the count of objects got with leases as the ``inflight``
+        """
+        if not self.stopped:
+            self.init()
+        
+        with self.lock:
+            return {'messages': self.n_messages, 
+                    'bytes': self.n_bytes,
+                    'segments': len(self.legal_files),
+                    'inflight': len(self.leases)}
@@ -20,13 +20,19 @@ Created on 2014-5-1
 @author: chine
 '''
 
+from cola.core.unit import Unit, get_label, get_fingerprint
+
 def labelize(obj):
-    if isinstance(obj, str):
-        return obj
-    elif isinstance(obj, unicode):
-        return unicode.encode('utf-8')
-    else:
-        try:
-            return str(obj)
-        except:
-            return ''
\ No newline at end of file
+    try:
+        return get_label(obj)
+    except:
+        return ''
+    
+def get_digest(obj):
+    """
+    The md5 digest of the object's label, the one precomputed
+    is used for the :class:`~cola.core.unit.Unit`.
+    """
+    if isinstance(obj, Unit):
+        return obj.fingerprint
+    return get_fingerprint(labelize(obj))
@@ -20,14 +20,70 @@ Created on 2013-5-23
 @author: Chine
 '''
 
+import hashlib
+
+def get_label(obj):
+    """
+    The string which identifies the object, the unicode is encoded by utf-8.
+    """
+    if isinstance(obj, str):
+        return obj
+    elif isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    try:
+        return str(obj)
+    except UnicodeEncodeError:
+        return unicode(obj).encode('utf-8')
+    
+def get_fingerprint(label):
+    """
+    The 128-bit md5 digest of the label.
+    """
+    return hashlib.md5(label).digest()
+
+
 class Unit(object):
+    # the fingerprint is kept in a slot instead of the ``__dict__``,
+    # so the attributes of the units are not changed
+    __slots__ = ('_fingerprint', )
+    
     def __init__(self, item, force=False, priority=0):
         self.item = item
         self.force = force
         self.priority = priority
+        self._fingerprint = None
     
     def __str__(self):
         raise NotImplementedError
+    
+    @property
+    def fingerprint(self):
+        """
+        The md5 digest of the unit, computed only once when first used,
+        then reused by the hash ring and the dedupers.
+        """
+        fingerprint = getattr(self, '_fingerprint', None)
+        if fingerprint is None:
+            fingerprint = self._fingerprint = get_fingerprint(get_label(self))
+        return fingerprint
+    
+    def reset_fingerprint(self):
+        """
+        Must be called if the unit's label is changed.
+        """
+        self._fingerprint = None
+        
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        fingerprint = getattr(self, '_fingerprint', None)
+        if fingerprint is not None:
+            state['_fingerprint'] = fingerprint
+        return state
+    
+    def __setstate__(self, state):
+        state = dict(state)
+        self._fingerprint = state.pop('_fingerprint', None)
+        self.__dict__.update(state)
 
 
 class Url(Unit):
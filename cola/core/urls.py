@@ -21,12 +21,116 @@ Created on 2013-5-21
 '''
 
 import re
+import fnmatch
+import urlparse
+
+from cola.core.unit import Url as UrlUnit
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+HOST_REGEX = re.compile(r'[a-zA-Z][a-zA-Z0-9+.\-]*://(?:[^@/?#]*@)?(\[[^\]]*\]|[^:/?#]*)')
+IPV4_REGEX = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
+# the second-level labels under the country code top-level domains
+# which are registered as the public suffixes, like the ``co.uk``
+GENERIC_SLDS = frozenset(['ac', 'co', 'com', 'edu', 'gen', 'go', 'gob', 'gov', 
+                          'ltd', 'mil', 'ne', 'net', 'nom', 'or', 'org', 'plc', 
+                          'sch'])
+PARTITIONS = ('url', 'host', 'domain')
+
+def compile_params(params):
+    """
+    Compile the names of the query parameters into a regex,
+    the wildcards like ``utm_*`` are supported.
+    """
+    params = list(params or [])
+    if len(params) == 0:
+        return None
+    return re.compile('|'.join(fnmatch.translate(param) for param in params))
+
+def canonicalize_url(url, drop_params=None, sort_query=True):
+    """
+    Get the canonical form of the url, so that the variants of a url 
+    are fetched only once. The scheme and the host are lowered, 
+    the default port and the fragment are removed, the query parameters
+    matched by ``drop_params`` are dropped, and the rest are sorted
+    by their names if ``sort_query``. The parameters are never decoded,
+    so the ones with the same name keep their order.
+    
+    :param drop_params: the regex returned by :func:`compile_params`
+    """
+    try:
+        scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+    except ValueError:
+        return url
+    if scheme not in DEFAULT_PORTS or not netloc:
+        return url
+    
+    userinfo, at, hostport = netloc.rpartition('@')
+    host, colon, port = hostport.rpartition(':')
+    if not colon or ']' in port: # no port or the ipv6 host
+        host, colon, port = hostport, '', ''
+    if port == DEFAULT_PORTS[scheme] or (colon and not port):
+        colon = port = ''
+    netloc = userinfo + at + host.lower() + colon + port
+    
+    if query:
+        params = [param for param in query.split('&') if param]
+        if drop_params is not None:
+            params = [param for param in params \
+                      if drop_params.match(param.split('=', 1)[0]) is None]
+        if sort_query:
+            params.sort(key=lambda param: param.split('=', 1)[0])
+        query = '&'.join(params)
+    
+    return urlparse.urlunsplit((scheme, netloc, path or '/', query, ''))
+
+def get_host(url):
+    """
+    Get the lowered host of the url without the port,
+    None if the url has no host.
+    """
+    res = HOST_REGEX.match(url)
+    if res is None or not res.group(1):
+        return
+    return res.group(1).lower()
+
+def get_registrable_domain(host):
+    """
+    Get the domain registered under the public suffix, like ``qinxuye.me``
+    of the ``www.qinxuye.me`` and ``bbc.co.uk`` of the ``news.bbc.co.uk``.
+    The public suffixes are guessed by the :data:`GENERIC_SLDS` instead 
+    of the full list, the ip addresses are returned as they are.
+    """
+    host = host.rstrip('.')
+    if host.startswith('[') or IPV4_REGEX.match(host) is not None:
+        return host
+    labels = host.split('.')
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in GENERIC_SLDS:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+def check_partition(partition):
+    if partition is not None and partition not in PARTITIONS \
+        and not callable(partition):
+        raise ValueError('Partition must be one of %s or a callable.' % \
+                         ', '.join(PARTITIONS))
+    return partition
 
 class Url(object):
-    def __init__(self, url_re, name, parser, **kw):
+    def __init__(self, url_re, name, parser, drop_params=None, 
+                 partition=None, **kw):
+        """
+        :param drop_params: names of the query parameters, like the 
+               tracking ones, which will be dropped when the url 
+               is canonicalized
+        :param partition: how the urls are partitioned on the mq nodes,
+               overrides the one of the job, refer to :class:`UrlPartitioner`
+        """
         self.url_re = re.compile(url_re, re.IGNORECASE)
         self.name = name
         self.parser = parser
+        self.drop_params = compile_params(drop_params)
+        self.partition = check_partition(partition)
         self.options = kw
         
     def match(self, url):
@@ -59,6 +163,11 @@ class UrlPatterns(object):
                     yield url
                     break
                 
+    def get_pattern(self, url):
+        for pattern in self.url_patterns:
+            if pattern.match(url):
+                return pattern
+                
     def get_parser(self, url, pattern_names=None, options=False):
         for pattern in self.url_patterns:
             if pattern.match(str(url)):
@@ -70,4 +179,109 @@ class UrlPatterns(object):
                     return pattern.parser, pattern.options
                 return pattern.parser
         if options:
-            return None, {}
\ No newline at end of file
+            return None, {}
+
+
+class UrlCanonicalizer(object):
+    """
+    Canonicalize the urls before they are distributed and deduplicated,
+    refer to :func:`canonicalize_url`. The parameters dropped are the
+    ``drop_params`` for all the urls together with the ones of the 
+    first :class:`Url` pattern matching the canonical url.
+    
+    The canonical urls replace the original ones, so they are the urls
+    fetched, it is disabled by default in the job settings.
+    """
+    def __init__(self, url_patterns=None, drop_params=None, sort_query=True):
+        """
+        :param url_patterns: instance of :class:`UrlPatterns`
+        :param drop_params: names of the query parameters dropped
+               from all the urls, the wildcards are supported
+        :param sort_query: sort the query parameters if True
+        """
+        self.url_patterns = url_patterns
+        self.drop_params = list(drop_params or [])
+        self.sort_query = sort_query
+        
+        self.compiled = compile_params(self.drop_params)
+        
+    def canonicalize(self, url):
+        url = canonicalize_url(url, drop_params=self.compiled, 
+                               sort_query=self.sort_query)
+        if self.url_patterns is not None:
+            # the pattern is matched against the canonical url
+            pattern = self.url_patterns.get_pattern(url)
+            if pattern is not None and pattern.drop_params is not None:
+                url = canonicalize_url(url, drop_params=pattern.drop_params,
+                                       sort_query=False)
+        return url
+        
+    def __call__(self, obj):
+        """
+        :param obj: the url string or :class:`~cola.core.unit.Url`,
+               the ``Url`` is changed in place, other objects like 
+               the bundles are returned as they are
+        """
+        if isinstance(obj, basestring):
+            return self.canonicalize(obj)
+        if isinstance(obj, UrlUnit) and isinstance(obj.url, basestring):
+            url = self.canonicalize(obj.url)
+            if url != obj.url:
+                if obj.item is obj.url:
+                    obj.item = url
+                obj.url = url
+                obj.reset_fingerprint()
+        return obj
+        
+class UrlPartitioner(object):
+    """
+    Get the partition key of the urls, the urls of the same key
+    are placed on the same mq node. The ``partition`` can be:
+    
+    * ``domain``: the registrable domain, refer to :func:`get_registrable_domain`
+    * ``host``: the host, so the subdomains are placed separately
+    * ``url``: no partition key, the urls are placed by themselves
+    * a callable which gets the url and returns the key
+    
+    The one of the first :class:`Url` pattern matching the url is used if set.
+    """
+    def __init__(self, url_patterns=None, partition='domain'):
+        """
+        :param url_patterns: instance of :class:`UrlPatterns`
+        :param partition: the partition for the urls matching no pattern
+               or the pattern without its own partition
+        """
+        self.url_patterns = url_patterns
+        self.partition = check_partition(partition)
+        
+        # the patterns are matched only if some of them have the partitions
+        self.has_patterns = url_patterns is not None and \
+            any(pattern.partition is not None \
+                for pattern in url_patterns.url_patterns)
+        
+    def get_key(self, url):
+        partition = self.partition
+        if self.has_patterns:
+            pattern = self.url_patterns.get_pattern(url)
+            if pattern is not None and pattern.partition is not None:
+                partition = pattern.partition
+        
+        if partition is None or partition == 'url':
+            return
+        if callable(partition):
+            return partition(url)
+        host = get_host(url)
+        if host is not None and partition == 'domain':
+            return get_registrable_domain(host)
+        return host
+        
+    def __call__(self, obj):
+        """
+        :param obj: the url string or :class:`~cola.core.unit.Url`
+        :return: the partition key, None if the object is placed by itself,
+                 like the bundles
+        """
+        if isinstance(obj, basestring):
+            return self.get_key(obj)
+        if isinstance(obj, UrlUnit) and isinstance(obj.url, basestring):
+            return self.get_key(obj.url)
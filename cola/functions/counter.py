@@ -27,7 +27,7 @@ try:
 except ImportError:
     import pickle
 
-from cola.core.counter import Counter, MergeAggregator
+from cola.core.counter import Counter, MergeAggregator, OverwriteAggregator
 from cola.core.rpc import client_call
 from cola.core.utils import get_rpc_prefix
 
@@ -46,6 +46,9 @@ class CounterServer(object):
         self.inc_counter = Counter(container=dict_cls())
         self.acc_counter = Counter(agg=MergeAggregator(), 
                                    container=dict_cls())
+        # the latest values like the health of the deduper
+        self.gauge_counter = Counter(agg=OverwriteAggregator(),
+                                     container=dict_cls())
         
         if not os.path.exists(self.dir_):
             os.makedirs(self.dir_)
@@ -68,6 +71,8 @@ class CounterServer(object):
                                      prefix=prefix)
         rpc_server.register_function(counter_server.acc_merge, 'acc_merge',
                                      prefix=prefix)
+        rpc_server.register_function(counter_server.gauge_merge, 'gauge_merge',
+                                     prefix=prefix)
         rpc_server.register_function(counter_server.output, 'get_global',
                                      prefix=prefix)
     
@@ -78,14 +83,18 @@ class CounterServer(object):
         save_file = os.path.join(self.dir_, COUNTER_STATUS_FILENAME)
         if os.path.exists(save_file):
             with open(save_file) as f:
-                inc_counter_container, acc_counter_container = pickle.load(f)
+                containers = pickle.load(f)
+                inc_counter_container, acc_counter_container = containers[:2]
                 self.inc_counter.reset(self.dict_cls(inc_counter_container))
                 self.acc_counter.reset(self.dict_cls(acc_counter_container))
+                if len(containers) > 2:
+                    self.gauge_counter.reset(self.dict_cls(containers[2]))
                     
     def save(self):
         save_file = os.path.join(self.dir_, COUNTER_STATUS_FILENAME)
         with open(save_file, 'w') as f:
-            t = (dict(self.inc_counter.container), dict(self.acc_counter.container))
+            t = (dict(self.inc_counter.container), dict(self.acc_counter.container),
+                 dict(self.gauge_counter.container))
             pickle.dump(t, f)
         
     def inc(self, group, item, val=1):
@@ -94,6 +103,9 @@ class CounterServer(object):
     def acc(self, group, item, val):
         self.acc_counter.inc(group, item, val=val)
         
+    def gauge(self, group, item, val):
+        self.gauge_counter.inc(group, item, val=val)
+        
     def inc_merge(self, vals):
         counter = Counter(agg=self.inc_counter.agg, container=vals)
         self.inc_counter.merge(counter)
@@ -102,8 +114,18 @@ class CounterServer(object):
         counter = Counter(agg=self.acc_counter.agg, container=vals)
         self.acc_counter.merge(counter)
         
+    def gauge_merge(self, vals):
+        counter = Counter(agg=self.gauge_counter.agg, container=vals)
+        self.gauge_counter.merge(counter)
+        
     def output(self):
-        return self.inc_counter.container.get('global', {})
+        """
+        The global counters, and the gauges keyed by their groups.
+        """
+        result = dict(self.inc_counter.container.get('global', {}))
+        for group, vals in self.gauge_counter.container.items():
+            result[group] = dict(vals)
+        return result
         
 class CounterClient(object):
     def __init__(self, server, app_name=None):
@@ -113,6 +135,7 @@ class CounterClient(object):
         
         self.inc_counter = Counter()
         self.acc_counter = Counter(agg=MergeAggregator())
+        self.gauge_counter = Counter(agg=OverwriteAggregator())
         
         self.lock = threading.Lock()
         
@@ -163,6 +186,15 @@ class CounterClient(object):
     
     def get_global_acc(self, item, default_val=None):
         return self.acc_counter.get('global', item, default_val=default_val)
+    
+    def multi_gauge(self, group, **kw):
+        """
+        Set the latest values of the group, they overwrite
+        the old ones in the server when synced.
+        """
+        with self.lock:
+            for item, val in kw.iteritems():
+                self.gauge_counter.inc(group, item, val=val)
         
     def sync(self):
         with self.lock:
@@ -171,8 +203,14 @@ class CounterClient(object):
                             self.inc_counter.container)
                 client_call(self.server, self.prefix+'acc_merge', 
                             self.acc_counter.container)
+                if self.gauge_counter.container:
+                    client_call(self.server, self.prefix+'gauge_merge', 
+                                self.gauge_counter.container)
             else:
                 self.server.inc_merge(self.inc_counter.container)
                 self.server.acc_merge(self.acc_counter.container)
+                if self.gauge_counter.container:
+                    self.server.gauge_merge(self.gauge_counter.container)
             self.inc_counter.reset()
             self.acc_counter.reset()
+            self.gauge_counter.reset()
@@ -29,23 +29,27 @@ import threading
 import pprint
 import socket
 import time
+import functools
 
 from cola.core.errors import ConfigurationError
 from cola.core.utils import base58_encode, get_cpu_count, \
                             import_job_desc
 from cola.core.mq import MessageQueue, MpMessageQueueClient
+from cola.core.mq.store import Store, LEGAL_STORE_FILE_REGEX
 from cola.core.dedup import FileBloomFilterDeduper
+from cola.core.urls import UrlCanonicalizer, UrlPartitioner
 from cola.core.unit import Bundle, Url
 from cola.core.logs import get_logger
 from cola.core.utils import get_rpc_prefix, import_module
 from cola.settings import Settings
 from cola.functions.budget import BudgetApplyServer, ALLFINISHED
 from cola.functions.speed import SpeedControlServer
-from cola.functions.counter import CounterServer
+from cola.functions.counter import CounterServer, CounterClient
 from cola.job.container import Container
 
 JOB_NAME_RE = re.compile(r'(\w| )+')
 UNLIMIT_BLOOM_FILTER_CAPACITY = 1000000
+DEDUP_STATS_INTERVAL = 10 # seconds
 NOTSTARTED, RUNNING, FINISHED, IDLE = range(4)
 
 class JobRunning(Exception): pass
@@ -184,18 +188,65 @@ class Job(object):
         del params['cls']
         
         deduper_cls = deduper_cls if not self.is_multi_process \
+                        or deduper_cls.process_shared \
                         else getattr(self.manager, deduper_cls.__name__)
         self.deduper = deduper_cls(self.working_dir, capacity, **params)
         # register shutdown callback
         self.shutdown_callbacks.append(self.deduper.shutdown)
         
+    def _get_store_cls(self):
+        store = self.settings.job.components.store
+        if not self.ctx.is_local_mode or not store.get('local'):
+            return import_module(store.cls)
+        
+        params = dict(store.local)
+        store_cls = import_module(params.pop('cls'))
+        if store_cls is not Store and self._has_mmap_stores():
+            raise ConfigurationError(
+                'The mq of job `%s` is kept by %s, which would be ignored by %s, '
+                'unset `job.components.store.local` to resume the job.' % \
+                (self.job_name, Store.__name__, store_cls.__name__))
+        return functools.partial(store_cls, **params)
+    
+    def _has_mmap_stores(self):
+        mq_dir = os.path.join(self.working_dir, 'mq')
+        for _, _, files in os.walk(mq_dir):
+            for fn in files:
+                if LEGAL_STORE_FILE_REGEX.match(fn) is not None:
+                    return True
+        return False
+        
+    def _get_canonicalizer(self):
+        canonicalize = self.job_desc.settings.job.canonicalize
+        if not canonicalize.enable:
+            return
+        return UrlCanonicalizer(self.job_desc.url_patterns, 
+                                drop_params=canonicalize.drop_params,
+                                sort_query=canonicalize.sort_query)
+        
+    def _get_partitioner(self):
+        partitioner = UrlPartitioner(self.job_desc.url_patterns, 
+                                     partition=self.job_desc.settings.job.partition)
+        if partitioner.partition == 'url' and not partitioner.has_patterns:
+            return
+        return partitioner
+        
     def init_mq(self):
         mq_dir = os.path.join(self.working_dir, 'mq')
         copies = self.job_desc.settings.job.copies
         n_priorities = self.job_desc.settings.job.priorities
         
         kw = {'app_name': self.job_name, 'copies': copies, 
-              'n_priorities': n_priorities, 'deduper': self.deduper}
+              'n_priorities': n_priorities, 'deduper': self.deduper,
+              'durability': self.job_desc.settings.job.durability,
+              'compress_threshold': self.job_desc.settings.job.compress,
+              'segments': self.job_desc.settings.job.segments,
+              'lease_timeout': self.job_desc.settings.job.lease,
+              'store_cls': self._get_store_cls(),
+              'canonicalizer': self._get_canonicalizer(),
+              'placement': self.job_desc.settings.job.placement,
+              'partitioner': self._get_partitioner(),
+              'batch': self.job_desc.settings.job.batch}
         self.mq = MessageQueue(mq_dir, self.rpc_server, self.ctx.worker_addr, 
             self.ctx.addrs[:], **kw)
         # register shutdown callback
@@ -257,10 +308,36 @@ class Job(object):
         self.init_deduper()
         self.init_mq()
         self.init_functions()
+        self.init_dedup_stats()
         
         self.inited = True
         self.status = RUNNING
         
+    def init_dedup_stats(self):
+        """
+        Export the health of the deduper like the fill ratio 
+        to the counter periodically.
+        """
+        group = 'dedup#%s' % self.ctx.worker_addr
+        client = CounterClient(self.counter_arg, app_name=self.job_name)
+        
+        def report():
+            stats = self.deduper.stats()
+            if stats:
+                client.multi_gauge(group, **stats)
+                client.sync()
+        
+        def run():
+            try:
+                while not self.stopped.is_set():
+                    report()
+                    self.stopped.wait(DEDUP_STATS_INTERVAL)
+            except Exception, e:
+                self.logger.error(e)
+        self.dedup_stats_t = threading.Thread(target=run)
+        self.dedup_stats_t.setDaemon(True)
+        self.dedup_stats_t.start()
+        
     def run(self, block=False):
         self.init()
         try:
@@ -349,4 +426,8 @@ class Job(object):
             
     def remove_node(self, node):
         if hasattr(self, 'mq'):
-            self.mq.remove_node(node)
\ No newline at end of file
+            self.mq.remove_node(node)
+            
+    def set_weights(self, weights):
+        if hasattr(self, 'mq'):
+            self.mq.set_weights(weights)
\ No newline at end of file
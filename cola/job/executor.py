@@ -94,6 +94,9 @@ class Executor(object):
         self._configure_proxy()
         
         self.processing_inc = False
+        # the unit finished last, so the task can tell if
+        # the unit executed is finished or given up when stopped
+        self.last_finished = None
         
         # used for tracking if banned
         self.is_normal = True
@@ -256,6 +259,7 @@ class Executor(object):
             self.handle_banned_by_proxy = False
         
     def _finish(self, unit):
+        self.last_finished = unit
         if self.logger:
             self.logger.info('Finish %s' % str(unit))
         if self.processing_inc:
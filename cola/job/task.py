@@ -21,6 +21,7 @@ Created on 2014-5-13
 '''
 
 import os
+import time
 try:
     import cPickle as pickle
 except ImportError:
@@ -34,6 +35,8 @@ MAX_RUNNING_SECONDS = 10 * 60 # max seconds for a unit in some mq to run
 MAX_BUNDLE_RUNNING_SECONDS = 2 * 60  # max seconds for a bundle to run
 NO_BUDGETS_RETRY_TIMES = 5
 DEFAULT_URL_APPLY_SIZE = 5
+ACK_BATCH_SIZE = 50 # units finished at most before their leases acked
+ACK_INTERVAL = 5 # seconds at most before the leases of the units finished acked
 
 TASK_STATUS_FILENAME = 'task.status'
 
@@ -69,6 +72,14 @@ class Task(object):
             [MAX_RUNNING_SECONDS/(2**i) for i in range(self.full_priorities)])
         self.priorities_objs = [[] for _ in range(self.full_priorities)]
         self.starts = []
+        # the leases of the units got from mq, keyed by the fingerprint of the unit,
+        # each one is the list of the leases of the units with the same fingerprint,
+        # and a lease is the list of the lease id and the time renewed last
+        self.leases = {}
+        self.lease_timeout = self.settings.job.lease
+        # the lease ids of the units finished, acked in batches
+        self.acks = []
+        self.acked_time = time.time()
         
         self.runnings = []
         self.running = None
@@ -87,15 +98,40 @@ class Task(object):
         self.load()
         
     def save(self):
+        # the units finished are acked, then the ones with leases 
+        # are put back into mq, the others are kept until next time
+        self._ack_finished(force=True)
+        lease_ids = [lease[0] for leases in self.leases.itervalues() \
+                     for lease in leases]
+        if len(lease_ids) > 0:
+            self.mq.nack(lease_ids)
+        n_leases = dict((key, len(leases)) for key, leases in self.leases.iteritems())
+        priorities_objs = []
+        for objs in self.priorities_objs:
+            kept_objs = []
+            for obj in objs:
+                key = self._lease_key(obj)
+                if n_leases.get(key, 0) > 0:
+                    n_leases[key] -= 1
+                else:
+                    kept_objs.append(obj)
+            priorities_objs.append(kept_objs)
+        self.leases = {}
+        
         save_file = os.path.join(self.dir_, TASK_STATUS_FILENAME)
         with open(save_file, 'w') as f:
-            pickle.dump((self.starts, self.priorities_objs), f)
+            pickle.dump((self.starts, priorities_objs), f)
             
     def load(self):
         save_file = os.path.join(self.dir_, TASK_STATUS_FILENAME)
         if os.path.exists(save_file):
             with open(save_file) as f:
-                self.starts, self.priorities_objs = pickle.load(f)
+                status = pickle.load(f)
+            if isinstance(status, tuple):
+                self.starts, self.priorities_objs = status
+            else:
+                # only the start units were saved by some versions
+                self.starts = status
             
     def finish(self):
         self.save()
@@ -111,8 +147,9 @@ class Task(object):
             starts.append(self.job_desc.starts[i])
             i += self.settings.job.instances
 
-        for start in starts:
-            if not self.mq.exist(start):
+        exists = self.mq.exist([str(start) for start in starts])
+        for start, exist in zip(starts, exists):
+            if not exist:
                 if not isinstance(start, self.job_desc.unit_cls):
                     start = self.job_desc.unit_cls(start)
                 self.starts.append(start)
@@ -134,16 +171,81 @@ class Task(object):
         else:
             is_inc = priority == self.n_priorities
             if not is_inc:
-                running = self.mq.get(priority=priority)
+                leased = self.mq.get_leased(priority=priority)
             else:
-                running = self.mq.get_inc()
-            if running:
+                leased = self.mq.get_inc_leased()
+            for lease_id, running in leased:
                 if isinstance(running, str):
                     running = self.job_desc.unit_cls(running)
+                self._add_lease(running, [lease_id, time.time()])
                 runnings.append(running)
                 
     def _has_not_finished(self, priority):
         return len(self.priorities_objs[priority]) > 0
+    
+    def _lease_key(self, unit):
+        if hasattr(unit, 'fingerprint'):
+            return unit.fingerprint
+        return str(unit)
+    
+    def _add_lease(self, unit, lease):
+        self.leases.setdefault(self._lease_key(unit), []).append(lease)
+        
+    def _pop_lease(self, unit):
+        key = self._lease_key(unit)
+        leases = self.leases.get(key)
+        if not leases:
+            return
+        lease = leases.pop(0)
+        if len(leases) == 0:
+            del self.leases[key]
+        return lease
+                
+    def _finish_unit(self, unit, obj):
+        lease = self._pop_lease(unit)
+        if lease is None:
+            return
+        if obj is not None:
+            # not finished, the lease goes with the unit returned
+            self._add_lease(obj, lease)
+        elif self.executor.last_finished is unit:
+            self.acks.append(lease[0])
+            if len(self.acks) >= ACK_BATCH_SIZE:
+                self._ack_finished(force=True)
+        else:
+            # given up when stopped, so put back when saved
+            self._add_lease(unit, lease)
+            
+    def _ack_finished(self, force=False):
+        """
+        Ack the leases of the units finished in a single call,
+        when ``ACK_INTERVAL`` seconds passed since last time, or forced.
+        """
+        if not force and time.time() - self.acked_time < ACK_INTERVAL:
+            return
+        self.acked_time = time.time()
+        if len(self.acks) == 0:
+            return
+        
+        acks, self.acks = self.acks, []
+        self.mq.ack(acks)
+            
+    def _renew_leases(self):
+        """
+        Renew the leases of the units kept by the task when half of
+        the lease time passed, so that the ones across several rounds,
+        like the long bundles, will not be handed to the others.
+        """
+        now = time.time()
+        leases = [lease for unit_leases in self.leases.itervalues() \
+                  for lease in unit_leases \
+                  if now - lease[1] >= self.lease_timeout / 2.0]
+        if len(leases) == 0:
+            return
+        
+        self.mq.renew([lease[0] for lease in leases])
+        for lease in leases:
+            lease[1] = now
         
     def _exceed_no_budgets_retry_times(self, retry_times):
         return retry_times > NO_BUDGETS_RETRY_TIMES
@@ -198,8 +300,11 @@ class Task(object):
                         if clock.clock() >= last:
                             break
                         
+                        self._renew_leases()
+                        self._ack_finished()
                         if not is_inc:
                             if self._has_not_finished(curr_priority):
+                                # the units left have applied for the budgets
                                 no_budgets_times = 0
                                 self._get_unit(curr_priority, self.runnings)
                             else:
@@ -234,12 +339,15 @@ class Task(object):
                             self.running = self.runnings.pop()
                             obj = self.executor.execute(self.running, is_inc=is_inc)
                             
+                        self._finish_unit(self.running, obj)
                         self.running = None
                         if obj is not None:
                             self.runnings.insert(0, obj)
                             self.runnings = OrderedDict.fromkeys(self.runnings).keys()
                 finally:
+                    # the unfinished units are kept with their leases for the next round
                     self.priorities_objs[curr_priority].extend(self.runnings)
+                    self.runnings = []
                     
                 curr_priority = (curr_priority+1) % self.full_priorities
         finally:
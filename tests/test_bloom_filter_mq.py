@@ -26,7 +26,9 @@ import shutil
 import os
 
 from cola.core.mq.store import Store
-from cola.core.dedup import FileBloomFilterDeduper
+from cola.core.dedup import FileBloomFilterDeduper, MapDeduper, \
+    FingerprintDeduper
+from cola.core.unit import Url
 
 class Test(unittest.TestCase):
 
@@ -67,6 +69,45 @@ class Test(unittest.TestCase):
         nums = [num, num2, num3]
         self.assertEqual(self.store.put(nums), [num3])
 
+    def testExistMany(self):
+        deduper = self.store.deduper
+        self.assertEqual(deduper.exist_many(['1', '2', '1']), [False, False, True])
+        self.assertEqual(deduper.exist_many(['2', '3']), [True, False])
+        
+        calls = []
+        class CountedDeduper(MapDeduper):
+            def exist(self, key):
+                calls.append(key)
+                return super(CountedDeduper, self).exist(key)
+            
+            def exist_many(self, keys):
+                calls.append(keys)
+                return super(CountedDeduper, self).exist_many(keys)
+            
+        self.store.shutdown()
+        self.store = Store(self.node_dir, mkdirs=True, 
+                           deduper=CountedDeduper(self.dir_, 10))
+        objs = [str(i) for i in range(500)]
+        self.assertEqual(self.store.put(objs + ['1', ' ']), objs)
+        self.assertEqual(calls, [objs + ['1']])
+        self.assertEqual(self.store.put(objs[:10], force=True), objs[:10])
+        self.assertEqual(len(calls), 1)
+        
+        # the fingerprints of the units are reused
+        urls = [Url('http://qinxuye.me/%s' % i) for i in range(3)]
+        self.assertEqual(self.store.deduper.exist_digests(
+            [url.url for url in urls], [None] * 3), [False] * 3)
+        del calls[:]
+        self.assertEqual(self.store.put(urls), [])
+        self.assertEqual(calls, [[url.url for url in urls]])
+        
+        deduper = self.store.deduper = FingerprintDeduper(
+            os.path.join(self.dir_, 'fingerprint'))
+        digests = [url.fingerprint for url in urls]
+        self.assertEqual(deduper.exist_digests(['1', '2', '3'], digests), [False] * 3)
+        self.assertEqual(self.store.put(urls), [])
+        deduper.shutdown()
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
\ No newline at end of file
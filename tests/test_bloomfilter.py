@@ -19,8 +19,20 @@ Created on 2013-5-31
 '''
 import unittest
 import random
+import tempfile
+import shutil
+import os
+import hashlib
+import multiprocessing
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
-from cola.core.bloomfilter import BloomFilter
+from cola.core.bloomfilter import BloomFilter, FileBloomFilter, \
+    MmapBloomFilter, ScalableBloomFilter, BloomFilterFileDamage, \
+    HASH_LEGACY, HASH_DOUBLE, HASH_DIGEST, convert_file, load_status, \
+    dump_status, count_bits
 
 
 class Test(unittest.TestCase):
@@ -35,6 +47,172 @@ class Test(unittest.TestCase):
         bf.add('apple')
         self.assertTrue('apple' in bf)
         self.assertFalse('banana' in bf)
+        
+        self.assertFalse(bf.verify('banana'))
+        self.assertTrue(bf.verify('banana'))
+        
+        # the bits can still be got as a long
+        hash_ = bf.hash
+        self.assertGreater(hash_, 0)
+        bf.hash = hash_
+        self.assertEqual(bf.hash, hash_)
+        self.assertTrue('banana' in bf)
+        
+        # the md5 digest computed before is reused
+        self.assertTrue(bf.contains('apple', digest=hashlib.md5('apple').digest()))
+        self.assertFalse(bf.verify('orange', digest=hashlib.md5('orange').digest()))
+        self.assertTrue('orange' in bf)
+        
+    def testCountBits(self):
+        self.assertEqual(count_bits(bytearray()), 0)
+        self.assertEqual(count_bits('\xff\x01\x80'), 10)
+        self.assertEqual(count_bits('\xff\x01\x80', start=1), 2)
+        bits = bytearray(os.urandom(3 << 20))
+        self.assertEqual(count_bits(bits), 
+                         sum(bin(byte).count('1') for byte in bits))
+        
+    def testLegacyFile(self):
+        dir_ = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(dir_, 'bloomfilter')
+            
+            # the file saved by the old versions keeps the bits in a long
+            bf = BloomFilter(capacity=100)
+            bf.hash_version = HASH_LEGACY
+            bf.add('apple')
+            with open(filename, 'wb') as f:
+                pickle.dump((100, 0.01, bf.hash), f)
+                
+            with FileBloomFilter(filename, 100) as bf:
+                self.assertEqual(bf.hash_version, HASH_LEGACY)
+                self.assertTrue('apple' in bf)
+                self.assertFalse(bf.verify('banana'))
+                bf.sync()
+            self.assertEqual(load_status(filename)[-1], HASH_LEGACY)
+            with FileBloomFilter(filename, 100) as bf:
+                self.assertTrue('banana' in bf)
+                
+            with open(filename, 'wb') as f:
+                pickle.dump((100, 0.01, bf.hash), f)
+            self.assertTrue(convert_file(filename))
+            self.assertFalse(convert_file(filename))
+            with FileBloomFilter(filename, 100) as bf:
+                self.assertTrue('apple' in bf)
+                
+            # the filter saved by the last version keeps hashing by SHA-1
+            bf = BloomFilter(capacity=100)
+            bf.hash_version = HASH_DOUBLE
+            bf.add('apple')
+            with open(filename, 'wb') as f:
+                dump_status(f, 100, 0.01, bf.bits, HASH_DOUBLE)
+            with FileBloomFilter(filename, 100) as bf:
+                self.assertEqual(bf.hash_version, HASH_DOUBLE)
+                self.assertTrue(bf.contains('apple', digest=hashlib.md5('pear').digest()))
+                
+            # the filter never grows, so the bits are kept
+            with FileBloomFilter(filename, 1000, false_positive_rate=0.001) as bf:
+                self.assertEqual((bf.capacity, bf.false_positive_rate), (100, 0.01))
+                self.assertEqual(bf.hash_version, HASH_DOUBLE)
+                self.assertTrue('apple' in bf)
+        finally:
+            shutil.rmtree(dir_)
+
+    def testMmapBloomFilter(self):
+        dir_ = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(dir_, 'bloomfilter.mmap')
+            legacy_filename = os.path.join(dir_, 'bloomfilter')
+            with FileBloomFilter(legacy_filename, 100) as bf:
+                bf.add('apple')
+                bf.sync()
+            
+            # the legacy bits are kept even if a larger capacity is set
+            bf = MmapBloomFilter(filename, 1000, legacy_filename=legacy_filename)
+            self.assertTrue('apple' in bf)
+            self.assertEqual(bf.capacity, 100)
+            self.assertEqual(bf.count, 1)
+            self.assertFalse(bf.verify('banana'))
+            
+            # the bits are shared by the processes and the pickled ones
+            def verify(bf, item):
+                bf.verify(item)
+            process = multiprocessing.Process(target=verify, args=(bf, 'orange'))
+            process.start()
+            process.join()
+            self.assertTrue('orange' in bf)
+            
+            other = pickle.loads(pickle.dumps(bf))
+            self.assertTrue(other.verify('banana'))
+            other.add('pear')
+            self.assertTrue('pear' in bf)
+            other.close()
+            bf.close()
+            
+            # not synced, but the bits are kept in the file
+            bf = MmapBloomFilter(filename, 100, sync_interval=0)
+            for item in ('apple', 'banana', 'orange', 'pear'):
+                self.assertTrue(item in bf)
+            self.assertEqual(bf.hash_version, HASH_DIGEST)
+            
+            # the existing file is never rewritten while mapped
+            other = MmapBloomFilter(filename, 1000, false_positive_rate=0.001,
+                                    sync_interval=0)
+            self.assertEqual((other.capacity, other.false_positive_rate), (100, 0.01))
+            other.add('grape')
+            self.assertTrue('grape' in bf)
+            for item in ('apple', 'banana', 'orange', 'pear'):
+                self.assertTrue(item in other)
+            other.close()
+            bf.close()
+            
+            with open(filename, 'r+b') as f:
+                f.truncate(100)
+            self.assertRaises(BloomFilterFileDamage, 
+                              lambda: MmapBloomFilter(filename, 100))
+        finally:
+            shutil.rmtree(dir_)
+            
+    def testScalableBloomFilter(self):
+        dir_ = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(dir_, 'bloomfilter.mmap')
+            bf = MmapBloomFilter(filename, 100, false_positive_rate=0.005)
+            bf.add('apple')
+            bf.close()
+            
+            # the file of the mmap bloom filter is reused as the first one
+            bf = ScalableBloomFilter(filename, 100, false_positive_rate=0.01)
+            self.assertTrue('apple' in bf)
+            self.assertEqual(bf.filters[0].capacity, 100)
+            
+            items = [str(i) for i in range(1000)]
+            false_positives = sum(bf.verify(item) for item in items)
+            self.assertLess(false_positives, 20)
+            self.assertGreater(len(bf.filters), 1)
+            for item in items:
+                self.assertTrue(item in bf)
+            
+            stats = bf.stats()
+            self.assertEqual(stats['filters'], len(bf.filters))
+            self.assertEqual(stats['count'], 1001 - false_positives)
+            self.assertGreaterEqual(stats['capacity'], 1001)
+            self.assertTrue(0 < stats['fill_ratio'] < 1)
+            # estimated by the counts without walking the bits
+            for sub_bf in bf.filters:
+                self.assertAlmostEqual(sub_bf.fill_ratio(), sub_bf.exact_fill_ratio(), 
+                                       delta=.02)
+            # estimated by the counts, so it is only around the expected one
+            self.assertLess(stats['false_positive_rate'], 0.015)
+            bf.close()
+            
+            # the chain is loaded back
+            bf = ScalableBloomFilter(filename, 100)
+            self.assertEqual(bf.stats(), stats)
+            for item in items:
+                self.assertTrue(item in bf)
+            bf.close()
+        finally:
+            shutil.rmtree(dir_)
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testBloomFilter']
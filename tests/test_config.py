@@ -46,6 +46,10 @@ class Test(unittest.TestCase):
         assert self.obj.name == 'cola'
         assert self.obj.list[2].count == 3
         
+        # the items which are not dicts are kept
+        self.obj.update(**{'names': ['utm_*', 'sid']})
+        assert self.obj.names == ['utm_*', 'sid']
+        
     def testPickle(self):
         c = pickle.dumps(main_conf)
         new_conf = pickle.loads(c)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-26
+
+@author: chine
+'''
+
+import unittest
+import tempfile
+import shutil
+import os
+import time
+import struct
+
+from cola.core import dedup
+from cola.core.dedup import FingerprintDeduper, TTLBloomFilterDeduper, \
+    FINGERPRINT_LOG_FILENAME, FINGERPRINT_FORMAT
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_ = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.dir_)
+        
+    def testFingerprintDeduper(self):
+        deduper = FingerprintDeduper(self.dir_, buffer_size=10)
+        keys = ['http://qinxuye.me/%s' % i for i in range(95)]
+        
+        self.assertEqual(deduper.exist_many(keys[:50]), [False] * 50)
+        self.assertTrue(deduper.exist(keys[0]))
+        self.assertTrue(deduper.exist(keys[0].decode('utf-8')))
+        self.assertEqual(deduper.exist_many(keys[40:60] + keys[55:56]), 
+                         [True] * 10 + [False] * 10 + [True])
+        for key in keys[60:]:
+            self.assertFalse(deduper.exist(key))
+        
+        # the runs are merged
+        stats = deduper.stats()
+        self.assertEqual(stats['count'], 95)
+        self.assertLess(stats['runs'], 5)
+        # the fingerprints in the buffer are already in the log
+        self.assertEqual(
+            os.path.getsize(os.path.join(self.dir_, FINGERPRINT_LOG_FILENAME)), 
+            5 * struct.calcsize(FINGERPRINT_FORMAT))
+        deduper.shutdown()
+        
+        # the runs and the log are loaded back
+        deduper = FingerprintDeduper(self.dir_, buffer_size=10)
+        self.assertEqual(deduper.stats(), stats)
+        self.assertEqual(deduper.exist_many(keys), [True] * 95)
+        self.assertFalse(deduper.exist('http://qinxuye.me/95'))
+        deduper.shutdown()
+        
+    def testTTLBloomFilterDeduper(self):
+        now = [1000000.0]
+        
+        class FakeTime(object):
+            @staticmethod
+            def time():
+                return now[0]
+        dedup.time = FakeTime
+        try:
+            # 3 periods of 100 seconds
+            deduper = TTLBloomFilterDeduper(self.dir_, 30, ttl=300, generations=3)
+            self.assertFalse(deduper.exist('a'))
+            self.assertTrue(deduper.exist('a'))
+            
+            now[0] += 150
+            self.assertEqual(deduper.exist_many(['a', 'b']), [True, False])
+            self.assertEqual(deduper.stats()['generations'], 2)
+            deduper.shutdown()
+            
+            # the filters are loaded back
+            now[0] += 200
+            deduper = TTLBloomFilterDeduper(self.dir_, 30, ttl=300, generations=3)
+            self.assertEqual(deduper.exist_many(['a', 'b']), [True, True])
+            
+            # forgotten after the ttl
+            now[0] += 100
+            self.assertEqual(deduper.exist_many(['a', 'b']), [False, True])
+            self.assertEqual(deduper.stats()['count'], 2)
+            now[0] += 300
+            self.assertFalse(deduper.exist('b'))
+            # only the filters of the last 2 periods are left
+            self.assertEqual(deduper.stats()['generations'], 2)
+            self.assertEqual(len(os.listdir(self.dir_)), 2)
+            deduper.shutdown()
+        finally:
+            dedup.time = time
+        
+    @unittest.skipUnless(os.environ.get('COLA_BENCHMARK'), 
+                         'set COLA_BENCHMARK to run the benchmarks')
+    def testBenchmark(self):
+        n = 200000
+        deduper = FingerprintDeduper(self.dir_)
+        keys = ['http://qinxuye.me/%s' % i for i in xrange(n)]
+        
+        start = time.time()
+        for i in xrange(0, n, 1000):
+            deduper.exist_many(keys[i:i+1000])
+        spent = time.time() - start
+        
+        start = time.time()
+        deduper.shutdown()
+        shutdown_spent = time.time() - start
+        
+        size = sum(os.path.getsize(os.path.join(self.dir_, fn)) \
+                   for fn in os.listdir(self.dir_))
+        print '\nfingerprint deduper: %d keys per second, ' \
+            '%.1f bytes per key, shutdown in %.3fs' % \
+            (n / max(spent, 1e-6), size / float(n), shutdown_spent)
+        self.assertLessEqual(size, n * 8)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -109,6 +109,15 @@ class Test(unittest.TestCase):
             self.assertEqual(self.cli2.get_local_acc(self.addr, 1, 'normal'), [100, ])
             self.cli2.sync()
             self.assertEqual(self.serv.acc_counter.get('%s#%s'%(self.addr, 1), 'normal'), [100, ])
+            
+            # the gauges are overwritten by the latest values
+            self.cli1.multi_gauge('dedup', count=10, fill_ratio=.1)
+            self.cli1.sync()
+            self.cli2.multi_gauge('dedup', count=20)
+            self.cli2.sync()
+            self.assertEqual(self.serv.gauge_counter.get('dedup', 'count'), 20)
+            self.assertEqual(self.serv.output()['dedup'], 
+                             {'count': 20, 'fill_ratio': .1})
         finally:
             self.serv.shutdown()
             
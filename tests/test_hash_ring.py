@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-27
+
+@author: chine
+'''
+
+import unittest
+import time
+import os
+from collections import Counter
+
+from cola.core.mq.hash_ring import HashRing
+from cola.core.mq.placement import JumpHash, RendezvousHash, jump_hash
+from cola.core.mq.distributor import Distributor
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = ['192.168.0.%s:11103' % i for i in range(10)]
+        
+    def without_successors(self, ring):
+        # the ring walked without the successor tables
+        walk_ring = HashRing.__new__(HashRing)
+        walk_ring.__dict__.update(ring.__dict__)
+        walk_ring._successors = []
+        return walk_ring
+        
+    def walk(self, ring, key):
+        return list(self.without_successors(ring).iterate_nodes(key))
+        
+    def testSuccessors(self):
+        ring = HashRing(self.nodes)
+        for i in range(1000):
+            key = 'http://qinxuye.me/%s' % i
+            nodes = list(ring.iterate_nodes(key))
+            self.assertEqual(nodes, self.walk(ring, key))
+            self.assertEqual(sorted(nodes), sorted(self.nodes))
+            self.assertEqual(ring.get_nodes(key, 3), tuple(nodes[:3]))
+            self.assertEqual(nodes[0], ring.get_node(key))
+            
+        # only 2 nodes precomputed, the rest are walked
+        ring = HashRing(self.nodes, successors=2)
+        for i in range(100):
+            key = 'http://qinxuye.me/%s' % i
+            self.assertEqual(list(ring.iterate_nodes(key)), self.walk(ring, key))
+            self.assertEqual(list(ring.get_nodes(key, 4)), self.walk(ring, key)[:4])
+            
+        self.assertEqual(HashRing(self.nodes[:1]).get_nodes('a', 3), 
+                         (self.nodes[0], ))
+        
+    def testJumpHash(self):
+        self.assertEqual([jump_hash(i, 1) for i in range(10)], [0] * 10)
+        # a key either stays or jumps to the new bucket
+        for i in range(1000):
+            key = i * 0x9e3779b97f4a7c15 & 0xffffffffffffffff
+            buckets = [jump_hash(key, n) for n in range(1, 20)]
+            for n, (old, new) in enumerate(zip(buckets, buckets[1:]), 2):
+                self.assertTrue(new == old or new == n - 1)
+        
+    def testPlacement(self):
+        keys = ['http://qinxuye.me/%s' % i for i in range(5000)]
+        for placement_cls in (JumpHash, RendezvousHash):
+            placement = placement_cls(self.nodes)
+            olds = dict((key, placement.get_nodes(key, 3)) for key in keys)
+            for key, nodes in olds.iteritems():
+                self.assertEqual(len(set(nodes)), 3)
+                self.assertEqual(placement.get_node(key), nodes[0])
+            self.assertEqual(sorted(placement.iterate_nodes(keys[0])), 
+                             sorted(self.nodes))
+            counts = Counter(nodes[0] for nodes in olds.itervalues())
+            self.assertEqual(len(counts), len(self.nodes))
+            self.assertLess(max(counts.values()), len(keys) / len(self.nodes) * 1.3)
+            
+            # the keys moved only when their nodes are removed, 
+            # or moved onto the last node by the jump hash
+            removed, last = self.nodes[3], self.nodes[-1]
+            placement.remove_node(removed)
+            for key, nodes in olds.iteritems():
+                node = placement.get_node(key)
+                self.assertNotEqual(node, removed)
+                if nodes[0] != removed and \
+                    (placement_cls is RendezvousHash or nodes[0] != last):
+                    self.assertEqual(node, nodes[0])
+                    
+            placement.add_node(removed)
+            if placement_cls is RendezvousHash:
+                self.assertEqual(placement.get_nodes(keys[0], 3), olds[keys[0]])
+            
+        self.assertRaises(ValueError, lambda: JumpHash(self.nodes, {self.nodes[0]: 2}))
+        self.assertEqual(JumpHash().get_nodes('a', 2), ())
+        self.assertEqual(RendezvousHash().get_nodes('a', 1), ())
+        
+    def testWeightedRendezvous(self):
+        weights = {self.nodes[0]: 3}
+        placement = RendezvousHash(self.nodes[:3], weights=weights)
+        counts = Counter(placement.get_node('http://qinxuye.me/%s' % i) 
+                         for i in range(10000))
+        # 3 / 5 of the keys
+        self.assertAlmostEqual(counts[self.nodes[0]] / 10000., .6, delta=.03)
+        
+    def testDistributorPlacement(self):
+        self.assertRaises(ValueError, lambda: Distributor(self.nodes, placement='x'))
+        
+        urls = ['http://qinxuye.me/%s' % i for i in range(10000)]
+        for placement in ('ring', 'jump', 'rendezvous'):
+            distributor = Distributor(self.nodes, copies=1, placement=placement)
+            node_objs, backup_node_objs = distributor.distribute(urls)
+            self.assertEqual(sum(len(objs) for objs in node_objs.itervalues()), 
+                             len(urls))
+            for backup_node, m in backup_node_objs.iteritems():
+                self.assertNotIn(backup_node, m)
+            
+            # the placement is changed in place
+            hash_ring = distributor.hash_ring
+            distributor.remove_node(self.nodes[0])
+            distributor.add_node(self.nodes[0])
+            self.assertEqual(distributor.hash_ring is hash_ring, 
+                             placement != 'ring')
+            if placement != 'jump':
+                # and the urls are placed back, the jump hash appends
+                # the node added to the end
+                self.assertEqual(distributor.distribute(urls)[0], node_objs)
+        
+    def testDistributorWeights(self):
+        urls = ['http://qinxuye.me/%s' % i for i in range(20000)]
+        heavy = self.nodes[0]
+        for placement in ('ring', 'rendezvous'):
+            distributor = Distributor(self.nodes, copies=0, placement=placement)
+            olds = {}
+            for node, objs in distributor.distribute(urls)[0].iteritems():
+                olds.update((obj, node) for obj in objs)
+                
+            distributor.set_weights({heavy: 2})
+            news = {}
+            for node, objs in distributor.distribute(urls)[0].iteritems():
+                news.update((obj, node) for obj in objs)
+            # 2 / 11 of the urls
+            share = sum(1 for node in news.itervalues() if node == heavy) / 20000.
+            self.assertAlmostEqual(share, 2 / 11., delta=.03)
+            
+            moved = [url for url in urls if news[url] != olds[url]]
+            moved_share = len(moved) / 20000.
+            if placement == 'rendezvous':
+                # only the urls won by the heavy node are moved,
+                # 2 / 11 - 1 / 10 of the urls
+                self.assertTrue(all(news[url] == heavy for url in moved))
+                self.assertAlmostEqual(moved_share, 2 / 11. - .1, delta=.02)
+            else:
+                # the ring is rebuilt, so more urls are moved
+                self.assertLess(moved_share, .2)
+                
+        distributor = Distributor(self.nodes, placement='jump')
+        self.assertRaises(ValueError, lambda: distributor.set_weights({heavy: 2}))
+        
+    @unittest.skipUnless(os.environ.get('COLA_BENCHMARK'), 
+                         'set COLA_BENCHMARK to run the benchmarks')
+    def testDistributeBenchmark(self):
+        n, n_nodes, batch = 1000000, 50, 1000
+        nodes = ['192.168.%s.%s:11103' % (i / 256, i % 256) for i in range(n_nodes)]
+        distributor = Distributor(nodes, copies=1)
+        
+        start = time.time()
+        counts = Counter()
+        for i in xrange(0, n, batch):
+            urls = ['http://qinxuye.me/%s' % j for j in xrange(i, i+batch)]
+            node_objs, backup_node_objs = distributor.distribute(urls)
+            for node, objs in node_objs.iteritems():
+                counts[node] += len(objs)
+        spent = time.time() - start
+        
+        # the old way walking the ring for a part of the urls
+        ring = self.without_successors(distributor.hash_ring)
+        m = 20000
+        walk_start = time.time()
+        for j in xrange(m):
+            it = ring.iterate_nodes('http://qinxuye.me/%s' % j)
+            next(it), next(it)
+        walk_spent = (time.time() - walk_start) * n / m
+        
+        print '\ndistribute %d urls over %d nodes: %.2fs, %.2fs estimated ' \
+            'by walking the ring, the most loaded node got %.2f%%' % \
+            (n, n_nodes, spent, walk_spent, max(counts.values()) * 100. / n)
+        self.assertEqual(sum(counts.values()), n)
+        self.assertEqual(len(counts), n_nodes)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -34,6 +34,9 @@ class Test(unittest.TestCase):
             test_obj = Url('http://qinxuye.me')
             self.proxy.put(test_obj, )
             self.assertEqual(self.proxy.get(), test_obj)
+            
+            self.assertFalse(self.proxy.exist('http://qinxuye.me'))
+            self.assertEqual(self.proxy.exist(['a', 'b']), [False, False])
         finally:
             self.mq.shutdown()
 
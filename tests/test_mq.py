@@ -71,6 +71,34 @@ class Test(unittest.TestCase):
             gets.append(get)
                       
         self.assertEqual(sorted(data), sorted(gets))
+        
+        # test stats, the backups are kept after got
+        n_backups = lambda stats: sum(sum(b['messages'] for b in s['backups'].values()) \
+                                      for s in stats.values())
+        self.assertEqual(n_backups(self.client.stats()), len(data))
+        mq.put(data, flush=True)
+        stats = self.client.stats()
+        self.assertEqual(sorted(stats.keys()), sorted(self.nodes))
+        self.assertEqual(sum(s['priorities'][0]['messages'] \
+                             for s in stats.values()), len(data))
+        self.assertEqual(n_backups(stats), 2 * len(data))
+        self.assertEqual(len(mq.get(size=len(data))), len(data))
+        stats = self.client.stats()
+        self.assertEqual(sum(s['priorities'][0]['messages'] \
+                             for s in stats.values()), 0)
+                   
+        # test get with leases
+        mq.put(data, flush=True)
+        leased = mq.get_leased(size=len(data))
+        self.assertEqual(sorted(obj for _, obj in leased), sorted(data))
+        self.assertIsNone(mq.get())
+        self.assertEqual(mq.renew([lease_id for lease_id, _ in leased]), 
+                         len(data))
+        self.assertEqual(mq.nack([lease_id for lease_id, _ in leased[:5]]), 5)
+        self.assertEqual(mq.ack([lease_id for lease_id, _ in leased[5:]]), 
+                         len(data) - 5)
+        self.assertEqual(sorted(mq.get(size=len(data))), 
+                         sorted(obj for _, obj in leased[:5]))
                    
         # test mq client
         data = str(random.randint(10000, 50000))
@@ -136,6 +164,28 @@ class Test(unittest.TestCase):
                 new_mq.shutdown()
             finally:
                 shutil.rmtree(new_dir)
+                
+    def testSpill(self):
+        dead_node = 'localhost:%s' % random.randint(30001, 40000)
+        new_dir = tempfile.mkdtemp()
+        mq = MessageQueue(new_dir, None, self.nodes[0], [self.nodes[0], dead_node], 
+                          copies=0, batch={'buffer': 1, 'timeout': .1})
+        try:
+            # the objects failed to send are kept in the buffer
+            data = [str(i) for i in range(100)]
+            mq.put(data, flush=True)
+            
+            # so the objects of the dead node are put into the local node
+            data2 = [str(i) for i in range(100, 200)]
+            mq.put(data2)
+            gets = mq.get(size=200)
+            self.assertTrue(set(data2).issubset(gets))
+            self.assertLess(len(gets), 200)
+        finally:
+            try:
+                mq.shutdown()
+            finally:
+                shutil.rmtree(new_dir)
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
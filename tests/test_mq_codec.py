@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-12
+
+@author: chine
+'''
+import unittest
+import hashlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from cola.core.unit import Url, Bundle
+from cola.core.mq.codec import Codecs, MARSHAL, PICKLE, URL, COMPRESSED
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.codecs = Codecs()
+
+    def testUrl(self):
+        for url in (Url('http://qinxuye.me'),
+                    Url('http://qinxuye.me/about', force=True, priority=2),
+                    Url(u'http://qinxuye.me/中文', priority=300)):
+            str_ = self.codecs.encode(url)
+            self.assertEqual(str_[0], URL)
+            self.assertLessEqual(len(str_), len(url.url.encode('utf-8')) + 4)
+
+            obj = self.codecs.decode(str_)
+            self.assertIsInstance(obj, Url)
+            self.assertEqual(obj.url, url.url)
+            self.assertEqual(type(obj.url), type(url.url))
+            self.assertEqual(obj.force, url.force)
+            self.assertEqual(obj.priority, url.priority)
+
+        url = Url('http://qinxuye.me')
+        url.error_times = 2
+        str_ = self.codecs.encode(url)
+        self.assertEqual(str_[0], PICKLE)
+        self.assertEqual(self.codecs.decode(str_).error_times, 2)
+
+    def testMarshal(self):
+        for obj in ('a', u'中文', 1, ['a', 'b']):
+            str_ = self.codecs.encode(obj)
+            self.assertEqual(str_[0], MARSHAL)
+            self.assertEqual(self.codecs.decode(str_), obj)
+
+    def testCompress(self):
+        bundle = Bundle('qinxuye')
+        bundle.current_urls = ['http://qinxuye.me/%s' % i for i in range(100)]
+        self.assertEqual(self.codecs.encode(bundle)[0], PICKLE)
+
+        codecs = Codecs(compress_threshold=500)
+        str_ = codecs.encode(bundle)
+        self.assertEqual(str_[0], COMPRESSED)
+        self.assertLess(len(str_), len(self.codecs.encode(bundle)))
+        self.assertEqual(codecs.decode(str_).current_urls,
+                         bundle.current_urls)
+        # small objects are left uncompressed
+        self.assertEqual(codecs.encode(Bundle('a'))[0], PICKLE)
+
+    def testFingerprint(self):
+        url = Url(u'http://qinxuye.me/中文')
+        fingerprint = hashlib.md5(u'http://qinxuye.me/中文'.encode('utf-8')).digest()
+        self.assertEqual(url.fingerprint, fingerprint)
+        self.assertNotIn('_fingerprint', url.__dict__)
+        
+        # the fingerprint is kept when pickled, but not by the url codec
+        for protocol in (0, pickle.HIGHEST_PROTOCOL):
+            obj = pickle.loads(pickle.dumps(url, protocol))
+            self.assertEqual(obj._fingerprint, fingerprint)
+            self.assertEqual(obj.url, url.url)
+        self.assertEqual(self.codecs.encode(url)[0], URL)
+        self.assertEqual(self.codecs.decode(self.codecs.encode(url)).fingerprint,
+                         fingerprint)
+        
+        # the units pickled by the old versions
+        obj = Bundle.__new__(Bundle)
+        obj.__setstate__({'item': 'qinxuye', 'label': 'qinxuye', 'force': False,
+                          'priority': 0, 'error_urls': [], 'current_urls': []})
+        self.assertEqual(obj.fingerprint, hashlib.md5('qinxuye').digest())
+        
+        url.url = 'http://qinxuye.me'
+        url.reset_fingerprint()
+        self.assertEqual(url.fingerprint, hashlib.md5('http://qinxuye.me').digest())
+
+    def testBadString(self):
+        self.assertRaises(ValueError, self.codecs.decode, 'x1234')
+        self.assertRaises(ValueError, self.codecs.decode, 'm')
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,100 @@
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-22
+
+@author: chine
+'''
+import unittest
+import tempfile
+import os
+import shutil
+
+from cola.core.mq.memory_store import MemoryStore
+
+
+class Test(unittest.TestCase):
+
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.dir_ = os.path.join(self.base_dir, 'store')
+        self.node = MemoryStore(self.dir_)
+
+    def tearDown(self):
+        self.node.shutdown()
+        shutil.rmtree(self.base_dir)
+
+    def testPutGet(self):
+        objs = ['1' * 10, '2' * 20, '3' * 30]
+        self.assertEqual(self.node.put(objs[0]), objs[0])
+        self.assertEqual(self.node.put(objs[1:]), objs[1:])
+        self.assertEqual(self.node.stats()['messages'], 3)
+
+        self.assertEqual(self.node.get(), objs[0])
+        self.assertEqual(self.node.get(size=5), objs[1:])
+        self.assertEqual(self.node.get(), None)
+        self.assertEqual(self.node.stats(),
+                         {'messages': 0, 'bytes': 0, 'segments': 0, 'inflight': 0})
+
+        # nothing is written without the snapshot
+        self.node.put(objs)
+        self.node.shutdown()
+        self.assertFalse(os.path.exists(self.dir_))
+
+    def testSnapshot(self):
+        objs = ['1' * 10, '2' * 10, '3' * 10]
+        self.node = MemoryStore(self.dir_, snapshot=True)
+        self.node.put(objs)
+        leased = self.node.get_leased()
+        self.assertEqual(leased[0][1], objs[0])
+        self.node.shutdown()
+
+        # the leased object is saved as well
+        self.node = MemoryStore(self.dir_, snapshot=True)
+        self.assertEqual(self.node.stats()['messages'], 3)
+        self.assertEqual(os.listdir(self.dir_), [])
+        self.assertEqual(self.node.get(size=3), objs)
+
+    def testLease(self):
+        objs = ['1' * 10, '2' * 10, '3' * 10, '4' * 10]
+        self.node.put(objs)
+
+        leased = self.node.get_leased(size=3)
+        self.assertEqual([obj for _, obj in leased], objs[:3])
+        self.assertEqual(self.node.stats()['inflight'], 3)
+
+        self.assertEqual(self.node.ack(leased[0][0]), 1)
+        self.assertEqual(self.node.ack(leased[0][0]), 0)
+        self.assertEqual(self.node.nack([leased[1][0]]), 1)
+        self.assertEqual(self.node.stats()['inflight'], 1)
+        self.assertEqual(self.node.get(size=2), [objs[1], objs[3]])
+
+        # the expired leases are put back
+        self.node.put(objs[:2])
+        leased = self.node.get_leased(size=2, timeout=0)
+        self.assertEqual(self.node.get(size=2), objs[:2])
+        self.assertEqual(self.node.ack([lease_id for lease_id, _ in leased]), 0)
+
+        # the renewed leases are not put back
+        self.node.put(objs[:2])
+        leased = self.node.get_leased(size=2, timeout=0)
+        self.assertEqual(self.node.renew([leased[0][0]], timeout=60), 1)
+        self.assertEqual(self.node.get(size=2), objs[1:2])
+        self.assertEqual(self.node.ack([leased[0][0]]), 1)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,132 @@
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-24
+
+@author: chine
+'''
+import unittest
+import tempfile
+import os
+import shutil
+import sys
+
+from cola.core.mq.store import Store
+from cola.core.mq.scanner import StoreScanner, UndecodableRecord, \
+    find_store_dirs
+from cola.core.unit import Url
+
+
+class Test(unittest.TestCase):
+
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.dir_ = os.path.join(self.base_dir, 'store', '0')
+        
+        self.objs = [Url('http://qinxuye.me/%s' % i, priority=i) for i in range(200)]
+        self.objs.extend('http://WWW.Douban.com/%s' % i for i in range(100))
+        # the url with other attributes is pickled
+        url = Url('http://Pickled.org/')
+        url.error_times = 1
+        self.objs.append(url)
+        with Store(self.dir_, 4096, mkdirs=True) as store:
+            store.put(self.objs)
+            store.get(size=50)
+            self.stats = store.stats()
+            
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def testSummarize(self):
+        self.assertEqual(find_store_dirs(self.base_dir), [self.dir_])
+        
+        scanner = StoreScanner(self.dir_, verify=True)
+        self.assertEqual(scanner.count()['messages'], self.stats['messages'])
+        
+        summary = scanner.summarize(n_hosts=1, n_samples=10, seed=1)
+        self.assertEqual(summary['files'], self.stats['segments'])
+        self.assertEqual(summary['messages'], self.stats['messages'])
+        self.assertEqual(summary['bytes'], self.stats['bytes'])
+        self.assertEqual(summary['types'], {'u': 150, 'm': 100, 'p': 1})
+        self.assertEqual(sum(summary['sizes'].values()), 251)
+        self.assertEqual(summary['hosts'], [('qinxuye.me', 150)])
+        self.assertEqual(len(summary['samples']), 10)
+        for sample in summary['samples']:
+            self.assertIn(sample, self.objs[50:])
+        
+        summary = scanner.summarize(n_hosts=3, n_samples=0, decode=True)
+        self.assertEqual(summary['hosts'], [('qinxuye.me', 150), ('www.douban.com', 100),
+                                            ('pickled.org', 1)])
+        self.assertEqual(summary['samples'], [])
+        
+        # the files are never changed
+        self.assertEqual(len(list(scanner.iter_records())), 251)
+        with Store(self.dir_, 4096) as store:
+            self.assertEqual(store.stats(), self.stats)
+        
+    def testBroken(self):
+        file_path = os.path.join(self.dir_, str(sys.maxint))
+        with open(file_path, 'r+') as f:
+            f.seek(-100, os.SEEK_END)
+            content = f.read()
+        pos = os.path.getsize(file_path) - 100 + content.rindex('qinxuye')
+        with open(file_path, 'r+') as f:
+            f.seek(pos)
+            f.write('x')
+            
+        self.assertEqual(StoreScanner(self.dir_).summarize()['broken'], [])
+        summary = StoreScanner(self.dir_, verify=True).summarize()
+        self.assertEqual(summary['broken'], [file_path])
+        
+    def testUndecodable(self):
+        # the bundles of a module which cannot be imported when scanned
+        mod_dir = os.path.join(self.base_dir, 'mod')
+        os.mkdir(mod_dir)
+        with open(os.path.join(mod_dir, 'cola_scanner_mod.py'), 'w') as f:
+            f.write('from cola.core.unit import Bundle\n'
+                    'class MyBundle(Bundle):\n'
+                    '    pass\n')
+        dir_ = os.path.join(self.base_dir, 'store', '1')
+        sys.path.insert(0, mod_dir)
+        try:
+            import cola_scanner_mod
+            bundles = [cola_scanner_mod.MyBundle('user%s' % i) for i in range(3)]
+            with Store(dir_, 4096, mkdirs=True) as store:
+                store.put(bundles + ['http://qinxuye.me/'])
+        finally:
+            sys.path.remove(mod_dir)
+            del sys.modules['cola_scanner_mod']
+        
+        scanner = StoreScanner(dir_)
+        summary = scanner.summarize(n_hosts=1, n_samples=4, decode=True)
+        self.assertEqual(summary['messages'], 4)
+        self.assertEqual(summary['hosts'], [('qinxuye.me', 1)])
+        self.assertEqual(summary['undecodable'], 3)
+        undecodables = [sample for sample in summary['samples'] \
+                        if isinstance(sample, UndecodableRecord)]
+        self.assertEqual(len(undecodables), 3)
+        self.assertEqual(undecodables[0].type, 'p')
+        self.assertIn('ImportError', undecodables[0].error)
+        self.assertIn('undecodable', repr(undecodables[0]))
+        
+        for m, start, end in scanner.iter_records():
+            self.assertIsInstance(scanner.decode(m, start, end), UndecodableRecord)
+            self.assertIsNone(scanner.host(m, start, end, decode=True))
+            break
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
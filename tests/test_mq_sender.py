@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-30
+
+@author: chine
+'''
+
+import unittest
+import threading
+import time
+
+from cola.core.mq.sender import BatchSender
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.backups = []
+        self.failing = False
+        self.delay = 0
+        self.sent = None
+        self.senders = []
+
+    def tearDown(self):
+        for sender in self.senders:
+            sender.stop(timeout=5)
+
+    def send(self, objs):
+        time.sleep(self.delay)
+        if self.sent is not None:
+            self.sent.wait()
+        if self.failing:
+            raise IOError('node unreachable')
+        self.batches.append(list(objs))
+
+    def send_backup(self, backup_addr, objs):
+        self.backups.append((backup_addr, list(objs)))
+
+    def create(self, **kw):
+        sender = BatchSender(self.send, self.send_backup, **kw)
+        self.senders.append(sender)
+        return sender
+
+    def testCount(self):
+        sender = self.create(max_count=10, linger=60)
+        sender.put([str(i) for i in range(25)])
+        time.sleep(.2)
+        self.assertEqual([len(batch) for batch in self.batches], [10, 10])
+        self.assertEqual(len(sender), 5)
+
+        self.assertTrue(sender.flush())
+        self.assertEqual(sum(self.batches, []), [str(i) for i in range(25)])
+        self.assertEqual(len(sender), 0)
+
+    def testSize(self):
+        sender = self.create(max_count=100, max_bytes=100, linger=60)
+        sender.put(['a' * 30 for _ in range(10)])
+        time.sleep(.2)
+        self.assertEqual([len(batch) for batch in self.batches], [3, 3, 3])
+
+    def testLinger(self):
+        sender = self.create(max_count=100, linger=.1)
+        # the sending thread is waiting since nothing pending
+        time.sleep(.1)
+        sender.put(['a', 'b'])
+        sender.put(['c'], backup_addr='192.168.0.1:11203')
+        self.assertEqual(len(self.batches), 0)
+        time.sleep(.5)
+        self.assertEqual(self.batches, [['a', 'b']])
+        self.assertEqual(self.backups, [('192.168.0.1:11203', ['c'])])
+
+    def testBackpressure(self):
+        self.delay = .2
+        sender = self.create(max_count=5, linger=0, buffer_size=10)
+        def put():
+            for i in range(0, 20, 5):
+                sender.put([str(j) for j in range(i, i+5)])
+        t = threading.Thread(target=put)
+        t.start()
+        t.join(.1)
+        # blocked since the buffer is full
+        self.assertTrue(t.is_alive())
+        t.join(5)
+        self.assertFalse(t.is_alive())
+
+        sender.put(['20'], block=False)
+        self.assertTrue(sender.flush())
+        self.assertEqual(sum(self.batches, []), [str(i) for i in range(21)])
+        
+    def testTimeout(self):
+        self.sent = threading.Event()
+        sender = self.create(max_count=5, linger=0, buffer_size=5)
+        self.assertTrue(sender.put([str(i) for i in range(5)], timeout=.1))
+        self.assertTrue(sender.put([str(i) for i in range(5, 10)], timeout=.1))
+        # the buffer keeps full since the first batch is not sent
+        self.assertFalse(sender.put(['10'], timeout=.1))
+        self.assertEqual(len(sender), 10)
+        
+        self.sent.set()
+        self.assertTrue(sender.flush())
+        self.assertEqual(sum(self.batches, []), [str(i) for i in range(10)])
+        
+    def testStopWhileSending(self):
+        self.sent = threading.Event()
+        sender = self.create(max_count=2, linger=0)
+        sender.put(['a', 'b', 'c'])
+        time.sleep(.1)
+        # the batch being sent is kept when the stop timed out
+        sender.stop(timeout=.1)
+        self.assertEqual(len(sender), 3)
+        self.assertEqual(sender.pending(), (['a', 'b', 'c'], {}))
+        self.sent.set()
+
+    def testFailure(self):
+        self.failing = True
+        sender = self.create(max_count=100, linger=60)
+        sender.put(['a', 'b'])
+        sender.put(['c'], backup_addr='192.168.0.1:11203')
+        self.assertFalse(sender.flush())
+        # the backups are sent, the others are kept in order
+        self.assertEqual(self.backups, [('192.168.0.1:11203', ['c'])])
+        self.assertEqual(len(sender), 2)
+
+        sender.stop()
+        self.assertEqual(sender.pending(), (['a', 'b'], {}))
+
+        self.failing = False
+        sender = self.create(max_count=100, linger=60)
+        sender.put(['a', 'b'])
+        sender.put(['c'], backup_addr='192.168.0.2:11203')
+        sender.discard_backups('192.168.0.2:11203')
+        sender.stop()
+        self.assertEqual(self.batches, [['a', 'b']])
+        self.assertEqual(sender.pending(), ([], {}))
+
+    def testAsync(self):
+        self.sent = threading.Event()
+        objs = ['http://www.example.com/%s' % i for i in range(5000)]
+
+        # the puts return though no batch is sent
+        sender = self.create()
+        for i in range(0, len(objs), 10):
+            sender.put(objs[i:i+10])
+        self.assertEqual(len(self.batches), 0)
+        
+        self.sent.set()
+        self.assertTrue(sender.flush())
+        self.assertEqual(sum(self.batches, []), objs)
+        self.assertLess(len(self.batches), len(objs) / 10)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,134 @@
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-20
+
+@author: chine
+'''
+import unittest
+import tempfile
+import shutil
+import sqlite3
+
+from cola.core.mq.sqlite_store import SqliteStore
+
+
+class Test(unittest.TestCase):
+
+
+    def setUp(self):
+        self.dir_ = tempfile.mkdtemp()
+        self.node = SqliteStore(self.dir_)
+
+    def tearDown(self):
+        self.node.shutdown()
+        shutil.rmtree(self.dir_)
+
+    def testPutGet(self):
+        objs = ['1' * 10, '2' * 20, '3' * 30]
+        self.assertEqual(self.node.put(objs[0]), objs[0])
+        self.assertEqual(self.node.put(objs[1:]), objs[1:])
+
+        self.assertEqual(self.node.peek(size=2), objs[:2])
+        self.assertEqual(self.node.get(), objs[0])
+        self.assertEqual(self.node.get(size=5), objs[1:])
+        self.assertEqual(self.node.get(), None)
+        self.assertEqual(self.node.get(size=2), [])
+
+    def testPutCloseGet(self):
+        self.node.put(['1' * 10, '2' * 10])
+        self.assertEqual(self.node.get(), '1' * 10)
+        self.node.shutdown()
+
+        self.node = SqliteStore(self.dir_)
+        self.assertEqual(self.node.stats(),
+                         {'messages': 1, 'bytes': 16, 'segments': 1, 'inflight': 0})
+        self.assertEqual(self.node.get(), '2' * 10)
+
+    def testFlushEvery(self):
+        self.node.shutdown()
+
+        self.node = SqliteStore(self.dir_, flush_every=3)
+        self.node.put(['1', '2'])
+        self.assertEqual(self.node.unsynced, 2)
+        # committed at once, though not synced yet
+        conn = sqlite3.connect(self.node.db_file)
+        self.assertEqual(conn.execute('SELECT count(*) FROM queue').fetchone(), (2, ))
+        conn.close()
+        self.node.put('3')
+        self.assertEqual(self.node.unsynced, 0)
+
+        self.assertEqual(self.node.get(), '1')
+        self.assertEqual(self.node.unsynced, 1)
+        self.node.flush()
+        self.assertEqual(self.node.unsynced, 0)
+
+    def testSynchronous(self):
+        synchronous = lambda node: node.conn.execute(
+            'PRAGMA synchronous').fetchone()[0]
+        self.node.init()
+        self.assertEqual(synchronous(self.node), 2) # FULL
+        self.node.shutdown()
+
+        self.node = SqliteStore(self.dir_, flush_every=0, durability='interval_ms')
+        self.node.init()
+        self.assertEqual(synchronous(self.node), 1) # NORMAL
+        self.node.shutdown()
+
+        self.node = SqliteStore(self.dir_, flush_every=0, durability='os')
+        self.node.put('1')
+        self.assertEqual(synchronous(self.node), 0) # OFF
+
+    def testLease(self):
+        objs = ['1' * 10, '2' * 10, '3' * 10, '4' * 10]
+        self.node.put(objs)
+
+        leased = self.node.get_leased(size=3)
+        self.assertEqual([obj for _, obj in leased], objs[:3])
+        self.assertEqual(self.node.stats()['messages'], 1)
+        self.assertEqual(self.node.stats()['inflight'], 3)
+
+        self.assertEqual(self.node.ack(leased[0][0]), 1)
+        self.assertEqual(self.node.ack(leased[0][0]), 0)
+        # the object put back keeps its position
+        self.assertEqual(self.node.nack([leased[1][0]]), 1)
+        self.assertEqual(self.node.stats()['inflight'], 1)
+        self.assertEqual(self.node.peek(), [objs[1]])
+        self.assertEqual(self.node.get(size=2), [objs[1], objs[3]])
+
+        # the leases are kept after restarted
+        self.node.shutdown()
+        self.node = SqliteStore(self.dir_)
+        self.assertEqual(self.node.stats()['inflight'], 1)
+        self.assertEqual(self.node.get(), None)
+        self.assertEqual(self.node.ack([leased[2][0]]), 1)
+        self.assertEqual(self.node.stats()['inflight'], 0)
+
+        # the expired leases are put back
+        self.node.put(objs[:2])
+        leased = self.node.get_leased(size=2, timeout=0)
+        self.assertEqual(self.node.get(size=2), objs[:2])
+        self.assertEqual(self.node.ack([lease_id for lease_id, _ in leased]), 0)
+
+        # the renewed leases are not put back
+        self.node.put(objs[:2])
+        leased = self.node.get_leased(size=2, timeout=0)
+        self.assertEqual(self.node.renew([leased[0][0]], timeout=60), 1)
+        self.assertEqual(self.node.get(size=2), objs[1:2])
+        self.assertEqual(self.node.ack([leased[0][0]]), 1)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -22,8 +22,12 @@ import tempfile
 import os
 import random
 import shutil
+import struct
+import sys
+import time
 
-from cola.core.mq.store import Store, StoreNoSpaceForPut
+from cola.core.mq.store import Store, StoreNoSpaceForPut, StoreNotSafetyShutdown, \
+    HEADER_SIZE, SYNCED_POS, WARM_FILE_SUFFIX, MIGRATE_FILE_SUFFIX
 
 
 class Test(unittest.TestCase):
@@ -54,8 +58,8 @@ class Test(unittest.TestCase):
     def testBatchPutGet(self):
         self.node.shutdown()
            
-        size = 60
-        # '1'*20 will spend 30 bytes in `mq store`
+        size = 68
+        # '1'*20 will spend 34 bytes in `mq store`
         batch1 = ['1' * 20, '2' * 20]
         batch2 = ['3' * 20, '4' * 20]
            
@@ -83,11 +87,213 @@ class Test(unittest.TestCase):
            
         self.assertRaises(StoreNoSpaceForPut, lambda: self.node.put('7' * 100))
         
+    def testBatchCrossBlocks(self):
+        self.node.shutdown()
+        
+        # 2 objects per block
+        self.node = Store(self.dir_, 68)
+        objs = [str(i) * 20 for i in range(1, 6)]
+        self.assertEqual(self.node.put(objs), objs)
+        self.assertEqual(len(self.node.legal_files), 3)
+        
+        self.assertEqual(self.node.get(size=3), objs[:3])
+        self.assertEqual(self.node.get(size=10), objs[3:])
+        self.assertEqual(len(self.node.legal_files), 1)
+        self.assertEqual(self.node.get(size=10), [])
+        
     def testPutCloseGet(self):
         self.node.put('1'*10)
         self.node.shutdown()
         self.node = Store(self.dir_)
         self.assertEqual(self.node.get(), '1'*10)
+        
+    def testMigrate(self):
+        self.node.shutdown()
+        
+        size = 1024
+        objs = ['1' * 10, '2' * 20]
+        # the block format without header
+        content = ''
+        for obj in objs:
+            obj_str = self.node._stringfy(obj)
+            content += struct.pack('I', len(obj_str)) + obj_str
+        with open(os.path.join(self.dir_, str(sys.maxint)), 'w') as f:
+            f.write(content + '\x00' * (size - len(content)))
+            
+        self.node = Store(self.dir_, size)
+        self.assertEqual(self.node.get(size=2), objs)
+        self.assertEqual(self.node.get(), None)
+        
+        self.node.put('3' * 10)
+        self.assertEqual(self.node.get(), '3' * 10)
+        self.node.shutdown()
+        
+        # the unknown version is not converted
+        with open(os.path.join(self.dir_, str(sys.maxint)), 'r+') as f:
+            f.write('CLMQ\x09')
+        self.node = Store(self.dir_, size)
+        self.assertRaises(StoreNotSafetyShutdown, self.node.init)
+        
+    def testRecover(self):
+        self.node.shutdown()
+        
+        size = 1024
+        objs = ['1' * 10, '2' * 10, '3' * 10]
+        self.node = Store(self.dir_, size)
+        self.node.put(objs)
+        self.node.shutdown()
+        
+        # break the last record, and pretend that nothing has been flushed
+        file_path = os.path.join(self.dir_, str(sys.maxint))
+        with open(file_path, 'r+') as f:
+            f.seek(8)
+            _, write_pos = struct.unpack('II', f.read(8))
+            f.seek(SYNCED_POS)
+            f.write(struct.pack('II', HEADER_SIZE, 0))
+            f.seek(write_pos - 1)
+            f.write('x')
+        # the unfinished files
+        open(file_path + MIGRATE_FILE_SUFFIX, 'w').close()
+        open(os.path.join(self.dir_, 'unknown'), 'w').close()
+        
+        self.node = Store(self.dir_, size)
+        self.assertEqual(self.node.stats()['messages'], 2)
+        self.assertEqual(self.node.get(size=3), objs[:2])
+        self.assertEqual(self.node.get(), None)
+        self.assertFalse(os.path.exists(file_path + MIGRATE_FILE_SUFFIX))
+        
+        self.node.put('4' * 10)
+        self.assertEqual(self.node.get(), '4' * 10)
+        
+    def testFlushEvery(self):
+        self.node.shutdown()
+        
+        self.node = Store(self.dir_, flush_every=3)
+        self.node.put(['1', '2'])
+        self.assertEqual(self.node.uncommitted, 2)
+        self.node.put('3')
+        self.assertEqual(self.node.uncommitted, 0)
+        
+        self.assertEqual(self.node.get(), '1')
+        self.assertEqual(self.node.uncommitted, 1)
+        self.node.flush()
+        self.assertEqual(self.node.uncommitted, 0)
+        
+        self.node.shutdown()
+        self.node = Store(self.dir_, flush_every=0)
+        self.assertEqual(self.node.get(size=2), ['2', '3'])
+        self.assertEqual(self.node.uncommitted, 2)
+
+    def testWarmFiles(self):
+        self.node.shutdown()
+
+        size = 68
+        self.node = Store(self.dir_, size, warm_files=1)
+        objs = [str(i) * 20 for i in range(1, 6)]
+        self.assertEqual(self.node.put(objs), objs)
+        self.assertEqual(len(self.node.legal_files), 3)
+        for file_path in self.node.legal_files:
+            self.assertEqual(os.path.getsize(file_path), HEADER_SIZE + size)
+
+        # wait for the warm file prepared
+        for _ in range(100):
+            if len(self.node.warm_pool) > 0: break
+            time.sleep(.01)
+        self.assertEqual(len(self.node.warm_pool), 1)
+        self.assertTrue(os.path.exists(self.node.warm_pool[0]))
+
+        self.assertEqual(self.node.get(size=5), objs)
+        self.node.shutdown()
+        self.assertEqual(os.listdir(self.dir_), [str(sys.maxint-2)])
+
+        # the warm files left last time are removed
+        open(os.path.join(self.dir_, '1' + WARM_FILE_SUFFIX), 'w').close()
+        self.node = Store(self.dir_, size)
+        self.node.init()
+        self.assertEqual(os.listdir(self.dir_), [str(sys.maxint-2)])
+
+    def testStats(self):
+        self.node.shutdown()
+        
+        size = 68
+        self.node = Store(self.dir_, size)
+        self.assertEqual(self.node.stats(), 
+                         {'messages': 0, 'bytes': 0, 'segments': 0, 'inflight': 0})
+        objs = [str(i) * 20 for i in range(1, 6)]
+        self.node.put(objs)
+        self.assertEqual(self.node.stats(), 
+                         {'messages': 5, 'bytes': 5 * 34, 'segments': 3, 'inflight': 0})
+        self.assertEqual(self.node.get(size=3), objs[:3])
+        self.assertEqual(self.node.stats(), 
+                         {'messages': 2, 'bytes': 2 * 34, 'segments': 2, 'inflight': 0})
+        
+        # the statistics are restored from the headers
+        self.node.shutdown()
+        self.node = Store(self.dir_, size)
+        self.assertEqual(self.node.stats(), 
+                         {'messages': 2, 'bytes': 2 * 34, 'segments': 2, 'inflight': 0})
+        self.assertEqual(self.node.get(size=3), objs[3:])
+        self.assertEqual(self.node.stats(), 
+                         {'messages': 0, 'bytes': 0, 'segments': 1, 'inflight': 0})
+        
+    def testLease(self):
+        objs = ['1' * 10, '2' * 10, '3' * 10, '4' * 10]
+        self.node.put(objs)
+        
+        leased = self.node.get_leased(size=3)
+        self.assertEqual([obj for _, obj in leased], objs[:3])
+        self.assertEqual(self.node.stats()['messages'], 1)
+        self.assertEqual(self.node.stats()['inflight'], 3)
+        
+        self.assertEqual(self.node.ack(leased[0][0]), 1)
+        self.assertEqual(self.node.ack(leased[0][0]), 0)
+        self.assertEqual(self.node.nack([leased[1][0]]), 1)
+        self.assertEqual(self.node.stats()['inflight'], 1)
+        self.assertEqual(self.node.get(size=2), [objs[3], objs[1]])
+        
+        # the leases are restored after restarted
+        self.node.shutdown()
+        self.node = Store(self.dir_)
+        self.assertEqual(self.node.stats()['inflight'], 1)
+        self.assertEqual(self.node.get(), None)
+        self.assertEqual(self.node.ack([leased[2][0]]), 1)
+        self.assertEqual(self.node.stats()['inflight'], 0)
+        self.assertEqual(os.path.getsize(self.node.inflight_file), 0)
+        
+        # the expired leases are put back
+        self.node.put(objs[:2])
+        leased = self.node.get_leased(size=2, timeout=0)
+        self.assertEqual(self.node.get(size=2), objs[:2])
+        self.assertEqual(self.node.ack([lease_id for lease_id, _ in leased]), 0)
+        
+        # the renewed leases are not put back
+        self.node.put(objs[:2])
+        leased = self.node.get_leased(size=2, timeout=0)
+        self.assertEqual(self.node.renew([leased[0][0]], timeout=60), 1)
+        self.assertEqual(self.node.get(size=2), objs[1:2])
+        self.node.shutdown()
+        self.node = Store(self.dir_)
+        self.assertEqual(self.node.get(), None)
+        self.assertEqual(self.node.ack([leased[0][0]]), 1)
+        
+    def testWriteCursor(self):
+        # the write cursor is kept in the memory and the block header,
+        # so the puts never walk the records from the head of the block
+        objs = ['http://qinxuye.me/%s' % i for i in xrange(1000)]
+        for obj in objs:
+            self.node.put_one(obj, commit=False)
+        self.assertEqual(len(self.node.legal_files), 1)
+        
+        size = sum(len(self.node._pack_record(self.node._stringfy(obj))) \
+                   for obj in objs)
+        self.assertEqual(self.node.write_pos, HEADER_SIZE + size)
+        
+        self.node.shutdown()
+        self.node = Store(self.dir_)
+        self.node.init()
+        self.assertEqual(self.node.write_pos, HEADER_SIZE + size)
+        self.node.put_one('end')
+        self.assertEqual(self.node.get(size=1001), objs + ['end'])
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
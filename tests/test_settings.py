@@ -25,6 +25,7 @@ except ImportError:
 
 from cola.core.config import Config
 from cola.settings import Settings
+from cola.core.urls import UrlCanonicalizer
 
 class Test(unittest.TestCase):
 
@@ -39,6 +40,21 @@ class Test(unittest.TestCase):
         self.assertEqual(settings.name, 'cola-unittest')
         self.assertEqual(settings.description, 'This is a just unittest')
         self.assertEqual(settings.job.db, 'cola')
+        
+    def testCanonicalize(self):
+        user_conf = Config(StringIO('job:\n'
+                                    '  canonicalize:\n'
+                                    '    enable: yes\n'
+                                    '    drop_params: [utm_*, sid]'))
+        settings = Settings(user_conf=user_conf)
+        canonicalize = settings.job.canonicalize
+        self.assertTrue(canonicalize.enable)
+        self.assertEqual(canonicalize.drop_params, ['utm_*', 'sid'])
+        
+        canonicalizer = UrlCanonicalizer(drop_params=canonicalize.drop_params,
+                                         sort_query=canonicalize.sort_query)
+        self.assertEqual(canonicalizer('http://qinxuye.me/?sid=1&utm_source=x&p=1'),
+                         'http://qinxuye.me/?p=1')
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
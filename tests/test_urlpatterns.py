@@ -20,7 +20,10 @@ Created on 2013-5-29
 import unittest
 
 from cola.core.parsers import Parser
-from cola.core.urls import Url, UrlPatterns
+from cola.core.urls import Url, UrlPatterns, UrlCanonicalizer, \
+    UrlPartitioner, canonicalize_url, get_host, get_registrable_domain
+from cola.core.unit import Url as UrlUnit, Bundle
+from cola.core.mq.distributor import Distributor
 
 class FakeParser(Parser):
     pass
@@ -40,6 +43,75 @@ class Test(unittest.TestCase):
         
         self.assertFalse(Url('^http://zh.wikipedia.org/wiki/[^FILE][^/]+$', None, None).match('http://zh.wikipedia.org/wiki/File:Flag_of_Cross_of_Burgundy.svg'))
 
+    def testCanonicalize(self):
+        self.assertEqual(canonicalize_url('HTTP://Qinxuye.ME:80/blog?b=2&a=1&b=1#top'),
+                         'http://qinxuye.me/blog?a=1&b=2&b=1')
+        self.assertEqual(canonicalize_url('https://qinxuye.me:443'), 'https://qinxuye.me/')
+        self.assertEqual(canonicalize_url('http://[::1]:8000/?b&a'), 'http://[::1]:8000/?a&b')
+        self.assertEqual(canonicalize_url('mailto:qin@qinxuye.me'), 'mailto:qin@qinxuye.me')
+        
+        url_patterns = UrlPatterns(
+            Url(r'^http://qinxuye.me/blog.*', 'blog', FakeParser, drop_params=['from']),
+            Url(r'^http://qinxuye.me/.*', 'other', FakeParser)
+        )
+        self.assertEqual(url_patterns.url_patterns[0].options, {})
+        canonicalizer = UrlCanonicalizer(url_patterns, drop_params=['utm_*'])
+        self.assertEqual(canonicalizer('http://qinxuye.me/blog?utm_source=x&from=a&p=1'),
+                         'http://qinxuye.me/blog?p=1')
+        self.assertEqual(canonicalizer('http://qinxuye.me/about?utm_source=x&from=a'),
+                         'http://qinxuye.me/about?from=a')
+        
+        url = UrlUnit('http://QINXUYE.me/blog?p=1#comments')
+        self.assertIs(canonicalizer(url), url)
+        self.assertEqual(url.url, 'http://qinxuye.me/blog?p=1')
+        self.assertIs(url.item, url.url)
+        
+        # the variants are distributed to the same node
+        distributor = Distributor(['localhost:%s' % i for i in range(5)], 
+                                  copies=0, canonicalizer=canonicalizer)
+        node_objs, _ = distributor.distribute(
+            ['http://qinxuye.me/blog?p=1&q=2', 'http://qinxuye.me/blog?q=2&p=1#top', 
+             'http://QinXuye.me:80/blog?from=a&p=1&q=2'])
+        self.assertEqual(node_objs.values(), [['http://qinxuye.me/blog?p=1&q=2'] * 3])
+        
+    def testPartition(self):
+        self.assertEqual(get_host('http://user@WWW.Qinxuye.me:8000/blog'), 'www.qinxuye.me')
+        self.assertEqual(get_host('http://[::1]:8000/'), '[::1]')
+        self.assertIsNone(get_host('mailto:qin@qinxuye.me'))
+        self.assertEqual(get_registrable_domain('www.qinxuye.me'), 'qinxuye.me')
+        self.assertEqual(get_registrable_domain('news.bbc.co.uk'), 'bbc.co.uk')
+        self.assertEqual(get_registrable_domain('www.sina.com.cn'), 'sina.com.cn')
+        self.assertEqual(get_registrable_domain('t.co'), 't.co')
+        self.assertEqual(get_registrable_domain('192.168.0.1'), '192.168.0.1')
+        
+        self.assertRaises(ValueError, lambda: Url(r'.*', 'all', FakeParser, partition='x'))
+        url_patterns = UrlPatterns(
+            Url(r'^http://blog.qinxuye.me/.*', 'blog', FakeParser, partition='host'),
+            Url(r'^http://weibo.com/.*', 'weibo', FakeParser, partition='url'),
+            Url(r'^http://qinxuye.me/(\w+)/.*', 'user', FakeParser, 
+                partition=lambda url: url.split('/')[3])
+        )
+        partitioner = UrlPartitioner(url_patterns)
+        self.assertEqual(partitioner('http://www.qinxuye.me/about'), 'qinxuye.me')
+        self.assertEqual(partitioner(UrlUnit('http://blog.qinxuye.me/1')), 'blog.qinxuye.me')
+        self.assertIsNone(partitioner('http://weibo.com/1'))
+        self.assertEqual(partitioner('http://qinxuye.me/chine/1'), 'chine')
+        self.assertIsNone(partitioner(Bundle('chine')))
+        self.assertFalse(UrlPartitioner(UrlPatterns(), partition='url').has_patterns)
+        
+        # all the urls of a domain are put into the same node
+        distributor = Distributor(['localhost:%s' % i for i in range(5)], 
+                                  copies=1, partitioner=partitioner)
+        urls = ['http://%s.qinxuye.me/%s' % (sub, i) for sub in ('www', 'm') \
+                for i in range(100)]
+        node_objs, backup_node_objs = distributor.distribute(urls)
+        self.assertEqual(node_objs.values(), [urls])
+        self.assertEqual([m.values() for m in backup_node_objs.values()], [[urls]])
+        
+        urls = ['http://weibo.com/%s' % i for i in range(100)]
+        node_objs, _ = distributor.distribute(urls)
+        self.assertGreater(len(node_objs), 1)
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testUrlPatterns']
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Copyright (c) 2013 Qin Xuye <qin@qinxuye.me>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on 2015-7-29
+
+@author: chine
+'''
+
+import unittest
+import tempfile
+import shutil
+
+from cola.settings import Settings
+from cola.functions.counter import CounterServer
+from cola.cluster.weight import WeightCalculator
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_ = tempfile.mkdtemp()
+        self.counter_server = CounterServer(self.dir_, Settings())
+        self.workers = ['192.168.0.1:11203', '192.168.0.2:11203', 
+                        '192.168.0.3:11203']
+        self.calculator = WeightCalculator(self.counter_server, n_instances=2)
+        
+    def tearDown(self):
+        shutil.rmtree(self.dir_)
+        
+    def report(self, ip, instance_id, pages, secs):
+        group = '%s#%s' % (ip, instance_id)
+        self.counter_server.inc(group, 'pages', pages)
+        self.counter_server.inc(group, 'secs', secs)
+
+    def testCalc(self):
+        self.assertIsNone(self.calculator.calc(self.workers))
+        
+        # 2 pages per second for each instance of the first worker,
+        # 1 page per second for the second one, the third is unknown
+        for instance_id in range(2):
+            self.report('192.168.0.1', instance_id, 100, 50)
+            self.report('192.168.0.2', instance_id, 50, 50)
+        weights = self.calculator.calc(self.workers)
+        # 4 : 2 : 3
+        self.assertEqual(weights, {self.workers[0]: 1.33, 
+                                   self.workers[1]: .67, 
+                                   self.workers[2]: 1.0})
+        
+        # not changed enough
+        for instance_id in range(2):
+            self.report('192.168.0.1', instance_id, 100, 50)
+            self.report('192.168.0.2', instance_id, 55, 50)
+        self.assertIsNone(self.calculator.calc(self.workers))
+        self.assertEqual(self.calculator.weights, weights)
+        
+        # the recent rates are averaged with the last ones,
+        # 1.1 and 1.525 pages per second, the third gets 2
+        for instance_id in range(2):
+            self.report('192.168.0.1', instance_id, 10, 50)
+            self.report('192.168.0.2', instance_id, 100, 50)
+            self.report('192.168.0.3', instance_id, 100, 50)
+        weights = self.calculator.calc(self.workers)
+        self.assertEqual(weights, {self.workers[0]: .71, 
+                                   self.workers[1]: .99, 
+                                   self.workers[2]: 1.3})
+        
+        # the rates are kept if no page processed since last time
+        self.assertIsNone(self.calculator.calc(self.workers))
+        self.assertEqual(self.calculator.weights, weights)
+        
+        # only the latest rates are used without the smoothing
+        calculator = WeightCalculator(self.counter_server, n_instances=2, 
+                                      smoothing=1)
+        calculator.calc(self.workers)
+        for instance_id in range(2):
+            self.report('192.168.0.1', instance_id, 100, 50)
+            self.report('192.168.0.2', instance_id, 50, 50)
+            self.report('192.168.0.3', instance_id, 50, 50)
+        self.assertEqual(calculator.calc(self.workers), 
+                         {self.workers[0]: 1.5, 
+                          self.workers[1]: .75, 
+                          self.workers[2]: .75})
+        
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()